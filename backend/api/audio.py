@@ -0,0 +1,70 @@
+import os
+import re
+import asyncio
+from fastapi import APIRouter, Header, HTTPException, Response, status
+from fastapi.responses import FileResponse
+
+from services import file_service, prefetch_service
+
+router = APIRouter()
+
+# <sha256> for an upload as stored, <sha256>-<profile>.<ext> for a transcoded rendition
+_AUDIO_NAME = re.compile(r"(?P<hash>[0-9a-f]{64})(?P<rendition>-[0-9a-f]{8}\.(?P<ext>opus|m4a))?")
+
+_MEDIA_TYPES = {None: "audio/mpeg", "opus": "audio/ogg", "m4a": "audio/mp4"}
+
+_VIDEO_ID = re.compile(r"[0-9A-Za-z_-]{11}")
+
+# Blobs are immutable: the URL names the content, so it can be cached forever
+_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@router.api_route("/audio/{name}", methods=["GET", "HEAD"])
+async def stream_audio(name: str, if_none_match: str | None = Header(default=None)):
+    """
+    Streams an uploaded track (or its rendition) by its SHA-256, with Range
+    support for seeking. The strong ETag is the name itself, so If-Range and
+    If-None-Match work across sessions and restarts.
+    """
+    match = _AUDIO_NAME.fullmatch(name)
+    if not match:
+        raise HTTPException(status_code=404, detail="Audio not found")
+
+    etag = f'"{name}"'
+    headers = {"ETag": etag, "Cache-Control": _CACHE_CONTROL}
+    if if_none_match and (etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    path = file_service.blob_path(match["hash"]) + (match["rendition"] or "")
+    try:
+        stat_result = await asyncio.to_thread(os.stat, path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    # Renditions go with their source, so the source's last use is what counts
+    await file_service.mark_served(match["hash"])
+
+    # FileResponse answers Range requests with 206 and, on servers offering the
+    # ASGI pathsend extension, hands whole-file responses to the server to send
+    return FileResponse(path, media_type=_MEDIA_TYPES[match["ext"]], headers=headers, stat_result=stat_result)
+
+
+@router.api_route("/audio/yt/{video_id}", methods=["GET", "HEAD"])
+async def stream_prefetched_audio(video_id: str):
+    """
+    Streams a YouTube track's audio from the look-ahead cache, with Range
+    support. Only tracks that were prefetched are here; the rest stream from
+    their playback URL as before.
+    """
+    cached = prefetch_service.cached_file(video_id) if _VIDEO_ID.fullmatch(video_id) else None
+    if cached is None:
+        raise HTTPException(status_code=404, detail="Audio not found")
+
+    path, media_type = cached
+    try:
+        stat_result = await asyncio.to_thread(os.stat, path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Audio not found")
+
+    # The file can be evicted later, so clients hold on to it only briefly
+    headers = {"Cache-Control": "private, max-age=3600"}
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result)
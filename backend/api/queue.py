@@ -1,11 +1,18 @@
+import asyncio
+import json
+import logging
+import time
 import uuid
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Header, Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from schemas.queue import QueueItem, QueueList
+from core import metrics
 from core.database import get_db
-from schemas.track import TrackCreate
-from services import queue_service
+from schemas.track import TrackCreate, TrackImport
+from services import queue_service, prefetch_service, url_refresh_service, lifecycle_service
 
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -21,22 +28,70 @@ async def add_track_to_queue(
     Adds a track to a session's queue.
     """
     try:
-        return await queue_service.add_track_to_queue(session_id, str(track_request.source_url), user_id, db)
+        queue_item = await queue_service.add_track_to_queue(session_id, str(track_request.source_url), user_id, db)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    # It may have landed near the head
+    prefetch_service.wake()
+    return queue_item
+
+
+@router.post("/sessions/{session_id}/queue/import")
+async def import_tracks(
+    session_id: uuid.UUID,
+    track_import: TrackImport,
+    user_id: str | None = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Adds many tracks at once from video and playlist URLs, in one transaction
+    with a single queue broadcast. Streams progress as newline-delimited JSON:
+    "expanded" per playlist, "resolving", "resolved" per video, then "done"
+    with the added items (or "error").
+    """
+    if not await queue_service.session_exists(session_id, db):
+        raise HTTPException(status_code=404, detail="Session not found")
+    # Most of an import is spent waiting on YouTube; it takes a connection only when it needs one
+    await db.close()
+
+    async def events():
+        try:
+            async for event in queue_service.import_tracks(
+                session_id, [str(url) for url in track_import.source_urls], user_id, db
+            ):
+                yield json.dumps(event) + "\n"
+        except ValueError as e:
+            yield json.dumps({"event": "error", "detail": str(e)}) + "\n"
+            return
+        prefetch_service.wake()
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
 
 
 @router.get("/sessions/{session_id}/queue", response_model=QueueList)
 async def get_queue(
     session_id: uuid.UUID, 
     user_id: str | None = None,
+    if_none_match: str | None = Header(default=None),
     db: AsyncSession = Depends(get_db)
 ):
     """
-    Retrieves the current queue for a given session, ordered by position.
+    Retrieves the current queue for a given session, ordered by position,
+    along with the queue version it reflects.
+    Answers 304 Not Modified when the client's ETag is still current.
     """
-    queue_items = await queue_service.get_queue(session_id, user_id, db)
-    return {"items": queue_items}
+    version = await queue_service.get_queue_version(session_id, db)
+    etag = queue_service.queue_etag(session_id, version, user_id)
+    # Clients must revalidate every time, but an unchanged queue costs one version lookup
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if if_none_match:
+        client_tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if etag in client_tags or "*" in client_tags:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    queue = await queue_service.get_queue(session_id, user_id, db, version=version)
+    return JSONResponse(queue, headers=headers)
 
 
 @router.post("/sessions/{session_id}/queue/pop", response_model=QueueItem | None)
@@ -47,13 +102,24 @@ async def pop_queue(session_id: uuid.UUID, db: AsyncSession = Depends(get_db)):
     popped_item = await queue_service.pop_next_track(session_id, db)
     if not popped_item:
         raise HTTPException(status_code=404, detail="Queue is empty")
-    return popped_item
+    # A new track moved into the look-ahead
+    prefetch_service.wake()
+    await lifecycle_service.note_popped(popped_item)
+    popped_item = await prefetch_service.local_playback(popped_item)
+    # Never hand the host a stream URL that lapses mid-track
+    return await url_refresh_service.ensure_playable(popped_item)
 
 from fastapi import UploadFile, File, Form
-from services import file_service
+from services import file_service, transcode_service
 import mutagen
 from mutagen.mp3 import MP3
 
+_UPLOAD_BYTES = metrics.Counter("ksunira_upload_bytes_total", "Bytes of audio uploaded")
+_UPLOAD_SECONDS = metrics.Histogram(
+    "ksunira_upload_processing_seconds", "Time to store, hash and read an upload", buckets=metrics.SLOW_BUCKETS
+)
+
+
 @router.post("/sessions/{session_id}/queue/upload", response_model=QueueItem)
 async def upload_track(
     session_id: uuid.UUID,
@@ -65,77 +131,77 @@ async def upload_track(
     if file.content_type not in ["audio/mpeg", "audio/mp3"]:
         raise HTTPException(status_code=400, detail="Invalid file type. Only MP3 files are allowed.")
 
-    # Save file
-    file_path, file_hash = await file_service.save_upload_file(session_id, file)
+    # Makes room by evicting the session's played uploads; an upload may take it over quota once
+    if not await lifecycle_service.enforce_session_quota(session_id, db):
+        raise HTTPException(status_code=status.HTTP_507_INSUFFICIENT_STORAGE, detail="Upload storage is full for this session")
+
+    # Save file (hashed off the event loop, deduplicated against every session's uploads)
+    started = time.perf_counter()
+    file_path, file_hash, created = await file_service.save_upload_file(session_id, file)
+    _UPLOAD_BYTES.inc(file.size or 0)
     
     # Check if a track with this hash already exists in the session
-    # This prevents storing duplicate files
+    # If so, its metadata is already known
     from models import Track
     from sqlalchemy import select
     
     query = select(Track).where(
         Track.session_id == session_id,
         Track.canonical_id == file_hash
-    )
+    ).limit(1)
     result = await db.execute(query)
     existing_track = result.scalar_one_or_none()
     
     if existing_track:
         # Duplicate file found!
-        # Delete the newly uploaded file to save space
-        import os
-        abs_path = file_path.lstrip("/")
-        if os.path.exists(abs_path):
-            os.remove(abs_path)
-            
-        # Use the existing track's path and metadata
+        # Use the existing track's path and metadata. The new path is the same
+        # blob; drop it if this upload is what linked it.
+        if created and existing_track.source_url != file_path:
+            await file_service.release_file(file_path)
         file_path = existing_track.source_url
         title = existing_track.title
         duration = existing_track.duration
-        # We can update title if needed, but let's keep it simple for now
-        # or maybe we want to use the new title?
-        # For now, let's just proceed with adding it to the queue
         # The queue service will handle the "already in queue" check
         
     else:
-        # New file, validate metadata
-        # Get metadata (duration)
-        # We need the absolute path for mutagen
-        # file_path is relative: /static/sessions/...
-        # We assume run from backend root
-        abs_path = file_path.lstrip("/")
-        
-        duration = 0
-        title = file.filename
-        
+        # New file, validate metadata (duration) in a thread; mutagen reads from disk
         try:
-            audio = MP3(abs_path)
-            duration = int(audio.info.length)
-            # Try to get title from tags
-            if audio.tags and 'TIT2' in audio.tags:
-                 title = str(audio.tags['TIT2'])
+            title, duration = await asyncio.to_thread(
+                _read_mp3_metadata, file_service.local_path(file_path), file.filename
+            )
         except Exception as e:
-            print(f"Error reading metadata: {e}")
-            # Delete the invalid file
-            import os
-            if os.path.exists(abs_path):
-                os.remove(abs_path)
+            logger.warning("Error reading metadata: %s", e)
+            # Delete the invalid file, unless it was already there for another track
+            if created:
+                await lifecycle_service.release_upload(session_id, file_path, file_hash, db)
             raise HTTPException(status_code=400, detail="Invalid audio file. Could not read metadata.")
-        
+    _UPLOAD_SECONDS.observe(time.perf_counter() - started)
+
     # Add to queue
     try:
-        return await queue_service.add_file_to_queue(session_id, title, file_path, duration, file_hash, user_id, db)
+        queue_item = await queue_service.add_file_to_queue(session_id, title, file_path, duration, file_hash, user_id, db)
     except ValueError as e:
-        # If it was a new file upload (no existing_track) and adding to queue failed,
-        # we should clean up the uploaded file to prevent orphans.
-        
-        if not existing_track:
-             import os
-             abs_path = file_path.lstrip("/")
-             if os.path.exists(abs_path):
-                os.remove(abs_path)
+        # If this upload linked a new file and adding to queue failed, clean it up
+        # to prevent orphans. A concurrent upload of the same song may have queued
+        # it since (or be waiting in memory to be flushed), so only if unused.
+        if created and not existing_track:
+            await lifecycle_service.release_upload(session_id, file_path, file_hash, db)
         raise HTTPException(status_code=400, detail=str(e))
 
+    # Plays the upload as is until its compact rendition is ready
+    transcode_service.submit(file_hash)
+    return queue_item
+
+
+def _read_mp3_metadata(path: str, default_title: str | None) -> tuple[str | None, int]:
+    """Returns (title, duration in seconds), preferring the ID3 title tag."""
+    audio = MP3(path)
+    title = default_title
+    # Try to get title from tags
+    if audio.tags and 'TIT2' in audio.tags:
+        title = str(audio.tags['TIT2'])
+    return title, int(audio.info.length)
+
 
 @router.post("/sessions/{session_id}/queue/{queue_item_id}/vote", response_model=QueueItem)
 async def vote_on_track(
@@ -10,5 +10,16 @@ async def search_youtube(q: str = Query(..., description="Search query")):
     Search YouTube for videos.
     Returns a list of search results with metadata.
     """
-    results = yt_service.search_youtube(q, max_results=10)
+    results = await yt_service.search_youtube(q, max_results=10)
     return {"results": results}
+
+
+@router.get("/search/stats")
+async def search_cache_stats():
+    """
+    Hit/miss counters for the YouTube search and track info caches.
+    """
+    return {
+        "search": yt_service.search_cache_stats(),
+        "track_info": yt_service.cache_stats(),
+    }
@@ -5,6 +5,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from models.session import Session as SessionModel
 from schemas.session import Session as SessionSchema, SessionCreate
 from core.database import get_db
+from services import lifecycle_service
 
 router = APIRouter()
 
@@ -47,12 +48,8 @@ async def delete_session(session_id: uuid.UUID, db: AsyncSession = Depends(get_d
     # Delete from DB (cascades to tracks and queue)
     await db.delete(session)
     await db.commit()
-    
-    # Delete static files
-    import shutil
-    import os
-    session_dir = os.path.join("static", "sessions", str(session_id))
-    if os.path.exists(session_dir):
-        shutil.rmtree(session_dir)
+
+    # Drop what's held in memory, and delete static files and the stored blobs no other session shares
+    await lifecycle_service.release_session(session_id)
         
     return None
@@ -0,0 +1,66 @@
+from fastapi import APIRouter
+
+from core.database import engine
+from core.db_metrics import db_stats
+from services import file_service, lifecycle_service, playback_service, prefetch_service, transcode_service, url_refresh_service
+
+router = APIRouter()
+
+
+@router.get("/stats/db")
+async def database_stats():
+    """
+    Per-route query counts and DB time, slow statements, suspected N+1
+    patterns and connection pool usage.
+    """
+    return db_stats(engine)
+
+
+@router.get("/stats/storage")
+async def storage_stats():
+    """
+    Size of the upload blob store and how many session files share its blobs.
+    """
+    return await file_service.blob_stats()
+
+
+@router.get("/stats/transcode")
+async def transcode_stats():
+    """
+    Transcoding job counts, sizes and per-job wait and run times.
+    """
+    return transcode_service.transcode_stats()
+
+
+@router.get("/stats/prefetch")
+async def prefetch_stats():
+    """
+    Look-ahead audio cache: size, downloads, evictions and how many popped
+    YouTube tracks it could serve.
+    """
+    return prefetch_service.prefetch_stats()
+
+
+@router.get("/stats/url-refresh")
+async def url_refresh_stats():
+    """
+    Stream URLs refreshed ahead of expiry or at pop, and upcoming-track probes.
+    """
+    return url_refresh_service.refresh_stats()
+
+
+@router.get("/stats/lifecycle")
+async def lifecycle_stats():
+    """
+    Expired sessions, evicted files and how full the upload store is.
+    """
+    return lifecycle_service.lifecycle_stats()
+
+
+@router.get("/stats/playback")
+async def playback_stats():
+    """
+    Sessions with held playback state, coalesced progress reports and
+    snapshots sent to joining clients.
+    """
+    return playback_service.playback_stats()
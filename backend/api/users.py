@@ -6,6 +6,7 @@ from sqlalchemy import select
 from models.user import User as UserModel
 from schemas.user import User as UserSchema, UserCreate
 from core.database import get_db
+from services import session_state
 
 router = APIRouter()
 
@@ -29,6 +30,7 @@ async def join_session(
     db.add(new_user)
     await db.commit()
     await db.refresh(new_user)
+    session_state.add_user(session_id, new_user.id, new_user.nickname)
     
     # Convert to dict and stringify UUIDs
     return UserSchema(
@@ -1,29 +1,29 @@
+import logging
 import uuid
 import json
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
 from core.websocket_manager import manager
-from core.database import get_db
+from core.database import AsyncSessionLocal
 
-from models import Session
-from services import queue_service
+from services import playback_service, queue_service
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
 @router.websocket("/ws/session/{session_id}")
-async def websocket_endpoint(
-    websocket: WebSocket,
-    session_id: uuid.UUID,
-    db: AsyncSession = Depends(get_db)
-):
-    session = await db.get(Session, session_id)
-    if not session:
+async def websocket_endpoint(websocket: WebSocket, session_id: uuid.UUID):
+    # Sockets sit idle most of the time, so none of them holds a DB connection;
+    # the messages that need one borrow it from the pool just for themselves
+    if not await queue_service.session_exists_cached(session_id):
         await websocket.close(code=1008)  # Policy Violation
         return
 
     await manager.connect(websocket, session_id)
+    # Late joiners see what's playing right away instead of asking the host
+    playback_service.send_snapshot(websocket, session_id)
     try:
         while True:
             data = await websocket.receive_text()
@@ -35,24 +35,44 @@ async def websocket_endpoint(
                 if msg_type == "add_track":
                     url = payload.get("url")
                     if url:
-                        await queue_service.add_track_to_queue(session_id, url, db)
+                        # Resolve first, so the connection is only borrowed for the insert
+                        track_info = await queue_service.resolve_youtube_track(url)
+                        async with AsyncSessionLocal() as db:
+                            await queue_service.add_resolved_track_to_queue(
+                                session_id, url, track_info, payload.get("user_id"), db
+                            )
                 
                 elif msg_type == "vote_track":
                     track_id = payload.get("track_id")
                     vote = payload.get("vote", 0)
                     user_id = payload.get("user_id")
                     if track_id and user_id:
-                        await queue_service.vote_track(session_id, uuid.UUID(track_id), vote, user_id, db)
+                        async with AsyncSessionLocal() as db:
+                            await queue_service.vote_track(session_id, uuid.UUID(track_id), vote, user_id, db)
+
+                elif msg_type == "track_progress":
+                    if playback_service.relay_progress(session_id, payload):
+                        await manager.broadcast(message, session_id)
 
-                elif msg_type in ["skip", "pause", "resume", "seek", "volume_change", "track_started", "track_progress", "clear_player", "request_state", "state_update"]:
+                elif msg_type == "request_state":
+                    # Answered from the state held here; only the host knows it until a track
+                    # has been reported here, e.g. on a worker that started mid-track
+                    if not playback_service.send_snapshot(websocket, session_id):
+                        playback_service.request_relayed()
+                        await manager.broadcast(message, session_id)
+
+                elif msg_type in ["skip", "pause", "resume", "seek", "volume_change", "track_started", "clear_player", "state_update"]:
                     # Relay control events to all clients
-                    print(f"Broadcasting message: {msg_type}")
+                    logger.debug("Broadcasting message: %s", msg_type)
                     await manager.broadcast(message, session_id)
 
             except json.JSONDecodeError:
                 pass
             except Exception as e:
-                print(f"Error handling WS message: {e}")
+                logger.warning("Error handling WS message: %s", e, extra={"session_id": str(session_id)})
 
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket, session_id)
+
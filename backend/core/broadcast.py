@@ -0,0 +1,162 @@
+import abc
+import asyncio
+import base64
+import logging
+import uuid
+import zlib
+from collections import deque
+from typing import Callable
+
+import asyncpg
+from sqlalchemy.engine import make_url
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# deliver(session_id, message type, serialized frame) fans a frame out to local sockets
+Deliver = Callable[[uuid.UUID, str | None, str], None]
+
+
+class BroadcastBackend(abc.ABC):
+    """Carries published session messages to the ConnectionManager of every worker."""
+
+    def __init__(self, deliver: Deliver):
+        self.deliver = deliver
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    @abc.abstractmethod
+    async def publish(self, session_id: uuid.UUID, msg_type: str | None, frame: str):
+        ...
+
+
+class MemoryBackend(BroadcastBackend):
+    """Single-process backend: publishing is just local delivery."""
+
+    async def publish(self, session_id: uuid.UUID, msg_type: str | None, frame: str):
+        self.deliver(session_id, msg_type, frame)
+
+
+class PostgresBackend(BroadcastBackend):
+    """
+    Fans messages out across processes and hosts with Postgres LISTEN/NOTIFY.
+    Every worker, including the publisher, receives each notification and
+    delivers it to its own sockets.
+    """
+
+    CHANNEL = "ksunira_broadcast"
+    # NOTIFY payloads must stay under 8000 bytes
+    MAX_PAYLOAD = 7900
+
+    def __init__(self, deliver: Deliver):
+        super().__init__(deliver)
+        self._dsn = make_url(settings.DATABASE_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+        self._listen_conn: asyncpg.Connection | None = None
+        self._publish_conn: asyncpg.Connection | None = None
+        # Payloads waiting to be sent; failed batches go back to the front
+        self._outbox: deque[str] = deque()
+        self._outbox_ready = asyncio.Event()
+        self._dropped = 0
+        self._publisher: asyncio.Task | None = None
+        self._seq = 0
+        self._stopping = False
+
+    async def start(self):
+        await self._listen()
+        self._publisher = asyncio.create_task(self._publish_loop())
+
+    async def stop(self):
+        self._stopping = True
+        if self._publisher:
+            self._publisher.cancel()
+            await asyncio.gather(self._publisher, return_exceptions=True)
+        for conn in (self._listen_conn, self._publish_conn):
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+
+    async def publish(self, session_id: uuid.UUID, msg_type: str | None, frame: str):
+        self._seq += 1
+        # The sequence number keeps Postgres from collapsing identical payloads
+        header = f"{self._seq}\t{session_id}\t{msg_type or ''}\t"
+        payload = header + "j" + frame
+        if len(payload.encode()) > self.MAX_PAYLOAD:
+            payload = header + "z" + base64.b64encode(zlib.compress(frame.encode())).decode()
+            if len(payload) > self.MAX_PAYLOAD:
+                logger.warning("Broadcast for session %s too large for NOTIFY, dropping", session_id)
+                return
+        self._outbox.append(payload)
+        self._trim_outbox()
+        self._outbox_ready.set()
+
+    def _trim_outbox(self):
+        """Drops the oldest payloads while Postgres is unreachable, so the outbox stays bounded."""
+        overflow = len(self._outbox) - settings.BROADCAST_OUTBOX_MAX
+        if overflow > 0:
+            for _ in range(overflow):
+                self._outbox.popleft()
+            self._dropped += overflow
+            logger.warning("Broadcast outbox full, dropped %d oldest messages (%d in all)", overflow, self._dropped)
+
+    async def _listen(self):
+        self._listen_conn = await asyncpg.connect(self._dsn)
+        await self._listen_conn.add_listener(self.CHANNEL, self._on_notify)
+        self._listen_conn.add_termination_listener(self._on_listen_terminated)
+
+    def _on_listen_terminated(self, conn: asyncpg.Connection):
+        if self._stopping:
+            return
+        logger.warning("Broadcast LISTEN connection lost, reconnecting")
+        asyncio.get_running_loop().create_task(self._reconnect_listener())
+
+    async def _reconnect_listener(self):
+        while True:
+            try:
+                await self._listen()
+                return
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning("Broadcast LISTEN reconnect failed: %s", e)
+                await asyncio.sleep(1)
+
+    def _on_notify(self, conn: asyncpg.Connection, pid: int, channel: str, payload: str):
+        _, session_id, msg_type, body = payload.split("\t", 3)
+        frame = body[1:]
+        if body[0] == "z":
+            frame = zlib.decompress(base64.b64decode(frame)).decode()
+        self.deliver(uuid.UUID(session_id), msg_type or None, frame)
+
+    async def _publish_loop(self):
+        while True:
+            if not self._outbox:
+                self._outbox_ready.clear()
+                await self._outbox_ready.wait()
+                continue
+
+            batch = list(self._outbox)
+            self._outbox.clear()
+            try:
+                if self._publish_conn is None or self._publish_conn.is_closed():
+                    self._publish_conn = await asyncpg.connect(self._dsn)
+                # executemany is atomic, so a failed batch was sent in full or not at all
+                await self._publish_conn.executemany(
+                    "SELECT pg_notify($1, $2)", [(self.CHANNEL, payload) for payload in batch]
+                )
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                logger.error("Failed to publish %d broadcasts, retrying: %s", len(batch), e)
+                # Ahead of anything published since, to keep the order
+                self._outbox.extendleft(reversed(batch))
+                self._trim_outbox()
+                if self._publish_conn is not None and not self._publish_conn.is_closed():
+                    self._publish_conn.terminate()
+                self._publish_conn = None
+                await asyncio.sleep(1)
+
+
+BACKENDS: dict[str, type[BroadcastBackend]] = {
+    "memory": MemoryBackend,
+    "postgres": PostgresBackend,
+}
@@ -0,0 +1,83 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Iterator
+
+
+class TTLCache:
+    """Size-capped LRU cache whose entries each carry their own expiry time."""
+
+    def __init__(self, max_size: int, default_ttl: float):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        # key -> (expires_at, value), least recently used first
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Like get(), but leaves the LRU order and counters alone."""
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= time.time():
+            return default
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            self._data.pop(key, None)
+            return
+
+        self._data[key] = (time.time() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def entries(self) -> Iterator[tuple[Hashable, float, Any]]:
+        """Yields (key, expires_at, value) for live entries, least recently used first."""
+        now = time.time()
+        for key, (expires_at, value) in list(self._data.items()):
+            if expires_at > now:
+                yield key, expires_at, value
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
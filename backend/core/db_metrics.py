@@ -0,0 +1,186 @@
+import logging
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class _RequestStats:
+    """Queries issued while serving one request."""
+    __slots__ = ("queries", "db_time", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements: Counter[str] = Counter()
+
+
+class _RouteStats:
+    __slots__ = ("requests", "queries", "db_time", "max_queries")
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.db_time = 0.0
+        self.max_queries = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "queries": self.queries,
+            "queries_per_request": self.queries / self.requests if self.requests else 0.0,
+            "max_queries": self.max_queries,
+            "db_time_ms": round(self.db_time * 1000, 3),
+            "db_time_per_request_ms": round(self.db_time * 1000 / self.requests, 3) if self.requests else 0.0,
+        }
+
+
+_current: ContextVar[_RequestStats | None] = ContextVar("db_request_stats", default=None)
+_routes: dict[str, _RouteStats] = {}
+_background = _RouteStats()  # queries issued outside any request
+_slow_queries: deque[dict] = deque(maxlen=50)
+_n_plus_one: deque[dict] = deque(maxlen=50)
+
+
+class _PoolStats:
+    __slots__ = ("checkouts", "wait_time", "max_wait", "timeouts", "peak_checked_out")
+
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self.peak_checked_out = 0
+
+
+_pool_stats = _PoolStats()
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            _pool_stats.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            _pool_stats.checkouts += 1
+            _pool_stats.wait_time += waited
+            _pool_stats.max_wait = max(_pool_stats.max_wait, waited)
+            _pool_stats.peak_checked_out = max(_pool_stats.peak_checked_out, self.checkedout())
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the statement's own execution context, which a failed query
+    # simply drops, rather than on the connection, where it would outlive it
+    context._db_metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._db_metrics_start
+
+    stats = _current.get()
+    if stats is None:
+        _background.queries += 1
+        _background.db_time += elapsed
+    else:
+        stats.queries += 1
+        stats.db_time += elapsed
+        stats.statements[statement] += 1
+
+    if elapsed * 1000 >= settings.DB_SLOW_QUERY_MS:
+        _slow_queries.append({
+            "statement": statement,
+            "duration_ms": round(elapsed * 1000, 3),
+            "at": time.time(),
+        })
+        logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, statement)
+
+
+def instrument(engine):
+    """Attaches the query timing listeners to an (async) engine."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _record(route: str, stats: _RequestStats):
+    totals = _routes.get(route)
+    if totals is None:
+        totals = _routes[route] = _RouteStats()
+    totals.requests += 1
+    totals.queries += stats.queries
+    totals.db_time += stats.db_time
+    totals.max_queries = max(totals.max_queries, stats.queries)
+
+    # The same statement over and over within one request is a loop that should be one query
+    for statement, count in stats.statements.items():
+        if count >= settings.DB_N_PLUS_ONE_THRESHOLD:
+            _n_plus_one.append({"route": route, "statement": statement, "count": count, "at": time.time()})
+            logger.warning("Possible N+1 in %s: %dx %s", route, count, statement)
+
+
+class DBStatsMiddleware:
+    """ASGI middleware that attributes each HTTP request's queries to its route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = _RequestStats()
+        token = _current.set(stats)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+            # The router leaves the matched route in the scope; key by its template
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "<unmatched>"
+            _record(f"{scope['method']} {path}", stats)
+
+
+def db_stats(engine) -> dict:
+    pool = engine.pool
+    pool_stats = {"class": type(pool).__name__}
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        pool_stats.update({
+            "size": pool.size(),
+            "max_overflow": pool._max_overflow,
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": pool.overflow(),
+            "saturation": pool.checkedout() / capacity if capacity else 0.0,
+            "peak_checked_out": _pool_stats.peak_checked_out,
+        })
+    pool_stats.update({
+        "checkouts": _pool_stats.checkouts,
+        "checkout_timeouts": _pool_stats.timeouts,
+        "checkout_wait_avg_ms": round(_pool_stats.wait_time * 1000 / _pool_stats.checkouts, 3) if _pool_stats.checkouts else 0.0,
+        "checkout_wait_max_ms": round(_pool_stats.max_wait * 1000, 3),
+    })
+
+    return {
+        "routes": {route: totals.as_dict() for route, totals in sorted(_routes.items())},
+        "background": {
+            "queries": _background.queries,
+            "db_time_ms": round(_background.db_time * 1000, 3),
+        },
+        "slow_queries": list(_slow_queries),
+        "n_plus_one": list(_n_plus_one),
+        "pool": pool_stats,
+    }
@@ -0,0 +1,79 @@
+"""
+Structured logging that stays off the hot paths.
+
+Handlers on the root logger only put records on a queue; a listener thread
+formats them and writes them to stderr, so a slow terminal or log shipper
+never stalls the event loop. LOG_FORMAT=json writes one JSON object per
+line, with anything passed through extra= as fields of its own.
+"""
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from datetime import datetime, timezone
+
+from .config import settings
+
+# Attributes every LogRecord has; the rest came in through extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Args may not stay valid until the listener gets to them, so merge them in
+        # now; tracebacks travel as text rather than folded into the message
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRS)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def setup():
+    """Routes all logging through the background listener. Safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return
+
+    handler = logging.StreamHandler(sys.stderr)
+    if settings.LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [_QueueHandler(records)]
+    root.setLevel(settings.LOG_LEVEL.upper())
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+
+
+def shutdown():
+    """Writes out whatever is still queued."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
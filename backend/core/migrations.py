@@ -0,0 +1,117 @@
+import logging
+from typing import Callable
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .database import Base
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary key for pg_advisory_xact_lock, so only one worker migrates at a time
+_LOCK_KEY = 7_165_110_013
+
+# Each step is SQL, or a callable run with the sync connection. A fresh database
+# gets the current schema from the models in migration 1, so every later step
+# must also be a no-op on that schema (IF NOT EXISTS and friends).
+Step = str | Callable
+
+MIGRATIONS: list[tuple[int, str, list[Step]]] = [
+    (1, "baseline schema", [
+        lambda conn: Base.metadata.create_all(conn, checkfirst=True),
+    ]),
+    (2, "queue versioning and ranked order", [
+        "ALTER TABLE sessions ADD COLUMN IF NOT EXISTS queue_version BIGINT NOT NULL DEFAULT 0",
+        "ALTER TABLE queue ALTER COLUMN position TYPE BIGINT",
+        "CREATE INDEX IF NOT EXISTS ix_queue_session_rank ON queue (session_id, votes DESC, position)",
+    ]),
+    (3, "indexes for hot lookups and cascades", [
+        "CREATE INDEX IF NOT EXISTS ix_tracks_session_canonical ON tracks (session_id, canonical_id)",
+        "CREATE INDEX IF NOT EXISTS ix_votes_queue_item_id ON votes (queue_item_id)",
+        "CREATE INDEX IF NOT EXISTS ix_users_session_id ON users (session_id)",
+        "CREATE INDEX IF NOT EXISTS ix_queue_track_id ON queue (track_id)",
+    ]),
+    (4, "one copy of each song per queue", [
+        "ALTER TABLE queue ADD COLUMN IF NOT EXISTS canonical_id VARCHAR",
+        """
+        UPDATE queue SET canonical_id = tracks.canonical_id
+        FROM tracks
+        WHERE tracks.id = queue.track_id AND queue.canonical_id IS NULL
+        """,
+        # Existing duplicates stay queued but no longer count as copies
+        """
+        UPDATE queue SET canonical_id = NULL
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (
+                    PARTITION BY session_id, canonical_id ORDER BY position
+                ) AS copy
+                FROM queue WHERE canonical_id IS NOT NULL
+            ) copies
+            WHERE copy > 1
+        )
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_queue_session_canonical
+        ON queue (session_id, canonical_id) WHERE canonical_id IS NOT NULL
+        """,
+    ]),
+    (5, "tracks by canonical id across sessions", [
+        "CREATE INDEX IF NOT EXISTS ix_tracks_canonical_id ON tracks (canonical_id)",
+    ]),
+    (6, "stream URL expiry of queued tracks", [
+        "ALTER TABLE queue ADD COLUMN IF NOT EXISTS playback_expires_at TIMESTAMPTZ",
+        r"""
+        UPDATE queue SET playback_expires_at = to_timestamp(
+            substring(tracks.playback_url from '[?&/]expire[=/]([0-9]+)')::bigint
+        )
+        FROM tracks
+        WHERE tracks.id = queue.track_id
+            AND queue.playback_expires_at IS NULL
+            AND tracks.playback_url ~ '[?&/]expire[=/][0-9]+'
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS ix_queue_playback_expiry
+        ON queue (playback_expires_at) WHERE playback_expires_at IS NOT NULL
+        """,
+    ]),
+    (7, "session activity for expiry", [
+        # Existing sessions count as active now, so they get a full idle period
+        "ALTER TABLE sessions ADD COLUMN IF NOT EXISTS last_active_at TIMESTAMPTZ NOT NULL DEFAULT now()",
+        "CREATE INDEX IF NOT EXISTS ix_sessions_last_active_at ON sessions (last_active_at)",
+    ]),
+]
+
+
+async def run_migrations(engine: AsyncEngine):
+    """
+    Applies pending migrations in one transaction. Postgres DDL is transactional,
+    so a failed migration leaves the schema as it was.
+    """
+    async with engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _LOCK_KEY})
+        await conn.execute(text(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            """
+        ))
+        result = await conn.execute(text("SELECT version FROM schema_migrations"))
+        applied = set(result.scalars().all())
+
+        for version, name, steps in MIGRATIONS:
+            if version in applied:
+                continue
+            for step in steps:
+                if callable(step):
+                    await conn.run_sync(step)
+                else:
+                    await conn.execute(text(step))
+            await conn.execute(
+                text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+                {"version": version, "name": name},
+            )
+            logger.info("Applied migration %d: %s", version, name)
@@ -0,0 +1,51 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into a single in-flight task."""
+
+    def __init__(self):
+        self._calls: dict[Hashable, _Call] = {}
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def run(
+        self,
+        key: Hashable,
+        factory: Callable[[], Awaitable[Any]],
+        timeout: float | None = None,
+    ) -> Any:
+        """
+        Awaits the shared result for `key`, starting `factory()` if nobody else has.
+        A caller timing out or being cancelled only stops its own wait; the shared
+        work is cancelled once the last waiter gives up.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(factory()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+
+        call.waiters += 1
+        try:
+            # shield() so one waiter's timeout doesn't cancel the work for the others
+            return await asyncio.wait_for(asyncio.shield(call.task), timeout)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+                self._forget(key, call)
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
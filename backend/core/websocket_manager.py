@@ -1,32 +1,215 @@
 from fastapi import WebSocket
+import asyncio
+import json
+import logging
+import time
 import uuid
+from collections import deque
+from typing import Callable
+
+from core import metrics, wire
+from core.broadcast import BACKENDS, BroadcastBackend, MemoryBackend
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Only the newest of these is worth delivering; a pending older copy is dropped
+LATEST_ONLY_TYPES = {"track_progress", "volume_change"}
+
+# Close code used when a client can't keep up with the session's traffic
+SLOW_CONSUMER_CLOSE_CODE = 1013  # Try Again Later
+
+_FANOUT_SECONDS = metrics.Histogram(
+    "ksunira_broadcast_fanout_seconds", "Time to queue a delivered message on all of a session's connections"
+)
+_SEND_DELAY_SECONDS = metrics.Histogram(
+    "ksunira_websocket_send_delay_seconds", "Time from queueing a frame to finishing its write"
+)
+_EVICTIONS = metrics.Counter(
+    "ksunira_websocket_evictions_total", "Clients dropped for falling behind", ("reason",)
+)
+
+
+def encode_message(message: dict) -> str:
+    """Serializes a message the same way WebSocket.send_json would."""
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+class _Connection:
+    """A client socket with its own bounded outbound queue and writer task."""
+    __slots__ = ("websocket", "protocol", "pending", "wakeup", "writer", "evicted")
+
+    def __init__(self, websocket: WebSocket, protocol: str | None):
+        self.websocket = websocket
+        self.protocol = protocol  # negotiated subprotocol, see core.wire
+        self.pending: deque[tuple[str | None, str | bytes, float]] = deque()  # (message type, frame, queued at)
+        self.wakeup = asyncio.Event()
+        self.writer: asyncio.Task | None = None
+        self.evicted = False
+
+    def enqueue(self, msg_type: str | None, frame: str | bytes) -> bool:
+        """
+        Queues a frame for sending. Returns False if the client is too far behind,
+        i.e. its oldest unsent frame has waited over WS_SEND_MAX_LAG. Lag is measured
+        in time rather than frames, since one server-side loop can queue a burst of
+        frames before any writer gets to run.
+        """
+        now = time.perf_counter()
+        if self.pending and now - self.pending[0][2] > settings.WS_SEND_MAX_LAG:
+            return False
+
+        if msg_type in LATEST_ONLY_TYPES:
+            for pending in self.pending:
+                if pending[0] == msg_type:
+                    self.pending.remove(pending)
+                    break
+
+        self.pending.append((msg_type, frame, now))
+        self.wakeup.set()
+        return True
 
 
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: dict[uuid.UUID, list[WebSocket]] = {}
+        # session_id -> {id(websocket): connection}
+        self.active_connections: dict[uuid.UUID, dict[int, _Connection]] = {}
+        self.backend: BroadcastBackend = MemoryBackend(self.deliver)
+        # Called with every (session_id, message type, frame) this worker delivers,
+        # whether or not it has clients for the session
+        self.observers: list[Callable[[uuid.UUID, str | None, str], None]] = []
+
+    async def start(self):
+        """Switches to the configured broadcast backend."""
+        backend_cls = BACKENDS[settings.BROADCAST_BACKEND]
+        if not isinstance(self.backend, backend_cls):
+            backend = backend_cls(self.deliver)
+            await backend.start()
+            self.backend = backend
+
+    async def stop(self):
+        await self.backend.stop()
+        self.backend = MemoryBackend(self.deliver)
 
     async def connect(self, websocket: WebSocket, session_id: uuid.UUID):
-        """Accepts a new WebSocket connection and adds it to the session's list."""
-        await websocket.accept()
+        """
+        Accepts a new WebSocket connection and adds it to the session's list,
+        in the first encoding the client offers that we speak.
+        """
+        protocol = wire.negotiate(websocket.scope.get("subprotocols", []), settings.WS_MSGPACK)
+        await websocket.accept(subprotocol=protocol)
 
-        if session_id not in self.active_connections:
-            self.active_connections[session_id] = []
-        self.active_connections[session_id].append(websocket)
+        connection = _Connection(websocket, protocol)
+        connection.writer = asyncio.create_task(self._write_loop(connection, session_id))
+        self.active_connections.setdefault(session_id, {})[id(websocket)] = connection
 
     def disconnect(self, websocket: WebSocket, session_id: uuid.UUID):
         """Removes a WebSocket form the active connections list.."""
-        if session_id in self.active_connections:
-            self.active_connections[session_id].remove(websocket)
-            # If the session has no more connected users, clean it up
-            if not self.active_connections[session_id]:
-                del self.active_connections[session_id]
+        connections = self.active_connections.get(session_id)
+        if connections is None:
+            return
+
+        connection = connections.pop(id(websocket), None)
+        if connection and connection.writer:
+            connection.writer.cancel()
+        # If the session has no more connected users, clean it up
+        if not connections:
+            del self.active_connections[session_id]
 
     async def broadcast(self, message: dict, session_id: uuid.UUID):
-        """Broadcasts a JSON message to all clients in a specific session."""
-        if session_id in self.active_connections:
-            for connection in self.active_connections[session_id]:
-                await connection.send_json(message)
+        """
+        Broadcasts a JSON message to all clients in a specific session,
+        on every worker attached to the broadcast backend.
+        """
+        await self.backend.publish(session_id, message.get("type"), encode_message(message))
+
+    def deliver(self, session_id: uuid.UUID, msg_type: str | None, frame: str):
+        """
+        Queues a serialized frame on each of this worker's connections for the
+        session, so a slow client never delays delivery to the others.
+        """
+        for observer in self.observers:
+            observer(session_id, msg_type, frame)
+
+        connections = self.active_connections.get(session_id)
+        if not connections:
+            return
+
+        with _FANOUT_SECONDS.time():
+            # Each encoding is produced once per message, however many clients use it
+            frames: dict[str | None, str | bytes] = {None: frame, wire.PROTOCOL_JSON: frame}
+            for connection in list(connections.values()):
+                encoded = frames.get(connection.protocol)
+                if encoded is None:
+                    encoded = frames[connection.protocol] = wire.encode(connection.protocol, frame)
+                if not connection.enqueue(msg_type, encoded):
+                    logger.warning("Evicting slow WebSocket client from session %s", session_id)
+                    _EVICTIONS.inc(reason="lagging")
+                    self._evict(connection, session_id)
+
+    def send_to(self, websocket: WebSocket, session_id: uuid.UUID, message: dict):
+        """Queues a message for a single client of this worker, e.g. a snapshot for a newcomer."""
+        connection = self.active_connections.get(session_id, {}).get(id(websocket))
+        if connection and not connection.enqueue(
+            message.get("type"), wire.encode(connection.protocol, encode_message(message))
+        ):
+            _EVICTIONS.inc(reason="lagging")
+            self._evict(connection, session_id)
+
+    def _evict(self, connection: _Connection, session_id: uuid.UUID):
+        """Drops a connection that can't keep up; its writer closes the socket."""
+        connection.evicted = True
+        connection.wakeup.set()
+        connections = self.active_connections.get(session_id)
+        if connections and connections.get(id(connection.websocket)) is connection:
+            del connections[id(connection.websocket)]
+            if not connections:
+                del self.active_connections[session_id]
+
+    async def _write_loop(self, connection: _Connection, session_id: uuid.UUID):
+        websocket = connection.websocket
+        try:
+            while not connection.evicted:
+                if not connection.pending:
+                    connection.wakeup.clear()
+                    await connection.wakeup.wait()
+                    continue
+
+                _, frame, queued_at = connection.pending.popleft()
+                send = websocket.send_bytes(frame) if isinstance(frame, bytes) else websocket.send_text(frame)
+                await asyncio.wait_for(send, settings.WS_SEND_TIMEOUT)
+                _SEND_DELAY_SECONDS.observe(time.perf_counter() - queued_at)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            logger.warning("Evicting WebSocket client stuck sending in session %s", session_id)
+            _EVICTIONS.inc(reason="send_timeout")
+            self._evict(connection, session_id)
+        except Exception:
+            # The socket is gone; the receive loop will notice and disconnect it
+            self._evict(connection, session_id)
+            return
+
+        try:
+            await websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            pass
 
 
 manager = ConnectionManager()
+
+
+metrics.Gauge(
+    "ksunira_sessions_active", "Sessions with clients connected to this worker",
+    collect=lambda: len(manager.active_connections),
+)
+metrics.Gauge(
+    "ksunira_websocket_connections", "WebSocket clients connected to this worker",
+    collect=lambda: sum(len(connections) for connections in manager.active_connections.values()),
+)
+metrics.Gauge(
+    "ksunira_websocket_send_queue_depth", "Frames waiting to be written, per session", ("session_id",),
+    collect=lambda: [
+        ((str(session_id),), sum(len(connection.pending) for connection in connections.values()))
+        for session_id, connections in list(manager.active_connections.items())
+    ],
+)
@@ -0,0 +1,94 @@
+"""
+WebSocket encodings negotiated through the Sec-WebSocket-Protocol header.
+
+ksunira.json     JSON text frames, as sent to clients that offer no subprotocol
+ksunira.msgpack  MessagePack binary frames with interned keys and UUIDs
+
+MessagePack frames encode map keys listed in KEYS as their index in it, and
+UUID strings under UUID_KEYS as 16-byte bin values; clients keep the same
+table. Track stream URLs are sent empty: only the host plays tracks, and it
+gets the URL from the pop response. Both encodings are further compressed by
+permessage-deflate when the client supports it.
+"""
+import json
+import re
+import uuid
+from typing import Any
+
+import msgpack
+
+PROTOCOL_JSON = "ksunira.json"
+PROTOCOL_MSGPACK = "ksunira.msgpack"
+
+# Append-only: a key's index is its wire code, and must match the client's table
+KEYS = (
+    "type", "payload", "version", "op", "id", "item", "items", "since", "votes",
+    "user_vote", "track", "title", "duration", "source_type", "playback_url", "added_by",
+    "canonical_id", "position", "session_id", "created_at", "track_id", "currentTrack",
+    "currentTime", "isPlaying", "volume", "time",
+)
+_KEY_CODES = {key: code for code, key in enumerate(KEYS)}
+
+# Keys whose values are UUIDs
+UUID_KEYS = {"id", "session_id", "track_id"}
+_UUID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+def negotiate(offered: list[str], allow_msgpack: bool = True) -> str | None:
+    """Picks the first offered subprotocol we speak; None means plain JSON without one."""
+    for protocol in offered:
+        if protocol == PROTOCOL_JSON or (protocol == PROTOCOL_MSGPACK and allow_msgpack):
+            return protocol
+    return None
+
+
+def encode(protocol: str | None, frame: str) -> str | bytes:
+    """Re-encodes a JSON frame for a client that negotiated the given subprotocol."""
+    if protocol != PROTOCOL_MSGPACK:
+        return frame
+    message = json.loads(frame)
+    if message.get("type") == "queue_delta":
+        payload = message.get("payload") or {}
+        for item in [payload.get("item")] + (payload.get("items") or []):
+            if item and item.get("track"):
+                item["track"]["playback_url"] = ""
+        if payload.get("track"):
+            payload["track"]["playback_url"] = ""
+    elif message.get("type") == "state_update":
+        current_track = (message.get("payload") or {}).get("currentTrack")
+        if current_track:
+            current_track["playback_url"] = ""
+    return pack(message)
+
+
+def pack(obj: Any) -> bytes:
+    return msgpack.packb(_intern(obj, False), use_bin_type=True)
+
+
+def _intern(obj: Any, is_uuid: bool) -> Any:
+    """Swaps KEYS for their codes and UUID strings under UUID_KEYS for their 16 bytes."""
+    if isinstance(obj, dict):
+        return {
+            _KEY_CODES.get(key, key): _intern(value, key in UUID_KEYS)
+            for key, value in obj.items()
+        }
+    if isinstance(obj, (list, tuple)):
+        return [_intern(value, is_uuid) for value in obj]
+    if is_uuid and isinstance(obj, str) and _UUID.fullmatch(obj):
+        return bytes.fromhex(obj.replace("-", ""))
+    return obj
+
+
+def unpack(data: bytes) -> Any:
+    """Decodes a frame from pack(), mapping interned keys and UUIDs back."""
+    return _restore(msgpack.unpackb(data, raw=False, strict_map_key=False))
+
+
+def _restore(obj: Any) -> Any:
+    if isinstance(obj, dict):
+        return {KEYS[key] if isinstance(key, int) else key: _restore(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_restore(value) for value in obj]
+    if isinstance(obj, bytes) and len(obj) == 16:
+        return str(uuid.UUID(bytes=obj))
+    return obj
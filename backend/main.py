@@ -1,9 +1,21 @@
+import asyncio
+import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from core.database import engine, Base
-from api import session as session_api, queue as queue_api, websockets as ws_api, search as search_api, users as users_api
+from core.database import engine
+from core.migrations import run_migrations
+from api import session as session_api, queue as queue_api, websockets as ws_api, search as search_api, users as users_api, stats as stats_api, audio as audio_api, metrics as metrics_api
 
+from core import logs
+from core.config import settings
+from core.db_metrics import DBStatsMiddleware
+from core.metrics import MetricsMiddleware
+from core.websocket_manager import manager
 from models import Session, Track, Queue, User
+from services import file_service, lifecycle_service, prefetch_service, transcode_service, url_refresh_service, yt_service, vote_aggregator, session_state
+
+logs.setup()
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="K Sunira? - Shared Party Music Player API")
 
@@ -25,6 +37,8 @@ app.add_middleware(
     allow_methods=["*"],  # Allow all methods
     allow_headers=["*"],  # Allow all headers
 )
+app.add_middleware(DBStatsMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 # Include the API router
 from fastapi.staticfiles import StaticFiles
@@ -35,7 +49,10 @@ app.include_router(session_api.router, prefix="/api", tags=["Sessions"])
 app.include_router(queue_api.router, prefix="/api", tags=["Queue"])
 app.include_router(search_api.router, prefix="/api", tags=["Search"])
 app.include_router(users_api.router, prefix="/api", tags=["Users"])
+app.include_router(stats_api.router, prefix="/api", tags=["Stats"])
+app.include_router(audio_api.router, prefix="/api", tags=["Audio"])
 app.include_router(ws_api.router, tags=["WebSockets"])
+app.include_router(metrics_api.router, tags=["Metrics"])
 
 # Create static directory if it doesn't exist
 os.makedirs("static", exist_ok=True)
@@ -44,13 +61,49 @@ os.makedirs("static", exist_ok=True)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
+# Long-running tasks started at startup and cancelled at shutdown
+_background_tasks: list[asyncio.Task] = []
+
+
 @app.on_event("startup")
 async def startup():
-    # Create database tables on startup
-    async with engine.begin() as conn:
-        # Use this for development to drop and recreate tables
-        await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
+    # Bring the schema up to date without touching existing data
+    await run_migrations(engine)
+
+    removed = await file_service.collect_garbage()
+    if removed:
+        logger.info("Removed %d unreferenced upload blobs", removed)
+    transcode_service.start()
+    await manager.start()
+    yt_service.load_cache()
+    _background_tasks.append(asyncio.create_task(yt_service.persist_cache_periodically()))
+    await prefetch_service.start()
+    if settings.PREFETCH_ENABLED:
+        _background_tasks.append(asyncio.create_task(prefetch_service.run_prefetcher()))
+    if settings.URL_REFRESH_ENABLED:
+        _background_tasks.append(asyncio.create_task(url_refresh_service.run_refresher()))
+    _background_tasks.append(asyncio.create_task(lifecycle_service.run_lifecycle()))
+    if settings.SESSION_STATE_ENGINE:
+        await session_state.preload()
+        _background_tasks.append(asyncio.create_task(session_state.run_persister()))
+    elif settings.VOTE_COALESCING:
+        _background_tasks.append(asyncio.create_task(vote_aggregator.run_flusher()))
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in _background_tasks:
+        task.cancel()
+    await transcode_service.shutdown()
+    if settings.SESSION_STATE_ENGINE:
+        await session_state.flush_all()
+    elif settings.VOTE_COALESCING:
+        await vote_aggregator.flush_all()
+    await manager.stop()
+    await yt_service.save_cache()
+    yt_service.shutdown()
+    prefetch_service.shutdown()
+    logs.shutdown()
 
 
 @app.get("/")
@@ -1,5 +1,5 @@
 import uuid
-from sqlalchemy import Column, Integer, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
@@ -15,9 +15,30 @@ class Queue(Base):
     track_id = Column(UUID(as_uuid=True), ForeignKey(
         "tracks.id", ondelete="CASCADE"), nullable=False)
 
-    position = Column(Integer, nullable=False)
+    # Insertion order, never rewritten. Play order is votes desc, then position.
+    position = Column(BigInteger, nullable=False)
     votes = Column(Integer, default=0)
+    # Copied from the track so the database can keep one copy of each song per queue
+    canonical_id = Column(String, nullable=True)
+    # When the track's signed stream URL stops working, so it can be refreshed first
+    playback_expires_at = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     session = relationship("Session")
     track = relationship("Track")
+
+
+# Serves the ranked reads (get_queue, pop) without sorting, so votes never rewrite positions
+Index("ix_queue_session_rank", Queue.session_id, Queue.votes.desc(), Queue.position)
+# Lets deleting a track cascade without scanning the queue
+Index("ix_queue_track_id", Queue.track_id)
+# Finds the stream URLs due for a refresh, soonest first
+Index(
+    "ix_queue_playback_expiry", Queue.playback_expires_at,
+    postgresql_where=Queue.playback_expires_at.isnot(None)
+)
+# One copy of each song per queue; popped items leave the table, so it can be queued again
+Index(
+    "uq_queue_session_canonical", Queue.session_id, Queue.canonical_id,
+    unique=True, postgresql_where=Queue.canonical_id.isnot(None)
+)
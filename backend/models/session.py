@@ -1,5 +1,5 @@
 import uuid
-from sqlalchemy import Column, String, DateTime, Boolean
+from sqlalchemy import Column, String, DateTime, Boolean, BigInteger, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 from core.database import Base
@@ -13,3 +13,11 @@ class Session(Base):
                          default=lambda: str(uuid.uuid4()))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     active = Column(Boolean, default=True)
+    # Last time a client was connected; sessions idle for SESSION_EXPIRE_AFTER are deleted
+    last_active_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    # Bumped by every queue mutation; clients use it to order deltas and detect gaps
+    queue_version = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+
+# The reaper looks for the longest-idle sessions first
+Index("ix_sessions_last_active_at", Session.last_active_at)
@@ -1,6 +1,6 @@
 import uuid
 import enum
-from sqlalchemy import Column, String, Integer, Enum, ForeignKey
+from sqlalchemy import Column, String, Integer, Enum, ForeignKey, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from core.database import Base
@@ -27,3 +27,9 @@ class Track(Base):
     canonical_id = Column(String, nullable=True) # Video ID or File Hash
 
     session = relationship("Session")
+
+
+# Upload dedup looks tracks up by (session, canonical_id)
+Index("ix_tracks_session_canonical", Track.session_id, Track.canonical_id)
+# Transcoding switches every session's copy of an upload at once
+Index("ix_tracks_canonical_id", Track.canonical_id)
@@ -1,5 +1,5 @@
 import uuid
-from sqlalchemy import Column, String, Integer, ForeignKey, DateTime, UniqueConstraint
+from sqlalchemy import Column, String, Integer, ForeignKey, DateTime, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
 from datetime import datetime
@@ -22,4 +22,6 @@ class Vote(Base):
     # Ensure one vote per user per queue item
     __table_args__ = (
         UniqueConstraint('user_id', 'queue_item_id', name='uq_user_queue_vote'),
+        # The unique constraint leads with user_id; this serves lookups and cascades by item
+        Index('ix_votes_queue_item_id', 'queue_item_id'),
     )
@@ -22,3 +22,4 @@ class QueueItem(BaseModel):
 
 class QueueList(BaseModel):
     items: List[QueueItem]
+    version: int = 0  # queue version this snapshot reflects
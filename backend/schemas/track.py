@@ -1,5 +1,5 @@
 import uuid
-from pydantic import BaseModel, HttpUrl
+from pydantic import BaseModel, Field, HttpUrl
 from models.track import SourceType
 
 
@@ -8,6 +8,11 @@ class TrackCreate(BaseModel):
     source_url: HttpUrl
 
 
+class TrackImport(BaseModel):
+    """Schema for a bulk add: video and playlist URLs, in the order to queue them"""
+    source_urls: list[HttpUrl] = Field(min_length=1, max_length=100)
+
+
 class TrackBase(BaseModel):
     """Schema for track details"""
     id: uuid.UUID
@@ -16,6 +21,7 @@ class TrackBase(BaseModel):
     source_type: SourceType
     playback_url: str # Can be relative path for files
     added_by: str | None = None
+    canonical_id: str | None = None # Video ID or File Hash
 
     class Config:
         from_attributes = True
@@ -24,5 +30,3 @@ class TrackBase(BaseModel):
 class Track(TrackBase):
     session_id: uuid.UUID
     source_url: str # Can be relative path for files
-    added_by: str | None = None
-    canonical_id: str | None = None
@@ -0,0 +1,158 @@
+"""
+Reports the bytes per WebSocket message under each encoding.
+
+    cd backend && python -m scripts.bench_ws_encoding
+
+Replays a typical session's traffic (adds, a playlist import, votes,
+removals, progress and state snapshots) through the JSON and msgpack
+encodings of core.wire, each raw and with permessage-deflate as browsers
+negotiate it: raw DEFLATE with the sliding window carried over between
+messages.
+"""
+import base64
+import json
+import random
+import uuid
+import zlib
+from collections import defaultdict
+
+from core import wire
+
+random.seed(7)
+_session_id = str(uuid.UUID(bytes=random.randbytes(16)))
+
+
+def _hex(size: int) -> str:
+    return random.randbytes(size).hex()
+
+
+def _token(size: int) -> str:
+    return base64.urlsafe_b64encode(random.randbytes(size)).decode().rstrip("=")
+
+
+def _playback_url(video_id: str) -> str:
+    """A googlevideo stream URL of realistic length and entropy."""
+    expire = 1_790_000_000 + random.randrange(20_000)
+    return (
+        f"https://rr{random.randrange(1, 9)}---sn-{_hex(4)}.googlevideo.com/videoplayback"
+        f"?expire={expire}&ei={_token(18)}&ip=203.0.113.{random.randrange(256)}"
+        f"&id=o-{_token(33)}&itag=251&source=youtube&requiressl=yes"
+        f"&mh=x{_hex(1)}&mm=31%2C29&mn=sn-{_hex(4)}&ms=au%2Crdu&mv=m&mvi=5"
+        f"&pl=24&initcwndbps={random.randrange(10**6, 10**7)}&vprv=1&svpuc=1&mime=audio%2Fwebm"
+        f"&gir=yes&clen={random.randrange(10**6, 10**7)}&dur={random.randrange(120, 400)}.{random.randrange(1000)}"
+        f"&lmt={random.randrange(10**15, 10**16)}&mt={expire - 21_000}&fvip=5&keepalive=yes"
+        f"&c=ANDROID&txp=5532434&sparams=expire%2Cei%2Cip%2Cid%2Citag%2Csource%2Crequiressl%2Cvprv%2Csvpuc"
+        f"%2Cmime%2Cgir%2Cclen%2Cdur%2Clmt&sig={_token(60)}"
+        f"&lsparams=mh%2Cmm%2Cmn%2Cms%2Cmv%2Cmvi%2Cpl%2Cinitcwndbps&lsig={_token(50)}"
+    )
+
+
+def _item(position: int) -> dict:
+    video_id = _token(8)[:11]
+    return {
+        "id": str(uuid.UUID(bytes=random.randbytes(16))),
+        "session_id": _session_id,
+        "position": position,
+        "votes": 0,
+        "user_vote": None,
+        "created_at": "2026-10-16T21:14:03.512847Z",
+        "track": {
+            "id": str(uuid.UUID(bytes=random.randbytes(16))),
+            "title": random.choice(["Daft Punk - Around the World", "Bonobo - Kerala (Official Video)", "Khruangbin - Time (You and I)"]),
+            "duration": random.randrange(120, 400),
+            "source_type": "youtube",
+            "playback_url": _playback_url(video_id),
+            "added_by": random.choice(["Ana", "Kofi", None]),
+            "canonical_id": video_id,
+        },
+    }
+
+
+def _delta(version: int, op: str, **fields) -> tuple[str, dict]:
+    return f"queue_delta {op}", {"type": "queue_delta", "payload": {"version": version, "op": op, **fields}}
+
+
+def _traffic() -> list[tuple[str, dict]]:
+    """(label, message) in the order one session's clients would receive them."""
+    messages = []
+    version = 0
+    items = []
+    for _ in range(20):
+        version += 1
+        items.append(_item(version))
+        messages.append(_delta(version, "added", item=items[-1]))
+    playlist = [_item(version + offset + 1) for offset in range(10)]
+    messages.append(_delta(version + 10, "added_many", since=version, items=playlist))
+    version += 10
+    items += playlist
+    for _ in range(60):
+        version += 1
+        messages.append(_delta(version, "votes", id=random.choice(items)["id"], votes=random.randrange(-3, 12)))
+    for item in items[:5]:
+        version += 1
+        messages.append(_delta(version, "removed", id=item["id"]))
+
+    current = items[0]
+    messages.append(("track_started", {
+        "type": "track_started",
+        "payload": {"track_id": current["id"], "title": current["track"]["title"], "duration": current["track"]["duration"]},
+    }))
+    for second in range(120):
+        messages.append(("track_progress", {
+            "type": "track_progress",
+            "payload": {"currentTime": second + random.random(), "duration": float(current["track"]["duration"])},
+        }))
+    for volume in (80, 65, 70):
+        messages.append(("volume_change", {"type": "volume_change", "payload": {"volume": volume}}))
+    for _ in range(10):
+        messages.append(("state_update", {
+            "type": "state_update",
+            "payload": {
+                "volume": 70,
+                "currentTrack": {
+                    "track_id": current["id"], "title": current["track"]["title"],
+                    "duration": current["track"]["duration"], "playback_url": current["track"]["playback_url"],
+                },
+                "isPlaying": True,
+                "currentTime": random.uniform(0, 100),
+                "duration": float(current["track"]["duration"]),
+            },
+        }))
+    return messages
+
+
+def _deflater():
+    """permessage-deflate with context takeover, as the server negotiates it by default."""
+    compressor = zlib.compressobj(wbits=-12, memLevel=5)
+    return lambda data: len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+
+
+def main():
+    traffic = _traffic()
+    columns = ("json", "json+deflate", "msgpack", "msgpack+deflate")
+    json_deflate, msgpack_deflate = _deflater(), _deflater()
+    sizes: dict[str, dict[str, list[int]]] = defaultdict(lambda: defaultdict(list))
+    for label, message in traffic:
+        # Serialized the way ConnectionManager.broadcast does
+        frame = json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+        packed = wire.encode(wire.PROTOCOL_MSGPACK, frame)
+        data = frame.encode()
+        for key in (label, "all messages"):
+            sizes[key]["json"].append(len(data))
+            sizes[key]["msgpack"].append(len(packed))
+        json_size, msgpack_size = json_deflate(data), msgpack_deflate(packed)
+        for key in (label, "all messages"):
+            sizes[key]["json+deflate"].append(json_size)
+            sizes[key]["msgpack+deflate"].append(msgpack_size)
+
+    print(f"{'message':<22} {'count':>5} " + " ".join(f"{column:>16}" for column in columns))
+    sizes["all messages"] = sizes.pop("all messages")
+    for label, by_column in sizes.items():
+        count = len(by_column["json"])
+        print(f"{label:<22} {count:>5} " + " ".join(
+            f"{sum(by_column[column]) / count:>16.0f}" for column in columns
+        ))
+
+
+if __name__ == "__main__":
+    main()
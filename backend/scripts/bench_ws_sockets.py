@@ -0,0 +1,99 @@
+"""
+Measures how many concurrent WebSockets one server holds with its DB pool.
+
+    cd backend && DB_POOL_SIZE=5 DB_MAX_OVERFLOW=0 uvicorn main:app &
+    python -m scripts.bench_ws_sockets --sockets 1000 --step 100
+
+Creates a session and ramps up idle guest sockets on it, a step at a time.
+Every new socket must receive the playback snapshot within --timeout; each
+step reports the sockets held, snapshot latency and the pool's checked-out
+connections from /api/stats/db. The ramp stops at the first step where
+sockets fail to connect, e.g. because each one is waiting for a connection
+of its own.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import urllib.request
+
+import websockets
+
+
+def _http(base_url: str, method: str, path: str) -> dict | None:
+    request = urllib.request.Request(f"{base_url}{path}", method=method, data=b"{}" if method == "POST" else None)
+    request.add_header("Content-Type", "application/json")
+    with urllib.request.urlopen(request, timeout=10) as response:
+        body = response.read()
+    return json.loads(body) if body else None
+
+
+async def _open_guest(ws_url: str, timeout: float):
+    """Connects and waits for the snapshot. Returns (socket, seconds taken)."""
+    started = time.perf_counter()
+    socket = await asyncio.wait_for(websockets.connect(ws_url, max_queue=None), timeout)
+    try:
+        while True:
+            message = json.loads(await asyncio.wait_for(socket.recv(), timeout))
+            if message.get("type") == "state_update":
+                return socket, time.perf_counter() - started
+    except BaseException:
+        await socket.close()
+        raise
+
+
+async def run(base_url: str, total: int, step: int, timeout: float):
+    session_id = _http(base_url, "POST", "/api/sessions")["id"]
+    ws_url = f"{base_url.replace('http', 'ws', 1)}/ws/session/{session_id}"
+    pool = _http(base_url, "GET", "/api/stats/db")["pool"]
+    print(f"Session {session_id}; pool size {pool.get('size')} + overflow {pool.get('max_overflow')}")
+
+    # The host reports a track, so every guest after it gets a snapshot on connect
+    host = await websockets.connect(ws_url, max_queue=None)
+    await host.send(json.dumps({
+        "type": "track_started",
+        "payload": {"track_id": "bench", "title": "Benchmark", "duration": 3600},
+    }))
+
+    guests = []
+    print(f"{'sockets':>8} {'failed':>7} {'p50 ms':>8} {'p95 ms':>8} {'checked out':>12} {'peak':>5} {'timeouts':>9}")
+    try:
+        while len(guests) < total:
+            results = await asyncio.gather(
+                *(_open_guest(ws_url, timeout) for _ in range(min(step, total - len(guests)))),
+                return_exceptions=True
+            )
+            opened = [result for result in results if not isinstance(result, BaseException)]
+            guests += [socket for socket, _ in opened]
+            latencies = sorted(seconds * 1000 for _, seconds in opened)
+            failed = len(results) - len(opened)
+
+            pool = _http(base_url, "GET", "/api/stats/db")["pool"]
+            p50 = statistics.median(latencies) if latencies else 0.0
+            p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0.0
+            print(
+                f"{len(guests):>8} {failed:>7} {p50:>8.1f} {p95:>8.1f} "
+                f"{pool.get('checked_out', 0):>12} {pool.get('peak_checked_out', 0):>5} {pool['checkout_timeouts']:>9}"
+            )
+            if failed:
+                break
+    finally:
+        await asyncio.gather(*(socket.close() for socket in guests + [host]), return_exceptions=True)
+        _http(base_url, "DELETE", f"/api/sessions/{session_id}")
+
+    print(f"Held {len(guests)} concurrent guest sockets")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000", help="server base URL")
+    parser.add_argument("--sockets", type=int, default=500, help="guest sockets to open in total")
+    parser.add_argument("--step", type=int, default=50, help="sockets opened per step")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds a socket may take to get its snapshot")
+    args = parser.parse_args()
+    asyncio.run(run(args.url.rstrip("/"), args.sockets, args.step, args.timeout))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Checks that the hot queries can be served by the indexes meant for them.
+
+    cd backend && python -m scripts.check_indexes
+
+Runs EXPLAIN for each query against DATABASE_URL with sequential scans
+disabled, so the planner picks an index whenever one applies even on small
+tables. Exits non-zero if a query doesn't use its expected index.
+"""
+import asyncio
+import json
+import sys
+import uuid
+
+from sqlalchemy import select, text, func
+from sqlalchemy.dialects import postgresql
+
+from core.database import engine
+from core.migrations import run_migrations
+from models import Queue, Track, User, Vote
+
+_session_id = uuid.uuid4()
+_user_id = uuid.uuid4()
+_item_id = uuid.uuid4()
+
+# (description, statement, index it should use)
+HOT_QUERIES = [
+    (
+        "ranked queue (get_queue, pop head)",
+        select(Queue).where(Queue.session_id == _session_id).order_by(Queue.votes.desc(), Queue.position).limit(1),
+        "ix_queue_session_rank",
+    ),
+    (
+        "duplicate check on add",
+        select(Queue.id).where(Queue.session_id == _session_id, Queue.canonical_id == "dQw4w9WgXcQ"),
+        "uq_queue_session_canonical",
+    ),
+    (
+        "upload dedup by file hash",
+        select(Track).where(Track.session_id == _session_id, Track.canonical_id == "0" * 64),
+        "ix_tracks_session_canonical",
+    ),
+    (
+        "a user's votes (queue overlay)",
+        select(Vote.queue_item_id, Vote.vote_value).where(Vote.user_id == _user_id),
+        "uq_user_queue_vote",
+    ),
+    (
+        "votes on queue items (state load, cascades)",
+        select(Vote).where(Vote.queue_item_id.in_([_item_id])),
+        "ix_votes_queue_item_id",
+    ),
+    (
+        "session users",
+        select(User.id, User.nickname).where(User.session_id == _session_id),
+        "ix_users_session_id",
+    ),
+    (
+        "queue items of a track (cascade on track delete)",
+        select(Queue.id).where(Queue.track_id == _item_id),
+        "ix_queue_track_id",
+    ),
+    (
+        "an upload's tracks across sessions (transcode switch)",
+        select(Track.id).where(Track.canonical_id == "0" * 64),
+        "ix_tracks_canonical_id",
+    ),
+    (
+        "stream URLs due for a refresh",
+        select(Queue.id).where(Queue.playback_expires_at < func.now()).order_by(Queue.playback_expires_at).limit(10),
+        "ix_queue_playback_expiry",
+    ),
+]
+
+
+def _index_names(plan: dict) -> set[str]:
+    names = {plan["Index Name"]} if "Index Name" in plan else set()
+    for child in plan.get("Plans", []):
+        names |= _index_names(child)
+    return names
+
+
+async def main() -> int:
+    await run_migrations(engine)
+    failures = 0
+    async with engine.connect() as conn:
+        await conn.execute(text("SET enable_seqscan = off"))
+        for description, statement, expected in HOT_QUERIES:
+            sql = statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+            result = await conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))
+            plan = result.scalar_one()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            used = _index_names(plan[0]["Plan"])
+            ok = expected in used
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {description}: expected {expected}, used {sorted(used) or 'no index'}")
+    await engine.dispose()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
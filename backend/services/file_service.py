@@ -1,33 +1,287 @@
+import asyncio
+import hashlib
 import os
-import uuid
 import shutil
+import tempfile
+import threading
+import uuid
 from fastapi import UploadFile
-import aiofiles
 
 STATIC_DIR = "static"
+SESSIONS_DIR = os.path.join(STATIC_DIR, "sessions")
+# Content-addressed store: every distinct upload is kept once, as blobs/<sha[:2]>/<sha>.
+# Session files are hardlinks to a blob, so a blob's link count minus one is the
+# number of session files using it; at one it's garbage.
+BLOB_DIR = os.path.join(STATIC_DIR, "blobs")
+BLOB_TMP_DIR = os.path.join(BLOB_DIR, "tmp")
 
-import hashlib
+CHUNK_SIZE = 1024 * 1024
+
+# Serializes publishing, linking and collecting blobs across the worker threads
+_blob_lock = threading.Lock()
 
-async def save_upload_file(session_id: uuid.UUID, file: UploadFile) -> tuple[str, str]:
+
+def blob_path(file_hash: str) -> str:
+    return os.path.join(BLOB_DIR, file_hash[:2], file_hash)
+
+
+def _spool_and_hash(src, tmp_dir: str) -> tuple[str, str]:
+    """Copies an upload to a temp file, hashing it on the way. Runs in a thread."""
+    sha256_hash = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as out_file:
+            while chunk := src.read(CHUNK_SIZE):
+                sha256_hash.update(chunk)
+                out_file.write(chunk)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return tmp_path, sha256_hash.hexdigest()
+
+
+def _store(tmp_path: str, file_hash: str, session_path: str) -> bool:
+    """
+    Links session_path to the blob for file_hash, publishing tmp_path as that blob
+    if it's new. Returns False if the session already had the file.
+    """
+    blob = blob_path(file_hash)
+    with _blob_lock:
+        try:
+            if os.path.exists(session_path):
+                return False
+            if not os.path.exists(blob):
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.replace(tmp_path, blob)
+                # Blobs are never modified in place
+                os.chmod(blob, 0o444)
+            # Blobs and sessions share the static/ volume, so a hardlink always works
+            os.link(blob, session_path)
+            return True
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+
+async def save_upload_file(session_id: uuid.UUID, file: UploadFile) -> tuple[str, str, bool]:
     """
-    Saves an uploaded file to static/sessions/{session_id}/{filename}.
-    Returns a tuple of (relative_path, sha256_hash).
+    Stores an upload as static/sessions/{session_id}/{sha256}{ext}, backed by a
+    shared blob, so a song any session already uploaded takes no extra space.
+    Returns a tuple of (relative_path, sha256_hash, created). created is False
+    when the session already had this file, e.g. from a concurrent upload of the
+    same song; the caller mustn't release it then, since a queued track may use it.
     """
-    session_dir = os.path.join(STATIC_DIR, "sessions", str(session_id))
+    session_dir = os.path.join(SESSIONS_DIR, str(session_id))
     os.makedirs(session_dir, exist_ok=True)
-    
-    # Generate a safe filename (or keep original if safe)
-    # For simplicity and to avoid collisions, prepend a UUID
-    file_ext = os.path.splitext(file.filename)[1]
-    safe_filename = f"{uuid.uuid4()}{file_ext}"
-    file_path = os.path.join(session_dir, safe_filename)
-    
-    sha256_hash = hashlib.sha256()
-    
-    async with aiofiles.open(file_path, 'wb') as out_file:
-        while content := await file.read(1024 * 1024):  # Read 1MB chunks
-            sha256_hash.update(content)
-            await out_file.write(content)
-            
+    os.makedirs(BLOB_TMP_DIR, exist_ok=True)
+
+    # Copying and hashing happen in a thread; hashlib releases the GIL for large chunks
+    tmp_path, file_hash = await asyncio.to_thread(_spool_and_hash, file.file, BLOB_TMP_DIR)
+
+    file_ext = os.path.splitext(file.filename or "")[1].lower()
+    filename = f"{file_hash}{file_ext}"
+    created = await asyncio.to_thread(_store, tmp_path, file_hash, os.path.join(session_dir, filename))
+
     # Return the URL path and the hash
-    return f"/static/sessions/{session_id}/{safe_filename}", sha256_hash.hexdigest()
+    return f"/static/sessions/{session_id}/{filename}", file_hash, created
+
+
+def playback_url(url_path: str, file_hash: str) -> str:
+    """Where players fetch a stored upload: the audio endpoint, for anything in the blob store."""
+    if os.path.basename(url_path).startswith(file_hash):
+        return f"/api/audio/{file_hash}"
+    return url_path  # stored before the blob store existed; still under /static
+
+
+def local_path(url_path: str) -> str:
+    """Maps a /static/... URL path to the file behind it (relative to the backend root)."""
+    return url_path.lstrip("/")
+
+
+def _blob_for(path: str) -> str | None:
+    file_hash = os.path.splitext(os.path.basename(path))[0]
+    if len(file_hash) != 64:
+        return None  # stored before the blob store existed
+    return blob_path(file_hash)
+
+
+def _release(paths: list[str]) -> int:
+    """Unlinks session files and collects their blobs. Returns the bytes freed."""
+    freed = 0
+    with _blob_lock:
+        blobs = {_blob_for(path) for path in paths} - {None}
+        for path in paths:
+            try:
+                if _blob_for(path) is None:
+                    freed += os.stat(path).st_size
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        for blob in blobs:
+            freed += _collect(blob)
+    return freed
+
+
+def _is_rendition(name: str) -> bool:
+    # Transcoded renditions sit next to their source as <sha>-<profile>.<ext>
+    return "-" in name
+
+
+def _remove_renditions(blob: str) -> int:
+    freed = 0
+    directory, name = os.path.split(blob)
+    for entry in os.scandir(directory):
+        if entry.name.startswith(name + "-"):
+            freed += entry.stat().st_size
+            os.unlink(entry.path)
+    return freed
+
+
+def _collect(blob: str) -> int:
+    try:
+        stat = os.stat(blob)
+        if stat.st_nlink <= 1:
+            os.unlink(blob)
+            return stat.st_size + _remove_renditions(blob)
+    except FileNotFoundError:
+        pass
+    return 0
+
+
+async def release_file(url_path: str):
+    """Removes a session file and its blob once nothing else links to it."""
+    await asyncio.to_thread(_release, [local_path(url_path)])
+
+
+async def evict_files(url_paths: list[str]) -> int:
+    """Removes session files to reclaim space. Returns the bytes actually freed."""
+    return await asyncio.to_thread(_release, [local_path(url_path) for url_path in url_paths])
+
+
+def _mark_served(file_hash: str):
+    try:
+        # Owners may set the times of a read-only blob
+        os.utime(blob_path(file_hash))
+    except OSError:
+        pass  # evicted, or stored before the blob store existed
+
+
+async def mark_served(file_hash: str):
+    """
+    Records that an upload was just streamed or popped, as its blob's mtime:
+    access times aren't kept on relatime or noatime mounts, and blobs are never
+    modified, so mtime is free to track when a song was last used.
+    """
+    await asyncio.to_thread(_mark_served, file_hash)
+
+
+def _session_files(session_id: uuid.UUID) -> list[tuple[str, str, int, float]]:
+    session_dir = os.path.join(SESSIONS_DIR, str(session_id))
+    if not os.path.isdir(session_dir):
+        return []
+    files = []
+    for entry in os.scandir(session_dir):
+        if entry.is_file():
+            stat = entry.stat()
+            file_hash = os.path.splitext(entry.name)[0]
+            files.append((f"/static/sessions/{session_id}/{entry.name}", file_hash, stat.st_size, stat.st_mtime))
+    return files
+
+
+async def session_files(session_id: uuid.UUID) -> list[tuple[str, str, int, float]]:
+    """
+    (url path, file hash, size, last served) for each of a session's uploads.
+    A session file shares its inode with the blob, so the time is the blob's:
+    the last time any session streamed or popped that song (see mark_served).
+    """
+    return await asyncio.to_thread(_session_files, session_id)
+
+
+def _sessions_with_files() -> list[uuid.UUID]:
+    if not os.path.isdir(SESSIONS_DIR):
+        return []
+    session_ids = []
+    for entry in os.scandir(SESSIONS_DIR):
+        try:
+            session_ids.append(uuid.UUID(entry.name))
+        except ValueError:
+            continue
+    return session_ids
+
+
+async def sessions_with_files() -> list[uuid.UUID]:
+    return await asyncio.to_thread(_sessions_with_files)
+
+
+async def release_session_files(session_id: uuid.UUID):
+    """Removes a deleted session's files, collecting the blobs only it used."""
+    session_dir = os.path.join(SESSIONS_DIR, str(session_id))
+
+    def release():
+        if not os.path.isdir(session_dir):
+            return
+        _release([entry.path for entry in os.scandir(session_dir) if entry.is_file()])
+        shutil.rmtree(session_dir, ignore_errors=True)
+
+    await asyncio.to_thread(release)
+
+
+def _collect_garbage() -> int:
+    removed = 0
+    with _blob_lock:
+        if os.path.isdir(BLOB_TMP_DIR):
+            # Spooled uploads a crash left behind
+            for entry in os.scandir(BLOB_TMP_DIR):
+                os.unlink(entry.path)
+        for root, _, files in os.walk(BLOB_DIR):
+            if root == BLOB_TMP_DIR:
+                continue
+            for name in files:
+                path = os.path.join(root, name)
+                if _is_rendition(name):
+                    # Renditions go with their source; remove those that lost it,
+                    # and partial ones a crash left behind
+                    source = os.path.join(root, name.split("-", 1)[0])
+                    if name.endswith(".part") or not os.path.exists(source):
+                        os.unlink(path)
+                elif os.stat(path).st_nlink <= 1:
+                    os.unlink(path)
+                    _remove_renditions(path)
+                    removed += 1
+    return removed
+
+
+async def collect_garbage() -> int:
+    """Deletes blobs no session links to any more. Returns how many were removed."""
+    return await asyncio.to_thread(_collect_garbage)
+
+
+def _blob_stats() -> dict:
+    blobs = 0
+    blob_bytes = 0
+    links = 0
+    renditions = 0
+    rendition_bytes = 0
+    for root, _, files in os.walk(BLOB_DIR):
+        if root == BLOB_TMP_DIR:
+            continue
+        for name in files:
+            stat = os.stat(os.path.join(root, name))
+            if _is_rendition(name):
+                renditions += 1
+                rendition_bytes += stat.st_size
+                continue
+            blobs += 1
+            blob_bytes += stat.st_size
+            links += stat.st_nlink - 1
+    return {
+        "blobs": blobs,
+        "bytes": blob_bytes,
+        "session_files": links,
+        "renditions": renditions,
+        "rendition_bytes": rendition_bytes,
+    }
+
+
+async def blob_stats() -> dict:
+    return await asyncio.to_thread(_blob_stats)
@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import settings
+from core.database import AsyncSessionLocal
+from core.websocket_manager import manager
+from models.queue import Queue as QueueModel
+from models.session import Session as SessionModel
+from models.track import SourceType
+from schemas.queue import QueueItem
+from services import file_service, playback_service, queue_service, session_state, vote_aggregator
+
+logger = logging.getLogger(__name__)
+
+# (session_id, file hash) -> monotonic time a popped upload may still be playing until
+_playing: dict[tuple[uuid.UUID, str], float] = {}
+
+_disk_full = False  # over the global quota with nothing left to evict
+
+_stats = {
+    "sessions_expired": 0,
+    "files_evicted": 0,
+    "bytes_freed": 0,
+    "uploads_rejected": 0,
+    "disk_bytes": 0,
+}
+
+
+async def note_popped(item: QueueItem):
+    """Keeps a popped upload's file safe from quota eviction while it plays."""
+    if item.track.source_type == SourceType.FILE and item.track.canonical_id:
+        until = time.monotonic() + item.track.duration + settings.PLAYING_GRACE
+        _playing[(item.session_id, item.track.canonical_id)] = until
+        await file_service.mark_served(item.track.canonical_id)
+
+
+async def release_session(session_id: uuid.UUID):
+    """Forgets everything held for a deleted session and removes its files."""
+    session_state.discard(session_id)
+    vote_aggregator.discard_session(session_id)
+    queue_service.discard_session(session_id)
+    playback_service.discard(session_id)
+    for key in [key for key in _playing if key[0] == session_id]:
+        del _playing[key]
+    await file_service.release_session_files(session_id)
+
+
+async def _touch_connected():
+    """Marks the sessions with clients on this worker as active."""
+    session_ids = list(manager.active_connections)
+    if not session_ids:
+        return
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(SessionModel)
+            .where(SessionModel.id.in_(session_ids))
+            .values(last_active_at=datetime.now(timezone.utc))
+        )
+        await db.commit()
+
+
+async def expire_idle_sessions() -> int:
+    """
+    Deletes sessions nobody has been connected to for SESSION_EXPIRE_AFTER
+    seconds, a batch at a time. Their tracks, queue, users and votes go with
+    them via ON DELETE CASCADE.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.SESSION_EXPIRE_AFTER)
+    connected = list(manager.active_connections)
+    idle = (
+        select(SessionModel.id)
+        .where(SessionModel.last_active_at < cutoff, SessionModel.id.not_in(connected))
+        .order_by(SessionModel.last_active_at)
+        .limit(settings.SESSION_EXPIRE_BATCH)
+        # Another worker reaping at the same time takes the next batch
+        .with_for_update(skip_locked=True)
+    )
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            delete(SessionModel).where(SessionModel.id.in_(idle.scalar_subquery())).returning(SessionModel.id)
+        )
+        expired = result.scalars().all()
+        await db.commit()
+
+    for session_id in expired:
+        await release_session(session_id)
+    _stats["sessions_expired"] += len(expired)
+    return len(expired)
+
+
+async def _queued_hashes(session_ids: list[uuid.UUID], db: AsyncSession) -> dict[uuid.UUID, set[str]]:
+    """The uploads still waiting in each session's queue, which must never be evicted."""
+    queued = {session_id: set() for session_id in session_ids}
+    result = await db.execute(
+        select(QueueModel.session_id, QueueModel.canonical_id)
+        .where(QueueModel.session_id.in_(session_ids), QueueModel.canonical_id.is_not(None))
+    )
+    for session_id, canonical_id in result:
+        queued[session_id].add(canonical_id)
+    if settings.SESSION_STATE_ENGINE:
+        # Memory is the source of truth for loaded sessions; the database may lag
+        for session_id in session_ids:
+            items = session_state.ranked_items(session_id)
+            if items:
+                queued[session_id] = {item.track.canonical_id for item in items if item.track.canonical_id}
+    return queued
+
+
+def _cold(
+    session_id: uuid.UUID,
+    files: list[tuple[str, str, int, float]],
+    queued: set[str]
+) -> list[tuple[str, str, int, float]]:
+    """Files of played tracks, least recently served first."""
+    now = time.monotonic()
+    return sorted(
+        (
+            entry for entry in files
+            if entry[1] not in queued and _playing.get((session_id, entry[1]), 0) < now
+        ),
+        key=lambda entry: entry[3]
+    )
+
+
+async def _evict(url_paths: list[str]) -> int:
+    freed = await file_service.evict_files(url_paths)
+    _stats["files_evicted"] += len(url_paths)
+    _stats["bytes_freed"] += freed
+    return freed
+
+
+async def release_upload(session_id: uuid.UUID, url_path: str, file_hash: str, db: AsyncSession):
+    """
+    Removes the file of an upload that failed, unless a queued or playing track
+    uses it: session files are named by content, so a concurrent upload of the
+    same song may have queued it in the meantime.
+    """
+    queued = await _queued_hashes([session_id], db)
+    if file_hash in queued[session_id] or _playing.get((session_id, file_hash), 0) >= time.monotonic():
+        return
+    await file_service.release_file(url_path)
+
+
+async def enforce_session_quota(session_id: uuid.UUID, db: AsyncSession) -> bool:
+    """
+    Evicts a session's cold files while it's over SESSION_DISK_QUOTA_BYTES.
+    Returns False if it's still over, i.e. its queue alone is too big, or if
+    the store as a whole is full.
+    """
+    if _disk_full:
+        _stats["uploads_rejected"] += 1
+        return False
+
+    files = await file_service.session_files(session_id)
+    used = sum(entry[2] for entry in files)
+    if used > settings.SESSION_DISK_QUOTA_BYTES:
+        queued = await _queued_hashes([session_id], db)
+        victims = []
+        for url_path, _, size, _ in _cold(session_id, files, queued[session_id]):
+            if used <= settings.SESSION_DISK_QUOTA_BYTES:
+                break
+            victims.append(url_path)
+            used -= size
+        if victims:
+            await _evict(victims)
+
+    if used > settings.SESSION_DISK_QUOTA_BYTES:
+        _stats["uploads_rejected"] += 1
+        return False
+    return True
+
+
+async def enforce_disk_quota() -> int:
+    """
+    Keeps the whole upload store under DISK_QUOTA_BYTES by evicting cold files,
+    from the longest-idle sessions first. Returns the bytes freed.
+    """
+    global _disk_full
+    stats = await file_service.blob_stats()
+    used = stats["bytes"] + stats["rendition_bytes"]
+    _stats["disk_bytes"] = used
+    if used <= settings.DISK_QUOTA_BYTES:
+        _disk_full = False
+        return 0
+
+    session_ids = await file_service.sessions_with_files()
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(SessionModel.id)
+            .where(SessionModel.id.in_(session_ids))
+            .order_by(SessionModel.last_active_at)
+        )
+        by_idleness = result.scalars().all()
+        queued = await _queued_hashes(by_idleness, db)
+
+    freed = 0
+    # Files of sessions deleted while a release was failing or interrupted
+    for session_id in set(session_ids) - set(by_idleness):
+        await file_service.release_session_files(session_id)
+    for session_id in by_idleness:
+        files = await file_service.session_files(session_id)
+        for url_path, _, _, _ in _cold(session_id, files, queued[session_id]):
+            if used - freed <= settings.DISK_QUOTA_BYTES:
+                break
+            # Frees nothing until the last session linking the blob lets go of it
+            freed += await _evict([url_path])
+
+    _stats["disk_bytes"] = used - freed
+    _disk_full = used - freed > settings.DISK_QUOTA_BYTES
+    if _disk_full:
+        logger.warning("Upload store is over quota with nothing left to evict (%d bytes)", used - freed)
+    return freed
+
+
+async def run_lifecycle():
+    """Background task: records activity, expires idle sessions and enforces the disk quota."""
+    while True:
+        try:
+            await _touch_connected()
+            while await expire_idle_sessions() == settings.SESSION_EXPIRE_BATCH:
+                pass
+            await enforce_disk_quota()
+            playback_service.prune()
+            now = time.monotonic()
+            for key in [key for key, until in _playing.items() if until < now]:
+                del _playing[key]
+        except Exception:
+            logger.exception("Error in session lifecycle")
+        await asyncio.sleep(settings.LIFECYCLE_INTERVAL)
+
+
+def lifecycle_stats() -> dict:
+    return {
+        **_stats,
+        "disk_full": _disk_full,
+        "disk_quota_bytes": settings.DISK_QUOTA_BYTES,
+        "session_quota_bytes": settings.SESSION_DISK_QUOTA_BYTES,
+        "expire_after_seconds": settings.SESSION_EXPIRE_AFTER,
+    }
@@ -0,0 +1,177 @@
+import json
+import logging
+import time
+import uuid
+
+from core.config import settings
+from core.websocket_manager import manager
+
+logger = logging.getLogger(__name__)
+
+# Control messages that change what a session is playing; every worker applies
+# them as they're delivered, so any of them can answer for the session
+PLAYBACK_TYPES = {"track_started", "track_progress", "pause", "resume", "seek", "volume_change", "clear_player", "state_update"}
+
+_stats = {
+    "progress_relayed": 0,
+    "progress_dropped": 0,  # coalesced into the next relayed update
+    "snapshots_sent": 0,
+    "requests_relayed": 0,  # state requests only the host could answer
+}
+
+
+class _Playback:
+    """What a session's host is playing, as last reported."""
+    __slots__ = ("track", "position", "reported_at", "duration", "playing", "volume", "relayed_at", "known")
+
+    def __init__(self):
+        self.track: dict | None = None  # {track_id, title, duration, playback_url}
+        self.position = 0.0  # seconds into the track at reported_at
+        self.reported_at = time.monotonic()
+        self.duration = 0.0
+        self.playing = False
+        self.volume: float | None = None
+        self.relayed_at = 0.0  # monotonic time progress was last relayed
+        # Whether what's playing has been reported at all. Progress and volume
+        # alone, e.g. on a worker started mid-track, don't say which track it is.
+        self.known = False
+
+    def seek(self, position: float):
+        self.position = float(position)
+        self.reported_at = time.monotonic()
+
+    def current_time(self) -> float:
+        if not self.playing:
+            return self.position
+        position = self.position + time.monotonic() - self.reported_at
+        return min(position, self.duration) if self.duration else position
+
+
+# session_id -> playback state
+_states: dict[uuid.UUID, _Playback] = {}
+
+
+def _apply(state: _Playback, msg_type: str, payload: dict):
+    if msg_type == "track_started":
+        state.track = {
+            "track_id": payload.get("track_id"),
+            "title": payload.get("title"),
+            "duration": payload.get("duration", 0),
+            "playback_url": payload.get("playback_url", ""),
+        }
+        state.duration = float(payload.get("duration") or 0)
+        state.playing = True
+        state.known = True
+        state.seek(0)
+    elif msg_type == "track_progress":
+        state.duration = float(payload.get("duration") or state.duration)
+        state.seek(payload.get("currentTime", 0))
+    elif msg_type == "seek":
+        state.seek(payload.get("time", 0))
+    elif msg_type in ("pause", "resume"):
+        state.seek(state.current_time())
+        state.playing = msg_type == "resume"
+    elif msg_type == "volume_change":
+        state.volume = payload.get("volume")
+    elif msg_type == "clear_player":
+        state.track = None
+        state.duration = 0.0
+        state.playing = False
+        state.known = True
+        state.seek(0)
+    elif msg_type == "state_update":
+        # The host's full answer to a request; take whatever it carries
+        if "currentTrack" in payload:
+            state.track = payload["currentTrack"]
+            state.known = True
+        if payload.get("volume") is not None:
+            state.volume = payload["volume"]
+        if payload.get("isPlaying") is not None:
+            state.playing = bool(payload["isPlaying"])
+        if payload.get("duration") is not None:
+            state.duration = float(payload["duration"] or 0)
+        if payload.get("currentTime") is not None:
+            state.seek(payload["currentTime"])
+
+
+def _observe(session_id: uuid.UUID, msg_type: str | None, frame: str):
+    if msg_type not in PLAYBACK_TYPES:
+        return
+    try:
+        payload = json.loads(frame).get("payload") or {}
+        _apply(_states.setdefault(session_id, _Playback()), msg_type, payload)
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.warning("Ignoring malformed %s for session %s: %s", msg_type, session_id, e)
+
+
+manager.observers.append(_observe)
+
+
+def relay_progress(session_id: uuid.UUID, payload: dict) -> bool:
+    """
+    Whether a host's progress report should go out to the session. Reports
+    arrive several times a second; at most one per PLAYBACK_PROGRESS_INTERVAL
+    is relayed and the rest only update the state held here.
+    """
+    state = _states.setdefault(session_id, _Playback())
+    now = time.monotonic()
+    if now - state.relayed_at >= settings.PLAYBACK_PROGRESS_INTERVAL:
+        state.relayed_at = now
+        _stats["progress_relayed"] += 1
+        return True
+    try:
+        _apply(state, "track_progress", payload)
+    except (ValueError, TypeError) as e:
+        logger.warning("Ignoring malformed track_progress for session %s: %s", session_id, e)
+    _stats["progress_dropped"] += 1
+    return False
+
+
+def snapshot(session_id: uuid.UUID) -> dict | None:
+    """The session's playback state as a state_update message, if it's known."""
+    state = _states.get(session_id)
+    if state is None or not state.known:
+        return None
+    return {
+        "type": "state_update",
+        "payload": {
+            "volume": state.volume,
+            "currentTrack": state.track,
+            "isPlaying": state.playing,
+            "currentTime": state.current_time(),
+            "duration": state.duration,
+        },
+    }
+
+
+def send_snapshot(websocket, session_id: uuid.UUID) -> bool:
+    """Sends the held state to one client. Returns False if there's nothing held yet."""
+    message = snapshot(session_id)
+    if message is None:
+        return False
+    manager.send_to(websocket, session_id, message)
+    _stats["snapshots_sent"] += 1
+    return True
+
+
+def request_relayed():
+    _stats["requests_relayed"] += 1
+
+
+def discard(session_id: uuid.UUID):
+    _states.pop(session_id, None)
+
+
+def prune():
+    """Forgets sessions nothing has been reported for in SESSION_EXPIRE_AFTER seconds."""
+    cutoff = time.monotonic() - settings.SESSION_EXPIRE_AFTER
+    for session_id in [session_id for session_id, state in _states.items() if state.reported_at < cutoff]:
+        del _states[session_id]
+
+
+def playback_stats() -> dict:
+    return {
+        **_stats,
+        "sessions": len(_states),
+        "progress_interval_seconds": settings.PLAYBACK_PROGRESS_INTERVAL,
+    }
@@ -0,0 +1,405 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import yt_dlp
+from sqlalchemy import select, func
+
+from core.cache import TTLCache
+from core.config import settings
+from core.database import AsyncSessionLocal
+from core.websocket_manager import manager
+from models.queue import Queue as QueueModel
+from models.track import Track as TrackModel, SourceType
+from schemas.queue import QueueItem
+from services import session_state
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = settings.PREFETCH_CACHE_DIR
+CACHE_TMP_DIR = os.path.join(CACHE_DIR, "tmp")
+
+# Extensions we keep, and what the audio endpoint serves them as
+MEDIA_TYPES = {"m4a": "audio/mp4", "webm": "audio/webm", "opus": "audio/ogg", "mp3": "audio/mpeg"}
+
+_DOWNLOAD_OPTS = {
+    # AAC in MP4 plays everywhere, Safari included
+    "format": "bestaudio[ext=m4a]/bestaudio[ext=webm]/bestaudio",
+    "outtmpl": os.path.join(CACHE_TMP_DIR, "%(id)s.%(ext)s"),
+    "quiet": True,
+    "no_warnings": True,
+    "noprogress": True,
+    "noplaylist": True,
+    "socket_timeout": 30,
+}
+
+# Downloads get their own pool, so they never hold up extractions and searches
+_executor = ThreadPoolExecutor(max_workers=settings.PREFETCH_CONCURRENCY, thread_name_prefix="prefetch")
+
+# CACHE_DIR is shared by every worker, so the files are the truth: a file's
+# mtime is when any worker last wanted or served it, and a popped track's is
+# set to when it stops playing. This is a per-worker view of them, refreshed on
+# every eviction pass.
+# video_id -> (file name, size), least recently used first
+_index: OrderedDict[str, tuple[str, int]] = OrderedDict()
+_index_bytes = 0
+
+_wanted: set[str] = set()  # the look-ahead of this worker's sessions, never evicted
+_jobs: dict[str, asyncio.Task] = {}
+_failed = TTLCache(max_size=1024, default_ttl=settings.YT_NEGATIVE_TTL)  # don't retry these yet
+_slots = asyncio.Semaphore(settings.PREFETCH_CONCURRENCY)
+_wakeup = asyncio.Event()
+
+# Files touched this recently are in some worker's look-ahead
+_WANTED_WINDOW = 3 * settings.PREFETCH_INTERVAL
+# A download lock older than this belongs to a worker that died mid-download
+_LOCK_STALE = 600.0
+
+_stats = {
+    "pops": 0,
+    "hits": 0,  # popped YouTube tracks served from the cache
+    "downloads": 0,
+    "failed": 0,
+    "evictions": 0,
+    "downloaded_bytes": 0,
+    "download_seconds": 0.0,
+}
+
+
+def _scan() -> list[tuple[float, str, str, int]]:
+    """(mtime, video_id, file name, size) of every cached track, least recently used first."""
+    entries = []
+    for entry in os.scandir(CACHE_DIR):
+        video_id, _, ext = entry.name.partition(".")
+        if ext in MEDIA_TYPES:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # evicted by another worker meanwhile
+            entries.append((stat.st_mtime, video_id, entry.name, stat.st_size))
+    return sorted(entries)
+
+
+def _set_index(entries: list[tuple[float, str, str, int]]):
+    global _index, _index_bytes
+    _index = OrderedDict((video_id, (name, size)) for _, video_id, name, size in entries)
+    _index_bytes = sum(size for _, _, _, size in entries)
+
+
+def _load_index():
+    os.makedirs(CACHE_TMP_DIR, exist_ok=True)
+    # Downloads a crash or restart cut short; recent ones may be another worker's
+    cutoff = time.time() - _LOCK_STALE
+    for entry in os.scandir(CACHE_TMP_DIR):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
+        except FileNotFoundError:
+            pass
+    _set_index(_scan())
+
+
+async def start():
+    """Picks up the audio cached by previous runs."""
+    await asyncio.to_thread(_load_index)
+    logger.info("Loaded %d prefetched tracks (%d MiB)", len(_index), _index_bytes // (1024 * 1024))
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
+
+
+def wake():
+    """Re-checks the queue heads now instead of at the next interval, e.g. after a pop."""
+    _wakeup.set()
+
+
+def _find_on_disk(video_id: str) -> tuple[str, int] | None:
+    for ext in MEDIA_TYPES:
+        name = f"{video_id}.{ext}"
+        try:
+            return name, os.stat(os.path.join(CACHE_DIR, name)).st_size
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def cached_file(video_id: str) -> tuple[str, str] | None:
+    """
+    Returns (path, media type) of a prefetched track, if it's in the cache.
+    Another worker may have downloaded it, so a miss here looks on disk too.
+    """
+    entry = _index.get(video_id)
+    if entry is None:
+        entry = _find_on_disk(video_id)
+        if entry is None:
+            return None
+        _adopt(video_id, *entry)
+    name, _ = entry
+    return os.path.join(CACHE_DIR, name), MEDIA_TYPES[name.rpartition(".")[2]]
+
+
+def _adopt(video_id: str, name: str, size: int):
+    global _index_bytes
+    if video_id in _index:
+        _index_bytes -= _index[video_id][1]
+    _index[video_id] = (name, size)
+    _index_bytes += size
+
+
+async def local_playback(item: QueueItem) -> QueueItem:
+    """
+    Points a popped YouTube track at its prefetched copy, so playback starts
+    from local disk instead of a signed URL resolved when the track was added.
+    """
+    track = item.track
+    if track.source_type != SourceType.YOUTUBE or not track.canonical_id:
+        return item
+    _stats["pops"] += 1
+    video_id = track.canonical_id
+    cached = await asyncio.to_thread(cached_file, video_id)
+    if cached is None:
+        return item
+
+    # Keep it while it plays, even once it's no longer in anyone's look-ahead:
+    # no worker evicts a file whose mtime is still ahead
+    path, _ = cached
+    if not await asyncio.to_thread(_touch, path, time.time() + track.duration + settings.PLAYING_GRACE):
+        _forget(video_id)  # another worker evicted it
+        return item
+    _stats["hits"] += 1
+    _index.move_to_end(video_id)
+    return item.model_copy(update={
+        "track": track.model_copy(update={"playback_url": f"/api/audio/yt/{video_id}"})
+    })
+
+
+def _touch(path: str, until: float | None = None) -> bool:
+    """
+    Marks a file used now, or kept until a later time; never moves an mtime back.
+    Returns False if the file is gone.
+    """
+    until = time.time() if until is None else until
+    try:
+        if os.stat(path).st_mtime < until:
+            os.utime(path, (until, until))
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _touch_all(paths: list[str]):
+    for path in paths:
+        _touch(path)
+
+
+def _forget(video_id: str):
+    global _index_bytes
+    entry = _index.pop(video_id, None)
+    if entry is not None:
+        _index_bytes -= entry[1]
+
+
+async def _upcoming_video_ids() -> list[str]:
+    """
+    The next PREFETCH_AHEAD YouTube tracks of every session with clients
+    connected to this worker, nearest to playing first.
+    """
+    session_ids = list(manager.active_connections)
+    if not session_ids:
+        return []
+
+    upcoming: list[tuple[int, str]] = []  # (place in its queue, video_id)
+    if settings.SESSION_STATE_ENGINE:
+        for session_id in session_ids:
+            items = [
+                item for item in session_state.ranked_items(session_id)
+                if item.track.source_type == SourceType.YOUTUBE and item.track.canonical_id
+                and item.track.duration <= settings.PREFETCH_MAX_DURATION
+            ]
+            upcoming += [(rank, item.track.canonical_id) for rank, item in enumerate(items[:settings.PREFETCH_AHEAD])]
+    else:
+        ranked = (
+            select(
+                TrackModel.canonical_id,
+                func.row_number().over(
+                    partition_by=QueueModel.session_id,
+                    order_by=(QueueModel.votes.desc(), QueueModel.position)
+                ).label("rank")
+            )
+            .join(QueueModel.track)
+            .where(
+                QueueModel.session_id.in_(session_ids),
+                TrackModel.source_type == SourceType.YOUTUBE,
+                TrackModel.canonical_id.is_not(None),
+                TrackModel.duration <= settings.PREFETCH_MAX_DURATION
+            )
+            .subquery()
+        )
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(ranked.c.rank, ranked.c.canonical_id).where(ranked.c.rank <= settings.PREFETCH_AHEAD)
+            )
+            upcoming = [tuple(row) for row in result]
+
+    upcoming.sort()
+    return list(dict.fromkeys(video_id for _, video_id in upcoming))
+
+
+def _take_lock(lock_path: str) -> bool:
+    """Claims a download across workers, taking over locks left by dead ones."""
+    for _ in range(2):
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if os.stat(lock_path).st_mtime >= time.time() - _LOCK_STALE:
+                    return False
+                os.unlink(lock_path)
+            except FileNotFoundError:
+                pass
+    return False
+
+
+_BUSY = object()  # _download() result when another worker is downloading it
+
+
+def _download(video_id: str) -> tuple[str, int] | None | object:
+    """
+    Blocking yt-dlp download of a video's audio into the cache. Runs on the prefetch pool.
+    Returns _BUSY if another worker holds the download, or has already finished it.
+    """
+    lock_path = os.path.join(CACHE_TMP_DIR, f"{video_id}.lock")
+    if not _take_lock(lock_path):
+        return _BUSY
+    try:
+        if _find_on_disk(video_id) is not None:
+            return _BUSY
+        return _fetch(video_id)
+    finally:
+        try:
+            os.unlink(lock_path)
+        except FileNotFoundError:
+            pass
+
+
+def _fetch(video_id: str) -> tuple[str, int] | None:
+    try:
+        with yt_dlp.YoutubeDL(dict(_DOWNLOAD_OPTS)) as ydl:
+            info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=True)
+            tmp_path = info["requested_downloads"][0]["filepath"]
+    except Exception as e:
+        logger.warning("Error prefetching %s: %s", video_id, e)
+        return None
+
+    ext = tmp_path.rpartition(".")[2]
+    if ext not in MEDIA_TYPES:
+        logger.warning("Prefetched %s as unsupported .%s; dropping it", video_id, ext)
+        os.unlink(tmp_path)
+        return None
+    name = f"{video_id}.{ext}"
+    os.replace(tmp_path, os.path.join(CACHE_DIR, name))
+    return name, os.stat(os.path.join(CACHE_DIR, name)).st_size
+
+
+async def _prefetch(video_id: str):
+    loop = asyncio.get_running_loop()
+    async with _slots:
+        # The queue may have moved on while this waited for a slot
+        if video_id not in _wanted:
+            return
+        started = time.perf_counter()
+        downloaded = await loop.run_in_executor(_executor, _download, video_id)
+    if downloaded is _BUSY:
+        return  # the next eviction pass picks it up from disk
+    if downloaded is None:
+        _stats["failed"] += 1
+        _failed.set(video_id, True)
+        return
+
+    name, size = downloaded
+    _stats["downloads"] += 1
+    _stats["downloaded_bytes"] += size
+    _stats["download_seconds"] += time.perf_counter() - started
+    _adopt(video_id, name, size)
+    await _evict()
+
+
+def _evict_files(wanted: set[str]) -> tuple[list[tuple[float, str, str, int]], int]:
+    """
+    Drops least recently used files until the shared cache fits. Spares this
+    worker's look-ahead, files another worker touched within _WANTED_WINDOW,
+    and playing ones, whose mtime is still ahead. Returns (what's left, evictions).
+    """
+    entries = _scan()
+    total = sum(size for _, _, _, size in entries)
+    keep_after = time.time() - _WANTED_WINDOW
+    kept, evicted = [], 0
+    for entry in entries:
+        mtime, video_id, name, size = entry
+        if total > settings.PREFETCH_CACHE_MAX_BYTES and video_id not in wanted and mtime < keep_after:
+            try:
+                os.unlink(os.path.join(CACHE_DIR, name))
+                evicted += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+            continue
+        kept.append(entry)
+    return kept, evicted
+
+
+async def _evict():
+    """Fits the cache to PREFETCH_CACHE_MAX_BYTES, counting every worker's files."""
+    entries, evicted = await asyncio.to_thread(_evict_files, set(_wanted))
+    _set_index(entries)
+    _stats["evictions"] += evicted
+
+
+async def run_prefetcher():
+    """Background task: keeps the look-ahead of every watched queue on local disk."""
+    global _wanted
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), settings.PREFETCH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+        try:
+            upcoming = await _upcoming_video_ids()
+        except Exception:
+            logger.exception("Error reading queue heads for prefetch")
+            continue
+
+        _wanted = set(upcoming)
+        # Tells other workers these are wanted, so they don't evict them
+        await asyncio.to_thread(_touch_all, [
+            os.path.join(CACHE_DIR, _index[video_id][0]) for video_id in upcoming if video_id in _index
+        ])
+        for video_id in upcoming:
+            if video_id in _index:
+                _index.move_to_end(video_id)
+            elif video_id not in _jobs and _failed.get(video_id) is None:
+                job = asyncio.create_task(_prefetch(video_id))
+                _jobs[video_id] = job
+                job.add_done_callback(lambda _, video_id=video_id: _jobs.pop(video_id, None))
+        await _evict()
+
+
+def prefetch_stats() -> dict:
+    downloads = _stats["downloads"]
+    return {
+        **_stats,
+        "enabled": settings.PREFETCH_ENABLED,
+        "cached_tracks": len(_index),
+        "cached_bytes": _index_bytes,
+        "max_bytes": settings.PREFETCH_CACHE_MAX_BYTES,
+        "in_flight": len(_jobs),
+        "wanted": len(_wanted),
+        "hit_ratio": _stats["hits"] / _stats["pops"] if _stats["pops"] else 0.0,
+        "avg_download_ms": round(_stats["download_seconds"] * 1000 / downloads, 1) if downloads else 0.0,
+    }
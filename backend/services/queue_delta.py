@@ -0,0 +1,32 @@
+import uuid
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.session import Session as SessionModel
+from core.websocket_manager import manager
+
+
+async def bump_queue_version(session_id: uuid.UUID, db: AsyncSession, by: int = 1) -> int:
+    """
+    Advances the session's queue version in the current transaction and returns it.
+    The row lock this takes also serializes concurrent mutations of the same queue.
+    """
+    result = await db.execute(
+        update(SessionModel)
+        .where(SessionModel.id == session_id)
+        .values(queue_version=SessionModel.queue_version + by)
+        .returning(SessionModel.queue_version)
+    )
+    return result.scalar_one()
+
+
+async def broadcast_queue_delta(session_id: uuid.UUID, version: int, op: str, **fields):
+    """
+    Tells clients how the queue changed instead of making them refetch it.
+    Deltas are idempotent, and a client that sees a gap in versions refetches a snapshot.
+    """
+    message = {
+        "type": "queue_delta",
+        "payload": {"version": version, "op": op, **fields}
+    }
+    await manager.broadcast(message, session_id)
@@ -1,29 +1,42 @@
+import asyncio
+import logging
 import uuid
+import zlib
+from typing import AsyncIterator
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, update, delete, exists, true
+from sqlalchemy.orm import selectinload, joinedload, aliased, contains_eager
 
 from models.session import Session as SessionModel
 from models.track import Track as TrackModel, SourceType
 from models.queue import Queue as QueueModel
 from models.user import User as UserModel
 from schemas.queue import QueueItem
-from services import yt_service
-from core.websocket_manager import manager
+from services import file_service, yt_service, vote_aggregator, session_state
+from core.cache import TTLCache
+from core.config import settings
+from core.database import AsyncSessionLocal
+from services.queue_delta import bump_queue_version, broadcast_queue_delta
+
+logger = logging.getLogger(__name__)
+
 
 async def _add_track_to_db_and_queue(session_id: uuid.UUID, track: TrackModel, db: AsyncSession) -> QueueModel:
     """Helper to add a track to the database and queue, and broadcast update."""
-    
+    if settings.SESSION_STATE_ENGINE:
+        return await session_state.add_track(session_id, track)
+
+    version = await bump_queue_version(session_id, db)
+
     # Check for duplicates in the active queue
     if track.canonical_id:
-        # Check if this track ID is already in the queue for this session
-        # We need to join Queue -> Track
+        # Check if this track ID is already in the queue for this session.
+        # uq_queue_session_canonical enforces it; this just gives a friendly error.
         query = (
-            select(QueueModel)
-            .join(QueueModel.track)
+            select(QueueModel.id)
             .where(
                 QueueModel.session_id == session_id,
-                TrackModel.canonical_id == track.canonical_id
+                QueueModel.canonical_id == track.canonical_id
             )
         )
         result = await db.execute(query)
@@ -35,16 +48,14 @@ async def _add_track_to_db_and_queue(session_id: uuid.UUID, track: TrackModel, d
     db.add(track)
     await db.flush()
 
-    # Find the next position in the queue
-    max_pos_result = await db.execute(select(func.max(QueueModel.position)).where(QueueModel.session_id == session_id))
-    max_pos = max_pos_result.scalar_one_or_none()
-    next_position = (max_pos + 1) if max_pos is not None else 0
-
-    # Create a new Queue record
+    # Create a new Queue record. The version is unique and increasing per
+    # session, so it doubles as the item's insertion order.
     new_queue_item = QueueModel(
         session_id=session_id,
         track_id=track.id,
-        position=next_position
+        position=version,
+        canonical_id=track.canonical_id,
+        playback_expires_at=yt_service.playback_url_expires_at(track.playback_url)
     )
     db.add(new_queue_item)
     await db.flush()
@@ -63,21 +74,43 @@ async def _add_track_to_db_and_queue(session_id: uuid.UUID, track: TrackModel, d
     final_queue_item = result.scalar_one()
 
     # Broadcast queue update
-    message = {
-        "type": "queue_update",
-        "payload": QueueItem.model_validate(final_queue_item).model_dump(mode="json")
-    }
-    await manager.broadcast(message, session_id)
+    await broadcast_queue_delta(
+        session_id, version, "added",
+        item=QueueItem.model_validate(final_queue_item).model_dump(mode="json")
+    )
 
     return final_queue_item
 
 
-async def _get_user_nickname(user_id: str | None, db: AsyncSession) -> str | None:
+async def session_exists(session_id: uuid.UUID, db: AsyncSession) -> bool:
+    if settings.SESSION_STATE_ENGINE:
+        return await session_state.get_state(session_id) is not None
+    return await db.get(SessionModel, session_id) is not None
+
+
+# session_id -> True for sessions known to exist, so WebSocket connects rarely touch the database
+_known_sessions = TTLCache(max_size=settings.SESSION_EXISTS_CACHE_SIZE, default_ttl=settings.SESSION_EXISTS_TTL)
+
+
+async def session_exists_cached(session_id: uuid.UUID) -> bool:
+    """session_exists() on a short-lived DB session, with hits remembered for SESSION_EXISTS_TTL."""
+    if _known_sessions.get(session_id):
+        return True
+    async with AsyncSessionLocal() as db:
+        found = await session_exists(session_id, db)
+    if found:
+        _known_sessions.set(session_id, True)
+    return found
+
+
+async def _get_user_nickname(session_id: uuid.UUID, user_id: str | None, db: AsyncSession) -> str | None:
     """Helper to get user nickname from user_id."""
     if not user_id:
         return None
     try:
         user_uuid = uuid.UUID(user_id)
+        if settings.SESSION_STATE_ENGINE:
+            return await session_state.get_nickname(session_id, user_uuid)
         result = await db.execute(select(UserModel).where(UserModel.id == user_uuid))
         user = result.scalar_one_or_none()
         return user.nickname if user else None
@@ -93,17 +126,38 @@ async def add_track_to_queue(session_id: uuid.UUID, source_url: str, user_id: st
     session = await db.get(SessionModel, session_id)
     if not session:
         raise ValueError("Session not found")
+    # Resolving can take up to YTDLP_TIMEOUT; don't sit idle in a transaction
+    # holding a pooled connection meanwhile. The session reconnects for the insert.
+    await db.close()
+
+    track_info = await resolve_youtube_track(source_url)
+    return await add_resolved_track_to_queue(session_id, source_url, track_info, user_id, db)
+
 
-    # Get track info from YouTube
-    track_info = yt_service.get_youtube_track_info(source_url)
+async def resolve_youtube_track(source_url: str) -> yt_service.YouTubeTrackInfo:
+    """Gets a video's track info from YouTube. Needs no database connection."""
+    track_info = await yt_service.get_youtube_track_info(source_url)
     if not track_info:
         raise ValueError("Could not fetch YouTube track info")
+    return track_info
+
+
+async def add_resolved_track_to_queue(
+    session_id: uuid.UUID,
+    source_url: str,
+    track_info: yt_service.YouTubeTrackInfo,
+    user_id: str | None,
+    db: AsyncSession
+) -> QueueModel:
+    """Queues a track resolve_youtube_track() already looked up."""
+    if not settings.SESSION_STATE_ENGINE and await db.get(SessionModel, session_id) is None:
+        raise ValueError("Session not found")
 
     # Extract video ID for canonical_id
     video_id = yt_service.extract_video_id(source_url)
 
     # Get user nickname
-    added_by = await _get_user_nickname(user_id, db)
+    added_by = await _get_user_nickname(session_id, user_id, db)
 
     # Create a new Track record
     new_track = TrackModel(
@@ -119,88 +173,326 @@ async def add_track_to_queue(session_id: uuid.UUID, source_url: str, user_id: st
     
     return await _add_track_to_db_and_queue(session_id, new_track, db)
 
-async def get_queue(session_id: uuid.UUID, user_id: str | None, db: AsyncSession):
-    query = (
+async def _add_tracks_to_db_and_queue(session_id: uuid.UUID, tracks: list[TrackModel], db: AsyncSession) -> list[QueueItem]:
+    """Adds many tracks in one transaction with a single broadcast, skipping ones already queued."""
+    if settings.SESSION_STATE_ENGINE:
+        return await session_state.add_tracks(session_id, tracks)
+
+    # Every mutation locks the session row first, so the duplicate check below holds until commit
+    since = (await db.execute(
+        select(SessionModel.queue_version).where(SessionModel.id == session_id).with_for_update()
+    )).scalar_one()
+    queued = await _queued_canonical_ids(session_id, [track.canonical_id for track in tracks], db)
+    new_tracks = []
+    for track in tracks:
+        if track.canonical_id not in queued:
+            queued.add(track.canonical_id)
+            new_tracks.append(track)
+    if not new_tracks:
+        await db.rollback()
+        return []
+
+    # One version per track keeps positions unique; the delta covers them all
+    version = await bump_queue_version(session_id, db, by=len(new_tracks))
+    db.add_all(new_tracks)
+    await db.flush()
+    new_queue_items = [
+        QueueModel(
+            session_id=session_id,
+            track_id=track.id,
+            position=since + offset,
+            canonical_id=track.canonical_id,
+            playback_expires_at=yt_service.playback_url_expires_at(track.playback_url)
+        )
+        for offset, track in enumerate(new_tracks, start=1)
+    ]
+    db.add_all(new_queue_items)
+    await db.flush()
+    new_ids = [queue_item.id for queue_item in new_queue_items]
+    await db.commit()
+
+    result = await db.execute(
         select(QueueModel)
-        .where(QueueModel.session_id == session_id)
+        .where(QueueModel.id.in_(new_ids))
         .options(selectinload(QueueModel.track))
         .order_by(QueueModel.position)
     )
-    result = await db.execute(query)
-    queue_items = result.scalars().all()
-
-    # If user_id is provided, fetch their votes
-    user_votes_map = {}
-    if user_id:
-        try:
-            user_uuid = uuid.UUID(user_id)
-            vote_query = select(VoteModel).where(
-                VoteModel.user_id == user_uuid,
-                VoteModel.queue_item_id.in_([item.id for item in queue_items])
-            )
-            vote_result = await db.execute(vote_query)
-            user_votes = vote_result.scalars().all()
-            user_votes_map = {vote.queue_item_id: vote.vote_value for vote in user_votes}
-        except ValueError:
-            pass
+    items = [QueueItem.model_validate(queue_item) for queue_item in result.scalars().all()]
+
+    await broadcast_queue_delta(
+        session_id, version, "added_many", since=since,
+        items=[item.model_dump(mode="json") for item in items]
+    )
+    return items
+
+
+async def _queued_canonical_ids(session_id: uuid.UUID, canonical_ids: list[str], db: AsyncSession) -> set[str]:
+    if settings.SESSION_STATE_ENGINE:
+        state = await session_state.get_state(session_id)
+        return {canonical_id for canonical_id in canonical_ids if state and canonical_id in state.canonical_ids}
+    result = await db.execute(
+        select(QueueModel.canonical_id).where(
+            QueueModel.session_id == session_id,
+            QueueModel.canonical_id.in_(canonical_ids)
+        )
+    )
+    return set(result.scalars().all())
+
+
+async def import_tracks(
+    session_id: uuid.UUID,
+    source_urls: list[str],
+    user_id: str | None,
+    db: AsyncSession
+) -> AsyncIterator[dict]:
+    """
+    Adds YouTube videos and playlists to the queue in bulk, yielding progress
+    events as it goes. Playlists are expanded with a flat extraction, songs
+    already queued are skipped before anything is extracted, the rest are
+    resolved concurrently, and everything is inserted in one transaction.
+    """
+    video_urls = []
+    for source_url in source_urls:
+        if yt_service.extract_playlist_id(source_url):
+            expanded = await yt_service.expand_playlist(source_url)
+            yield {"event": "expanded", "url": source_url, "count": len(expanded)}
+            video_urls += expanded
+        else:
+            video_urls.append(source_url)
+
+    # video_id -> URL, first occurrence wins
+    wanted: dict[str, str] = {}
+    invalid = []
+    for url in video_urls:
+        video_id = yt_service.extract_video_id(url)
+        if video_id:
+            wanted.setdefault(video_id, url)
+        else:
+            invalid.append(url)
+    queued = await _queued_canonical_ids(session_id, list(wanted), db)
+    duplicates = [video_id for video_id in wanted if video_id in queued]
+    pending = [video_id for video_id in wanted if video_id not in queued][:settings.PLAYLIST_MAX_TRACKS]
+    # Hand the connection back to the pool while waiting on YouTube
+    await db.close()
+    yield {"event": "resolving", "total": len(pending), "duplicates": len(duplicates), "invalid": len(invalid)}
+
+    # Bounded per import, so one big playlist can't take over the yt-dlp pool
+    slots = asyncio.Semaphore(settings.PLAYLIST_IMPORT_CONCURRENCY)
+
+    async def resolve(video_id: str):
+        async with slots:
+            return video_id, await yt_service.get_youtube_track_info(wanted[video_id])
+
+    resolved = {}
+    failed = []
+    for done, next_result in enumerate(asyncio.as_completed([resolve(video_id) for video_id in pending]), start=1):
+        video_id, track_info = await next_result
+        if track_info:
+            resolved[video_id] = track_info
+        else:
+            failed.append(video_id)
+        yield {
+            "event": "resolved", "done": done, "total": len(pending), "video_id": video_id,
+            "title": track_info.title if track_info else None,
+        }
+
+    added_by = await _get_user_nickname(session_id, user_id, db)
+    tracks = [
+        TrackModel(
+            session_id=session_id,
+            title=resolved[video_id].title,
+            duration=resolved[video_id].duration,
+            source_type=SourceType.YOUTUBE,
+            source_url=wanted[video_id],
+            playback_url=str(resolved[video_id].playback_url),
+            added_by=added_by,
+            canonical_id=video_id
+        )
+        # In playlist order, whatever order they resolved in
+        for video_id in pending if video_id in resolved
+    ]
+    items = await _add_tracks_to_db_and_queue(session_id, tracks, db)
+    yield {
+        "event": "done",
+        "added": [item.model_dump(mode="json") for item in items],
+        # Anything queued by someone else while we were resolving counts as a duplicate
+        "duplicates": len(duplicates) + len(tracks) - len(items),
+        "failed": failed,
+        "invalid": invalid,
+    }
+
+
+# session_id -> (version, JSON-ready items in play order, without anyone's user_vote)
+_snapshots = TTLCache(max_size=settings.QUEUE_SNAPSHOT_CACHE_SIZE, default_ttl=settings.QUEUE_SNAPSHOT_TTL)
+
+
+def discard_session(session_id: uuid.UUID):
+    """Drops what's cached about a deleted session."""
+    _snapshots.pop(session_id)
+    _known_sessions.pop(session_id)
+
+
+def _parse_user_id(user_id: str | None) -> uuid.UUID | None:
+    try:
+        return uuid.UUID(user_id) if user_id else None
+    except ValueError:
+        return None
+
+
+async def get_queue_version(session_id: uuid.UUID, db: AsyncSession) -> int:
+    if settings.SESSION_STATE_ENGINE:
+        state = await session_state.get_state(session_id)
+        return state.version if state else 0
+
+    result = await db.execute(
+        select(SessionModel.queue_version).where(SessionModel.id == session_id)
+    )
+    return result.scalar_one_or_none() or 0
+
+
+def queue_etag(session_id: uuid.UUID, version: int, user_id: str | None) -> str:
+    """
+    Every queue mutation bumps the version, including the user's own votes, so the
+    version identifies the response. Votes still waiting to be coalesced don't
+    bump it yet and are folded in separately.
+    """
+    tag = str(version)
+    user_uuid = _parse_user_id(user_id)
+    if settings.VOTE_COALESCING and not settings.SESSION_STATE_ENGINE and user_uuid:
+        pending = vote_aggregator.pending_user_votes(session_id, user_uuid)
+        if pending:
+            tag += f"-{zlib.crc32(repr(sorted(pending.items())).encode()):08x}"
+    return f'"{tag}"'
+
+
+async def _queue_snapshot(session_id: uuid.UUID, version: int, db: AsyncSession) -> list[dict]:
+    cached = _snapshots.get(session_id)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    if settings.SESSION_STATE_ENGINE:
+        state = await session_state.get_state(session_id)
+        queue_items = state.rank() if state else []
+    else:
+        # If a mutation lands after the version was read, the snapshot is newer
+        # than its version and clients just re-apply an idempotent delta.
+        query = (
+            select(QueueModel)
+            .where(QueueModel.session_id == session_id)
+            .options(selectinload(QueueModel.track))
+            .order_by(QueueModel.votes.desc(), QueueModel.position)
+        )
+        result = await db.execute(query)
+        queue_items = [QueueItem.model_validate(item) for item in result.scalars().all()]
 
-    # Convert to Pydantic models and populate user_vote
-    pydantic_items = []
-    for item in queue_items:
-        pydantic_item = QueueItem.model_validate(item)
-        pydantic_item.user_vote = user_votes_map.get(item.id)
-        pydantic_items.append(pydantic_item)
+    items = [item.model_dump(mode="json") for item in queue_items]
+    _snapshots.set(session_id, (version, items))
+    return items
+
+
+async def _get_user_votes(session_id: uuid.UUID, user_id: uuid.UUID, db: AsyncSession) -> dict[str, int | None]:
+    """The user's vote per queue item id; None marks a vote that's being removed."""
+    if settings.SESSION_STATE_ENGINE:
+        state = await session_state.get_state(session_id)
+        if not state:
+            return {}
+        return {str(item_id): value for (voter, item_id), value in state.votes.items() if voter == user_id}
+
+    # A user belongs to a single session, so all of their votes are for this queue
+    result = await db.execute(
+        select(VoteModel.queue_item_id, VoteModel.vote_value).where(VoteModel.user_id == user_id)
+    )
+    user_votes = {str(item_id): value for item_id, value in result}
+    if settings.VOTE_COALESCING:
+        for item_id, value in vote_aggregator.pending_user_votes(session_id, user_id).items():
+            user_votes[str(item_id)] = value
+    return user_votes
 
-    return pydantic_items
+
+async def get_queue(session_id: uuid.UUID, user_id: str | None, db: AsyncSession, version: int | None = None) -> dict:
+    """
+    Returns the queue as JSON-ready data. The shared snapshot is built once per
+    queue version; only the items the user voted on are copied to set user_vote.
+    """
+    if version is None:
+        version = await get_queue_version(session_id, db)
+    items = await _queue_snapshot(session_id, version, db)
+
+    user_uuid = _parse_user_id(user_id)
+    if user_uuid and items:
+        user_votes = await _get_user_votes(session_id, user_uuid, db)
+        if user_votes:
+            items = [
+                {**item, "user_vote": user_votes[item["id"]]} if item["id"] in user_votes else item
+                for item in items
+            ]
+
+    return {"items": items, "version": version}
 
 async def pop_next_track(session_id: uuid.UUID, db: AsyncSession) -> QueueItem | None:
     """Removes the first item from the queue and returns it (or the next one)."""
-    # Get the first item
-    query = (
-        select(QueueModel)
+    if settings.SESSION_STATE_ENGINE:
+        return await session_state.pop(session_id)
+
+    if settings.VOTE_COALESCING:
+        # Rank by every vote cast so far, not just the flushed ones
+        await vote_aggregator.flush_session(session_id)
+
+    # Lock the session row first, like every other queue mutation. That serializes
+    # concurrent pops and vote flushes, so the head needs no row lock of its own;
+    # skipping locked rows would pop the runner-up whenever a vote holds the head.
+    session_result = await db.execute(
+        select(SessionModel.id).where(SessionModel.id == session_id).with_for_update()
+    )
+    if session_result.scalar_one_or_none() is None:
+        await db.rollback()
+        return None
+
+    # One statement: delete the head (its votes go with it via ON DELETE CASCADE)
+    # and bump the version.
+    head = (
+        select(QueueModel.id)
         .where(QueueModel.session_id == session_id)
-        .order_by(QueueModel.position)
+        .order_by(QueueModel.votes.desc(), QueueModel.position)
         .limit(1)
+        .cte("head")
+    )
+    popped = (
+        delete(QueueModel)
+        .where(QueueModel.id == head.c.id)
+        .returning(*QueueModel.__table__.c)
+        .cte("popped")
+    )
+    bumped = (
+        update(SessionModel)
+        .where(SessionModel.id == session_id, exists(select(popped.c.id)))
+        .values(queue_version=SessionModel.queue_version + 1)
+        .returning(SessionModel.queue_version)
+        .cte("bumped")
+    )
+    popped_item = aliased(QueueModel, popped)
+    query = (
+        select(popped_item, bumped.c.queue_version)
+        .join(popped_item.track)
+        .join(bumped, true())
+        .options(contains_eager(popped_item.track))
     )
     result = await db.execute(query)
-    first_item = result.scalar_one_or_none()
-
-    if not first_item:
+    row = result.first()
+    if row is None:
+        await db.rollback()
         return None
 
-    # Capture the full object data we need before deletion
-    # We need to make sure the track relationship is loaded
-    query_full = (
-        select(QueueModel)
-        .where(QueueModel.id == first_item.id)
-        .options(selectinload(QueueModel.track))
-    )
-    result_full = await db.execute(query_full)
-    full_item = result_full.scalar_one()
-    
-    # Convert to Pydantic model BEFORE deletion to preserve data
-    popped_data = QueueItem.model_validate(full_item)
-
-    # Delete associated votes first to avoid foreign key constraint issues
-    print(f"Deleting votes for queue item: {full_item.id}")
-    vote_delete_query = select(VoteModel).where(VoteModel.queue_item_id == full_item.id)
-    vote_result = await db.execute(vote_delete_query)
-    votes_to_delete = vote_result.scalars().all()
-    for vote in votes_to_delete:
-        await db.delete(vote)
-    
-    # Remove the queue item
-    print(f"Popping track: {full_item.id} - {full_item.track.title}")
-    await db.delete(full_item)
+    popped_data = QueueItem.model_validate(row[0])
+    version = row[1]
     await db.commit()
-    print("Track popped and committed.")
+    logger.info("Popped track %s - %s", popped_data.id, popped_data.track.title, extra={"session_id": str(session_id)})
+
+    if settings.VOTE_COALESCING:
+        vote_aggregator.discard_item(session_id, popped_data.id)
 
     # Broadcast update
-    message = {
-        "type": "queue_update",
-        "payload": {}
-    }
-    await manager.broadcast(message, session_id)
+    await broadcast_queue_delta(session_id, version, "removed", id=str(popped_data.id))
     
     # Return the Pydantic model
     return popped_data
@@ -223,7 +515,7 @@ async def add_file_to_queue(
         raise ValueError("Session not found")
 
     # Get user nickname
-    added_by = await _get_user_nickname(user_id, db)
+    added_by = await _get_user_nickname(session_id, user_id, db)
 
     # Create Track
     new_track = TrackModel(
@@ -231,8 +523,8 @@ async def add_file_to_queue(
         title=title,
         duration=duration,
         source_type=SourceType.FILE,
-        source_url=file_path,
-        playback_url=file_path, # For files, source and playback are the same (relative path)
+        source_url=file_path,  # the session's link to the stored blob
+        playback_url=file_service.playback_url(file_path, file_hash),
         added_by=added_by,
         canonical_id=file_hash
     )
@@ -255,35 +547,42 @@ async def vote_track(session_id: uuid.UUID, queue_item_id: uuid.UUID, vote: int,
 
     user_uuid = uuid.UUID(user_id)
 
-    # Find the queue item
-    query = select(QueueModel).where(
-        QueueModel.session_id == session_id,
-        QueueModel.id == queue_item_id
+    if settings.SESSION_STATE_ENGINE:
+        return await session_state.vote(session_id, queue_item_id, vote, user_uuid)
+    if settings.VOTE_COALESCING:
+        return await vote_aggregator.vote(session_id, queue_item_id, vote, user_uuid, db)
+
+    # Taken first so the user's existing vote can't change under us
+    version = await bump_queue_version(session_id, db)
+
+    # Find the queue item (with its track, for the response) and the user's current vote
+    query = (
+        select(QueueModel, VoteModel)
+        .outerjoin(VoteModel, (VoteModel.queue_item_id == QueueModel.id) & (VoteModel.user_id == user_uuid))
+        .where(
+            QueueModel.session_id == session_id,
+            QueueModel.id == queue_item_id
+        )
+        .options(joinedload(QueueModel.track))
     )
     result = await db.execute(query)
-    queue_item = result.scalar_one_or_none()
+    row = result.first()
     
-    if not queue_item:
+    if not row:
         return None
-
-    # Check if user has already voted
-    vote_query = select(VoteModel).where(
-        VoteModel.user_id == user_uuid,
-        VoteModel.queue_item_id == queue_item_id
-    )
-    vote_result = await db.execute(vote_query)
-    existing_vote = vote_result.scalar_one_or_none()
+    queue_item, existing_vote = row
 
     if existing_vote:
         if existing_vote.vote_value == vote:
             # Same vote -> Toggle off (remove vote)
             await db.delete(existing_vote)
-            queue_item.votes -= vote
+            net_change = -vote
+            user_vote = None
         else:
             # Changing vote (e.g. +1 to -1)
             net_change = vote - existing_vote.vote_value
             existing_vote.vote_value = vote
-            queue_item.votes += net_change
+            user_vote = vote
     else:
         # New vote
         new_vote = VoteModel(
@@ -292,59 +591,29 @@ async def vote_track(session_id: uuid.UUID, queue_item_id: uuid.UUID, vote: int,
             vote_value=vote
         )
         db.add(new_vote)
-        queue_item.votes += vote
+        net_change = vote
+        user_vote = vote
+    await db.flush()
 
-    await db.commit()
-    
-    # Reorder the queue based on votes (highest votes first)
-    # Get all queue items for this session
-    all_items_query = (
-        select(QueueModel)
-        .where(QueueModel.session_id == session_id)
-        .order_by(QueueModel.votes.desc(), QueueModel.position)
-    )
-    result = await db.execute(all_items_query)
-    all_items = result.scalars().all()
-    
-    # Update positions based on vote order
-    for idx, item in enumerate(all_items):
-        item.position = idx
-    
-    await db.commit()
-    
-    # Broadcast update
-    message = {
-        "type": "queue_update",
-        "payload": {} 
-    }
-    await manager.broadcast(message, session_id)
-    
-    # Reload the item to ensure we have the latest state
-    query = (
-        select(QueueModel)
+    # One atomic row update; the ranking follows from the (votes, position) index
+    votes_result = await db.execute(
+        update(QueueModel)
         .where(QueueModel.id == queue_item_id)
-        .options(selectinload(QueueModel.track))
+        .values(votes=QueueModel.votes + net_change)
+        .returning(QueueModel.votes)
+        .execution_options(synchronize_session=False)
     )
-    result = await db.execute(query)
-    updated_item = result.scalar_one()
-    
+    votes = votes_result.scalar_one()
+
     # Convert to Pydantic and set user_vote
     # Since we just voted, we know the state!
-    pydantic_item = QueueItem.model_validate(updated_item)
-    
-    # If we deleted the vote (toggle off), user_vote is None (or 0)
-    # If we added/changed vote, it's 'vote'
-    # Wait, if we toggled off, 'vote' variable is still the input (+1 or -1).
-    # We need to know if we deleted it.
-    
-    # Re-check vote status for this user to be sure
-    vote_check_query = select(VoteModel).where(
-        VoteModel.user_id == user_uuid,
-        VoteModel.queue_item_id == queue_item_id
-    )
-    vote_check_result = await db.execute(vote_check_query)
-    current_vote = vote_check_result.scalar_one_or_none()
+    pydantic_item = QueueItem.model_validate(queue_item)
+    pydantic_item.votes = votes
+    pydantic_item.user_vote = user_vote
+
+    await db.commit()
     
-    pydantic_item.user_vote = current_vote.vote_value if current_vote else None
+    # Broadcast update
+    await broadcast_queue_delta(session_id, version, "votes", id=str(queue_item_id), votes=votes)
     
     return pydantic_item
@@ -0,0 +1,441 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from sqlalchemy import exc, select, delete, update, tuple_, values, column, Integer
+from sqlalchemy.dialects.postgresql import insert, UUID
+from sqlalchemy.orm import contains_eager
+
+from core.config import settings
+from core.database import AsyncSessionLocal
+from core.singleflight import SingleFlight
+from models.session import Session as SessionModel
+from models.track import Track as TrackModel
+from models.queue import Queue as QueueModel
+from models.user import User as UserModel
+from models.vote import Vote as VoteModel
+from schemas.queue import QueueItem
+from services import yt_service
+from services.queue_delta import broadcast_queue_delta
+
+logger = logging.getLogger(__name__)
+
+VoteKey = tuple[uuid.UUID, uuid.UUID]  # (user_id, queue_item_id)
+
+
+class _SessionState:
+    """A session's queue, votes and users, held in memory as the source of truth."""
+    __slots__ = (
+        "session_id", "version", "items", "canonical_ids", "votes", "users",
+        "ranked", "last_access", "lock", "flush_failures",
+        "new_rows", "dirty_counts", "dirty_votes", "removed",
+    )
+
+    def __init__(self, session_id: uuid.UUID, version: int):
+        self.session_id = session_id
+        self.version = version
+        self.items: dict[uuid.UUID, QueueItem] = {}  # user_vote is always None here
+        self.canonical_ids: dict[str, uuid.UUID] = {}  # for the duplicate check
+        self.votes: dict[VoteKey, int] = {}  # non-zero votes only
+        self.users: dict[uuid.UUID, str] = {}  # user_id -> nickname
+        self.ranked: list[QueueItem] | None = None  # play order, rebuilt lazily
+        self.last_access = time.monotonic()
+        self.lock = asyncio.Lock()  # held while flushing
+        self.flush_failures = 0  # consecutive transient failures
+
+        # Changes not yet written to the database
+        self.new_rows: dict[uuid.UUID, tuple[dict, dict]] = {}  # item_id -> (track row, queue row)
+        self.dirty_counts: set[uuid.UUID] = set()
+        self.dirty_votes: dict[VoteKey, int] = {}  # 0 deletes the row
+        self.removed: set[uuid.UUID] = set()
+
+    def is_dirty(self) -> bool:
+        return bool(self.new_rows or self.dirty_counts or self.dirty_votes or self.removed)
+
+    def rank(self) -> list[QueueItem]:
+        if self.ranked is None:
+            self.ranked = sorted(self.items.values(), key=lambda item: (-item.votes, item.position))
+        return self.ranked
+
+
+_states: dict[uuid.UUID, _SessionState] = {}
+_loads = SingleFlight()
+
+
+async def _load(session_id: uuid.UUID) -> _SessionState | None:
+    async with AsyncSessionLocal() as db:
+        version_result = await db.execute(
+            select(SessionModel.queue_version).where(SessionModel.id == session_id)
+        )
+        version = version_result.scalar_one_or_none()
+        if version is None:
+            return None
+        state = _SessionState(session_id, version)
+
+        result = await db.execute(
+            select(QueueModel)
+            .join(QueueModel.track)
+            .where(QueueModel.session_id == session_id)
+            .options(contains_eager(QueueModel.track))
+        )
+        for queue_item in result.scalars():
+            state.items[queue_item.id] = QueueItem.model_validate(queue_item)
+            if queue_item.track.canonical_id:
+                state.canonical_ids[queue_item.track.canonical_id] = queue_item.id
+
+        if state.items:
+            vote_result = await db.execute(
+                select(VoteModel.user_id, VoteModel.queue_item_id, VoteModel.vote_value)
+                .where(VoteModel.queue_item_id.in_(list(state.items)))
+            )
+            state.votes = {(user_id, item_id): value for user_id, item_id, value in vote_result}
+
+        user_result = await db.execute(
+            select(UserModel.id, UserModel.nickname).where(UserModel.session_id == session_id)
+        )
+        state.users = dict(user_result.all())
+    return state
+
+
+async def get_state(session_id: uuid.UUID) -> _SessionState | None:
+    """Returns the session's in-memory state, loading it on first use; None if there's no such session."""
+    state = _states.get(session_id)
+    if state is None:
+        state = await _loads.run(session_id, lambda: _load(session_id))
+        if state is None:
+            return None
+        # Concurrent loaders all get the same object; keep the first one registered
+        state = _states.setdefault(session_id, state)
+    state.last_access = time.monotonic()
+    return state
+
+
+async def preload():
+    """Loads the sessions that still have something queued, most recent first."""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(SessionModel.id)
+            .where(SessionModel.active.is_(True), select(QueueModel.id).where(QueueModel.session_id == SessionModel.id).exists())
+            .order_by(SessionModel.created_at.desc())
+            .limit(settings.SESSION_STATE_PRELOAD_MAX)
+        )
+        session_ids = result.scalars().all()
+    for session_id in session_ids:
+        await get_state(session_id)
+    logger.info("Loaded state for %d sessions", len(session_ids))
+
+
+def ranked_items(session_id: uuid.UUID) -> list[QueueItem]:
+    """The session's queue in play order if it's loaded, without loading it."""
+    state = _states.get(session_id)
+    return state.rank() if state else []
+
+
+def discard(session_id: uuid.UUID):
+    """Forgets a session without writing it back, e.g. once it's been deleted."""
+    _states.pop(session_id, None)
+
+
+def add_user(session_id: uuid.UUID, user_id: uuid.UUID, nickname: str):
+    """Records a user who joined; sessions that aren't loaded pick them up on load."""
+    state = _states.get(session_id)
+    if state:
+        state.users[user_id] = nickname
+
+
+async def get_nickname(session_id: uuid.UUID, user_id: uuid.UUID) -> str | None:
+    state = await get_state(session_id)
+    return state.users.get(user_id) if state else None
+
+
+def _queue_track(state: _SessionState, track: TrackModel) -> QueueItem:
+    state.version += 1
+    track.id = uuid.uuid4()
+    track_row = {column.key: getattr(track, column.key) for column in TrackModel.__table__.columns}
+    queue_row = {
+        "id": uuid.uuid4(),
+        "session_id": state.session_id,
+        "track_id": track.id,
+        "position": state.version,
+        "votes": 0,
+        "canonical_id": track.canonical_id,
+        "playback_expires_at": yt_service.playback_url_expires_at(track.playback_url),
+        "created_at": datetime.now(timezone.utc),
+    }
+    item = QueueItem.model_validate({**queue_row, "track": track})
+
+    state.items[item.id] = item
+    if track.canonical_id:
+        state.canonical_ids[track.canonical_id] = item.id
+    state.new_rows[item.id] = (track_row, queue_row)
+    state.ranked = None
+    return item
+
+
+async def add_track(session_id: uuid.UUID, track: TrackModel) -> QueueItem:
+    """Queues a new (unsaved) track. It's written to the database on the next flush."""
+    state = await get_state(session_id)
+    if state is None:
+        raise ValueError("Session not found")
+    if track.canonical_id and track.canonical_id in state.canonical_ids:
+        raise ValueError("This track is already in the queue!")
+
+    item = _queue_track(state, track)
+    await broadcast_queue_delta(session_id, state.version, "added", item=item.model_dump(mode="json"))
+    return item
+
+
+async def add_tracks(session_id: uuid.UUID, tracks: list[TrackModel]) -> list[QueueItem]:
+    """Queues many new tracks with a single broadcast, skipping ones already queued."""
+    state = await get_state(session_id)
+    if state is None:
+        raise ValueError("Session not found")
+
+    since = state.version
+    items = [
+        _queue_track(state, track) for track in tracks
+        if not (track.canonical_id and track.canonical_id in state.canonical_ids)
+    ]
+    if items:
+        await broadcast_queue_delta(
+            session_id, state.version, "added_many", since=since,
+            items=[item.model_dump(mode="json") for item in items]
+        )
+    return items
+
+
+async def vote(session_id: uuid.UUID, queue_item_id: uuid.UUID, vote: int, user_id: uuid.UUID) -> QueueItem | None:
+    state = await get_state(session_id)
+    if state is None or queue_item_id not in state.items:
+        return None
+    if user_id not in state.users:
+        raise ValueError("User not found in this session")
+
+    key = (user_id, queue_item_id)
+    previous = state.votes.get(key, 0)
+    # Same vote -> Toggle off, otherwise set or change it
+    current = 0 if previous == vote else vote
+    if current:
+        state.votes[key] = current
+    else:
+        state.votes.pop(key, None)
+
+    item = state.items[queue_item_id]
+    item.votes += current - previous
+    state.version += 1
+    state.dirty_votes[key] = current
+    state.dirty_counts.add(queue_item_id)
+    state.ranked = None
+
+    await broadcast_queue_delta(session_id, state.version, "votes", id=str(queue_item_id), votes=item.votes)
+    return item.model_copy(update={"user_vote": current or None})
+
+
+async def pop(session_id: uuid.UUID) -> QueueItem | None:
+    state = await get_state(session_id)
+    if state is None or not state.items:
+        return None
+
+    item = state.rank()[0]
+    del state.items[item.id]
+    for canonical_id in [key for key, item_id in state.canonical_ids.items() if item_id == item.id]:
+        del state.canonical_ids[canonical_id]
+    for key in [key for key in state.votes if key[1] == item.id]:
+        del state.votes[key]
+    state.removed.add(item.id)
+    state.version += 1
+    state.ranked = None
+
+    await broadcast_queue_delta(session_id, state.version, "removed", id=str(item.id))
+    return item
+
+
+async def replace_playback_url(old_url: str, new_url: str) -> set[uuid.UUID]:
+    """
+    Switches queued tracks playing old_url to new_url in every loaded session.
+    Returns the loaded sessions, which the database must leave to us.
+    """
+    changed = []
+    for state in _states.values():
+        for item in state.items.values():
+            if item.track.playback_url == old_url:
+                item.track = item.track.model_copy(update={"playback_url": new_url})
+                state.version += 1
+                state.ranked = None
+                changed.append((state.session_id, state.version, item))
+        for track_row, _ in state.new_rows.values():
+            if track_row["playback_url"] == old_url:
+                track_row["playback_url"] = new_url
+    handled = set(_states)
+
+    for session_id, version, item in changed:
+        await broadcast_queue_delta(
+            session_id, version, "updated", id=str(item.id), track=item.track.model_dump(mode="json")
+        )
+    return handled
+
+
+def queued_items() -> list[QueueItem]:
+    """Every queued item of the loaded sessions."""
+    return [item for state in _states.values() for item in state.items.values()]
+
+
+async def set_playback_url(session_id: uuid.UUID, queue_item_id: uuid.UUID, playback_url: str) -> QueueItem | None:
+    """
+    Gives a queued track a freshly resolved stream URL. Tracks already in the
+    database are the caller's to update; ones awaiting a flush go in with it.
+    """
+    state = _states.get(session_id)
+    item = state.items.get(queue_item_id) if state else None
+    if item is None:
+        return None
+
+    item.track = item.track.model_copy(update={"playback_url": playback_url})
+    if queue_item_id in state.new_rows:
+        track_row, queue_row = state.new_rows[queue_item_id]
+        track_row["playback_url"] = playback_url
+        queue_row["playback_expires_at"] = yt_service.playback_url_expires_at(playback_url)
+    state.version += 1
+    state.ranked = None
+
+    await broadcast_queue_delta(
+        session_id, state.version, "updated", id=str(item.id), track=item.track.model_dump(mode="json")
+    )
+    return item
+
+
+async def flush(state: _SessionState):
+    """Writes a session's accumulated changes in one transaction."""
+    async with state.lock:
+        if not state.is_dirty():
+            return
+
+        # Changes made during the flush accumulate in fresh containers
+        new_rows, state.new_rows = state.new_rows, {}
+        dirty_counts, state.dirty_counts = state.dirty_counts, set()
+        dirty_votes, state.dirty_votes = state.dirty_votes, {}
+        removed, state.removed = state.removed, set()
+        try:
+            async with AsyncSessionLocal() as db:
+                await _write(state, new_rows, dirty_counts, dirty_votes, removed, db)
+        except Exception as e:
+            state.flush_failures += 1
+            if not _is_transient(e) or state.flush_failures > settings.SESSION_STATE_FLUSH_RETRIES:
+                # Retrying can't fix it, and would hold back every later change too
+                logger.exception(
+                    "Dropping unpersistable changes for session %s after %d attempts "
+                    "(%d new, %d counts, %d votes, %d removed)",
+                    state.session_id, state.flush_failures,
+                    len(new_rows), len(dirty_counts), len(dirty_votes), len(removed),
+                )
+                state.flush_failures = 0
+                return
+            logger.warning("Error persisting state for session %s, will retry: %s", state.session_id, e)
+            # Put the work back; anything changed since takes precedence
+            for item_id, rows in new_rows.items():
+                state.new_rows.setdefault(item_id, rows)
+            state.dirty_counts |= dirty_counts
+            for key, value in dirty_votes.items():
+                state.dirty_votes.setdefault(key, value)
+            state.removed |= removed
+            return
+        state.flush_failures = 0
+
+
+def _is_transient(error: Exception) -> bool:
+    """Whether a failed write may succeed if tried again, e.g. once the database is reachable."""
+    if isinstance(error, exc.DBAPIError):
+        return error.connection_invalidated or isinstance(error, (exc.OperationalError, exc.InterfaceError))
+    return isinstance(error, (exc.TimeoutError, asyncio.TimeoutError, OSError))
+
+
+async def _write(
+    state: _SessionState,
+    new_rows: dict[uuid.UUID, tuple[dict, dict]],
+    dirty_counts: set[uuid.UUID],
+    dirty_votes: dict[VoteKey, int],
+    removed: set[uuid.UUID],
+    db
+):
+    # Items added and popped between two flushes never need to reach the database
+    inserted = {item_id: rows for item_id, rows in new_rows.items() if item_id not in removed}
+    removed = removed - new_rows.keys()
+    gone = removed | (new_rows.keys() - inserted.keys())
+
+    if inserted:
+        # Current vote counts go in with the row
+        queue_rows = [
+            {**queue_row, "votes": state.items[item_id].votes if item_id in state.items else queue_row["votes"]}
+            for item_id, (_, queue_row) in inserted.items()
+        ]
+        await db.execute(insert(TrackModel), [track_row for track_row, _ in inserted.values()])
+        await db.execute(insert(QueueModel), queue_rows)
+
+    counts = [
+        (item_id, state.items[item_id].votes)
+        for item_id in dirty_counts
+        if item_id in state.items and item_id not in inserted
+    ]
+    if counts:
+        counts_table = values(
+            column("id", UUID(as_uuid=True)), column("votes", Integer), name="counts"
+        ).data(counts)
+        await db.execute(
+            update(QueueModel)
+            .where(QueueModel.id == counts_table.c.id)
+            .values(votes=counts_table.c.votes)
+            .execution_options(synchronize_session=False)
+        )
+
+    dirty_votes = {key: value for key, value in dirty_votes.items() if key[1] not in gone}
+    cleared = [key for key, value in dirty_votes.items() if value == 0]
+    if cleared:
+        await db.execute(
+            delete(VoteModel).where(tuple_(VoteModel.user_id, VoteModel.queue_item_id).in_(cleared))
+        )
+    upserts = [
+        {"id": uuid.uuid4(), "user_id": user_id, "queue_item_id": item_id, "vote_value": value}
+        for (user_id, item_id), value in dirty_votes.items() if value != 0
+    ]
+    if upserts:
+        stmt = insert(VoteModel).values(upserts)
+        await db.execute(
+            stmt.on_conflict_do_update(
+                constraint="uq_user_queue_vote",
+                set_={"vote_value": stmt.excluded.vote_value}
+            )
+        )
+
+    if removed:
+        # Their votes go with them via ON DELETE CASCADE
+        await db.execute(delete(QueueModel).where(QueueModel.id.in_(removed)))
+
+    await db.execute(
+        update(SessionModel)
+        .where(SessionModel.id == state.session_id)
+        .values(queue_version=state.version)
+    )
+    await db.commit()
+
+
+async def flush_all():
+    for state in list(_states.values()):
+        await flush(state)
+
+
+async def evict_idle():
+    """Writes back and unloads sessions nobody has touched for SESSION_STATE_IDLE_TTL seconds."""
+    cutoff = time.monotonic() - settings.SESSION_STATE_IDLE_TTL
+    for state in [state for state in _states.values() if state.last_access < cutoff]:
+        await flush(state)
+        if state.last_access < cutoff and not state.is_dirty() and _states.get(state.session_id) is state:
+            del _states[state.session_id]
+
+
+async def run_persister():
+    """Background task: flushes changes every SESSION_STATE_FLUSH_INTERVAL seconds and evicts idle sessions."""
+    while True:
+        await asyncio.sleep(settings.SESSION_STATE_FLUSH_INTERVAL)
+        await flush_all()
+        await evict_idle()
@@ -0,0 +1,219 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import time
+from collections import deque
+from sqlalchemy import select, update
+from sqlalchemy.orm import selectinload
+
+from core.config import settings
+from core.database import AsyncSessionLocal
+from models.queue import Queue as QueueModel
+from models.track import Track as TrackModel, SourceType
+from schemas.track import TrackBase
+from services import file_service, session_state
+from services.queue_delta import bump_queue_version, broadcast_queue_delta
+
+logger = logging.getLogger(__name__)
+
+# codec setting -> (file extension, ffmpeg output options)
+_CODECS = {
+    "opus": ("opus", ["-c:a", "libopus", "-ar", "48000", "-f", "ogg"]),
+    "aac": ("m4a", ["-c:a", "aac", "-movflags", "+faststart", "-f", "mp4"]),
+}
+
+# Single-pass EBU R128 normalization to the usual streaming target
+_LOUDNORM = "loudnorm=I=-16:TP=-1.5:LRA=11"
+
+_enabled = False
+_semaphore: asyncio.Semaphore | None = None
+_jobs: dict[str, asyncio.Task] = {}  # source hash -> running or queued job
+
+_stats = {
+    "submitted": 0,
+    "transcoded": 0,
+    "reused": 0,  # rendition already on disk
+    "failed": 0,
+    "input_bytes": 0,
+    "output_bytes": 0,
+    "wait_seconds": 0.0,
+    "transcode_seconds": 0.0,
+}
+_recent_jobs: deque[dict] = deque(maxlen=50)
+
+
+def _output_options() -> list[str]:
+    _, codec_options = _CODECS[settings.TRANSCODE_CODEC]
+    options = ["-map", "0:a:0", "-vn", "-map_metadata", "-1"]
+    if settings.TRANSCODE_LOUDNORM:
+        options += ["-af", _LOUDNORM]
+    return options + codec_options + ["-b:a", settings.TRANSCODE_BITRATE, "-threads", "1"]
+
+
+def rendition_suffix() -> str:
+    """
+    File suffix of the current rendition profile, e.g. "-1a2b3c4d.opus". The
+    profile is part of the name, so changing the settings never serves a stale
+    rendition under an immutable URL.
+    """
+    ext, _ = _CODECS[settings.TRANSCODE_CODEC]
+    profile = hashlib.sha1(" ".join(_output_options()).encode()).hexdigest()[:8]
+    return f"-{profile}.{ext}"
+
+
+def start():
+    global _enabled, _semaphore
+    _enabled = settings.TRANSCODE_ENABLED and shutil.which(settings.FFMPEG_PATH) is not None
+    if settings.TRANSCODE_ENABLED and not _enabled:
+        logger.warning("Transcoding disabled: %s not found", settings.FFMPEG_PATH)
+    _semaphore = asyncio.Semaphore(settings.TRANSCODE_CONCURRENCY)
+
+
+async def shutdown():
+    for job in list(_jobs.values()):
+        job.cancel()
+    await asyncio.gather(*_jobs.values(), return_exceptions=True)
+
+
+def submit(file_hash: str):
+    """Queues an upload for transcoding; tracks switch to the rendition once it's ready."""
+    if not _enabled or file_hash in _jobs:
+        return
+    _stats["submitted"] += 1
+    job = asyncio.create_task(_run_job(file_hash, time.perf_counter()))
+    _jobs[file_hash] = job
+    job.add_done_callback(lambda _: _jobs.pop(file_hash, None))
+
+
+async def _run_job(file_hash: str, submitted_at: float):
+    suffix = rendition_suffix()
+    source = file_service.blob_path(file_hash)
+    target = source + suffix
+
+    if await asyncio.to_thread(os.path.exists, target):
+        _stats["reused"] += 1
+    else:
+        # Bounded so transcodes can't take every core away from the API
+        async with _semaphore:
+            started = time.perf_counter()
+            ok = await _transcode(source, target)
+            finished = time.perf_counter()
+        if not ok:
+            _stats["failed"] += 1
+            return
+        if not await asyncio.to_thread(os.path.exists, source):
+            # Every session using the upload went away while we worked
+            await asyncio.to_thread(_remove, target)
+            return
+
+        input_bytes = (await asyncio.to_thread(os.stat, source)).st_size
+        output_bytes = (await asyncio.to_thread(os.stat, target)).st_size
+        _stats["transcoded"] += 1
+        _stats["input_bytes"] += input_bytes
+        _stats["output_bytes"] += output_bytes
+        _stats["wait_seconds"] += started - submitted_at
+        _stats["transcode_seconds"] += finished - started
+        _recent_jobs.append({
+            "hash": file_hash,
+            "wait_ms": round((started - submitted_at) * 1000, 1),
+            "transcode_ms": round((finished - started) * 1000, 1),
+            "input_bytes": input_bytes,
+            "output_bytes": output_bytes,
+        })
+
+    await _switch_playback_url(file_hash, f"/api/audio/{file_hash}{suffix}")
+
+
+async def _transcode(source: str, target: str) -> bool:
+    partial = target + ".part"
+    args = [settings.FFMPEG_PATH, "-hide_banner", "-nostdin", "-y", "-i", source, *_output_options(), partial]
+    if shutil.which("nice"):
+        args = ["nice", "-n", "10", *args]
+
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        _, stderr = await asyncio.wait_for(process.communicate(), settings.TRANSCODE_TIMEOUT)
+    except BaseException as e:
+        process.kill()
+        await process.wait()
+        await asyncio.to_thread(_remove, partial)
+        if isinstance(e, asyncio.TimeoutError):
+            logger.warning("ffmpeg timed out for %s", source)
+            return False
+        raise
+
+    if process.returncode != 0:
+        logger.error("ffmpeg failed for %s: %s", source, stderr.decode(errors="replace")[-500:])
+        await asyncio.to_thread(_remove, partial)
+        return False
+
+    await asyncio.to_thread(os.replace, partial, target)
+    return True
+
+
+def _remove(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+async def _switch_playback_url(file_hash: str, rendition_url: str):
+    """Points every track still playing the original upload at its rendition."""
+    original_url = f"/api/audio/{file_hash}"
+
+    # Sessions held in memory are updated there; their versions live there too
+    handled = set()
+    if settings.SESSION_STATE_ENGINE:
+        handled = await session_state.replace_playback_url(original_url, rendition_url)
+
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(TrackModel)
+            .where(
+                TrackModel.canonical_id == file_hash,
+                TrackModel.source_type == SourceType.FILE,
+                TrackModel.playback_url == original_url
+            )
+            .values(playback_url=rendition_url)
+            .returning(TrackModel.id, TrackModel.session_id)
+        )
+        track_ids = [track_id for track_id, session_id in result if session_id not in handled]
+
+        deltas = []
+        if track_ids:
+            queue_result = await db.execute(
+                select(QueueModel)
+                .where(QueueModel.track_id.in_(track_ids))
+                .options(selectinload(QueueModel.track))
+                # Lock sessions in a consistent order
+                .order_by(QueueModel.session_id)
+            )
+            for item in queue_result.scalars().all():
+                version = await bump_queue_version(item.session_id, db)
+                track = TrackBase.model_validate(item.track).model_dump(mode="json")
+                deltas.append((item.session_id, version, item.id, track))
+        await db.commit()
+
+    for session_id, version, item_id, track in deltas:
+        await broadcast_queue_delta(session_id, version, "updated", id=str(item_id), track=track)
+
+
+def transcode_stats() -> dict:
+    transcoded = _stats["transcoded"]
+    return {
+        **_stats,
+        "enabled": _enabled,
+        "codec": settings.TRANSCODE_CODEC,
+        "bitrate": settings.TRANSCODE_BITRATE,
+        "concurrency": settings.TRANSCODE_CONCURRENCY,
+        "in_flight": len(_jobs),
+        "avg_transcode_ms": round(_stats["transcode_seconds"] * 1000 / transcoded, 1) if transcoded else 0.0,
+        "avg_wait_ms": round(_stats["wait_seconds"] * 1000 / transcoded, 1) if transcoded else 0.0,
+        "size_ratio": _stats["output_bytes"] / _stats["input_bytes"] if _stats["input_bytes"] else None,
+        "recent_jobs": list(_recent_jobs),
+    }
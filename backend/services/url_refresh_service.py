@@ -0,0 +1,277 @@
+import asyncio
+import logging
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update, func, or_
+
+from core.cache import TTLCache
+from core.config import settings
+from core.database import AsyncSessionLocal
+from core.websocket_manager import manager
+from models.queue import Queue as QueueModel
+from models.session import Session as SessionModel
+from models.track import Track as TrackModel, SourceType
+from schemas.queue import QueueItem
+from schemas.track import TrackBase
+from services import session_state, yt_service
+from services.queue_delta import bump_queue_version, broadcast_queue_delta
+
+logger = logging.getLogger(__name__)
+
+# queue item id -> True while its URL counts as recently probed
+_probed = TTLCache(max_size=4096, default_ttl=settings.URL_PROBE_INTERVAL)
+# queue item id -> True while a failed refresh shouldn't be retried
+_failed = TTLCache(max_size=4096, default_ttl=settings.YT_NEGATIVE_TTL)
+
+# googlevideo answers these for URLs that lapsed or were revoked
+_DEAD_STATUSES = {403, 404, 410}
+
+_stats = {
+    "refreshed": 0,
+    "failed": 0,
+    "probes": 0,
+    "dead_probes": 0,
+    "refreshed_at_pop": 0,
+}
+
+
+class _Due:
+    """A queued YouTube track whose stream URL needs resolving again."""
+    __slots__ = ("item_id", "session_id", "video_id")
+
+    def __init__(self, item_id: uuid.UUID, session_id: uuid.UUID, video_id: str):
+        self.item_id = item_id
+        self.session_id = session_id
+        self.video_id = video_id
+
+    @property
+    def watch_url(self) -> str:
+        return f"https://www.youtube.com/watch?v={self.video_id}"
+
+
+def _recently_active():
+    """Sessions with a client on this worker, or on any worker within URL_REFRESH_ACTIVE_WITHIN."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.URL_REFRESH_ACTIVE_WITHIN)
+    return or_(
+        SessionModel.last_active_at >= cutoff,
+        SessionModel.id.in_(list(manager.active_connections)),
+    )
+
+
+async def _expiring(limit: int) -> list[_Due]:
+    """
+    Queued tracks of recently active sessions whose URLs lapse within
+    URL_REFRESH_MARGIN, soonest first. Abandoned sessions aren't kept fresh;
+    ensure_playable catches up if one of them pops a track again.
+    """
+    deadline = time.time() + settings.URL_REFRESH_MARGIN
+    if settings.SESSION_STATE_ENGINE:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(SessionModel.id).where(_recently_active()))
+            active = set(result.scalars())
+        expiring = []
+        for item in session_state.queued_items():
+            if item.session_id not in active:
+                continue
+            expires_at = yt_service.playback_url_expiry(item.track.playback_url)
+            if item.track.source_type == SourceType.YOUTUBE and item.track.canonical_id \
+                    and expires_at is not None and expires_at < deadline:
+                expiring.append((expires_at, _Due(item.id, item.session_id, item.track.canonical_id)))
+        expiring.sort(key=lambda entry: entry[0])
+        return [due for _, due in expiring[:limit]]
+
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(QueueModel.id, QueueModel.session_id, TrackModel.canonical_id)
+            .join(QueueModel.track)
+            .join(SessionModel, SessionModel.id == QueueModel.session_id)
+            .where(
+                QueueModel.playback_expires_at < datetime.fromtimestamp(deadline, timezone.utc),
+                _recently_active()
+            )
+            .order_by(QueueModel.playback_expires_at)
+            .limit(limit)
+        )
+        return [_Due(*row) for row in result]
+
+
+async def _heads() -> list[tuple[_Due, str]]:
+    """(item, current URL) for the next URL_PROBE_AHEAD YouTube tracks of every watched session."""
+    session_ids = list(manager.active_connections)
+    if not session_ids:
+        return []
+
+    if settings.SESSION_STATE_ENGINE:
+        heads = []
+        for session_id in session_ids:
+            items = [
+                item for item in session_state.ranked_items(session_id)
+                if item.track.source_type == SourceType.YOUTUBE and item.track.canonical_id
+            ]
+            heads += [
+                (_Due(item.id, session_id, item.track.canonical_id), item.track.playback_url)
+                for item in items[:settings.URL_PROBE_AHEAD]
+            ]
+        return heads
+
+    ranked = (
+        select(
+            QueueModel.id, QueueModel.session_id, TrackModel.canonical_id, TrackModel.playback_url,
+            func.row_number().over(
+                partition_by=QueueModel.session_id,
+                order_by=(QueueModel.votes.desc(), QueueModel.position)
+            ).label("rank")
+        )
+        .join(QueueModel.track)
+        .where(
+            QueueModel.session_id.in_(session_ids),
+            TrackModel.source_type == SourceType.YOUTUBE,
+            TrackModel.canonical_id.is_not(None)
+        )
+        .subquery()
+    )
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(ranked.c.id, ranked.c.session_id, ranked.c.canonical_id, ranked.c.playback_url)
+            .where(ranked.c.rank <= settings.URL_PROBE_AHEAD)
+        )
+        return [(_Due(*row[:3]), row[3]) for row in result]
+
+
+def _is_dead(playback_url: str) -> bool:
+    """HEAD-probes a stream URL. Runs in a thread; network trouble doesn't count as dead."""
+    request = urllib.request.Request(playback_url, method="HEAD")
+    try:
+        with urllib.request.urlopen(request, timeout=settings.URL_PROBE_TIMEOUT):
+            return False
+    except urllib.error.HTTPError as e:
+        return e.code in _DEAD_STATUSES
+    except (OSError, ValueError):
+        return False
+
+
+async def _probe_heads() -> list[_Due]:
+    """Returns the upcoming tracks whose URLs no longer work."""
+    heads = [(due, url) for due, url in await _heads() if _probed.get(due.item_id) is None]
+    heads = heads[:settings.URL_REFRESH_BATCH]
+    for due, _ in heads:
+        _probed.set(due.item_id, True)
+
+    results = await asyncio.gather(*(asyncio.to_thread(_is_dead, url) for _, url in heads))
+    _stats["probes"] += len(heads)
+    dead = [due for (due, _), is_dead in zip(heads, results) if is_dead]
+    _stats["dead_probes"] += len(dead)
+    return dead
+
+
+async def _refresh(due: _Due, dead: bool):
+    # A dead URL may still be cached, so don't take anything from the cache then
+    min_ttl = float("inf") if dead else settings.URL_REFRESH_MARGIN
+    track_info = await yt_service.get_youtube_track_info(due.watch_url, min_ttl=min_ttl)
+    if track_info is None:
+        _stats["failed"] += 1
+        _failed.set(due.item_id, True)
+        return
+    playback_url = str(track_info.playback_url)
+    expires_at = yt_service.playback_url_expires_at(playback_url)
+
+    if settings.SESSION_STATE_ENGINE:
+        item = await session_state.set_playback_url(due.session_id, due.item_id, playback_url)
+        if item is None:
+            return  # popped meanwhile
+        async with AsyncSessionLocal() as db:
+            # No-ops for a track that's still waiting for its first flush
+            await db.execute(update(TrackModel).where(TrackModel.id == item.track.id).values(playback_url=playback_url))
+            await db.execute(update(QueueModel).where(QueueModel.id == due.item_id).values(playback_expires_at=expires_at))
+            await db.commit()
+        _stats["refreshed"] += 1
+        return
+
+    async with AsyncSessionLocal() as db:
+        version = await bump_queue_version(due.session_id, db)
+        result = await db.execute(
+            update(QueueModel)
+            .where(QueueModel.id == due.item_id)
+            .values(playback_expires_at=expires_at)
+            .returning(QueueModel.track_id)
+        )
+        track_id = result.scalar_one_or_none()
+        if track_id is None:
+            await db.rollback()
+            return  # popped meanwhile
+        track = await db.scalar(
+            update(TrackModel)
+            .where(TrackModel.id == track_id)
+            .values(playback_url=playback_url)
+            .returning(TrackModel)
+        )
+        track_data = TrackBase.model_validate(track).model_dump(mode="json")
+        await db.commit()
+
+    _stats["refreshed"] += 1
+    await broadcast_queue_delta(due.session_id, version, "updated", id=str(due.item_id), track=track_data)
+
+
+async def refresh_due():
+    """
+    One round: re-resolves dead URLs among the upcoming tracks, then the ones
+    closest to lapsing, at most URL_REFRESH_BATCH of them.
+    """
+    dead = await _probe_heads()
+    dead_ids = {due.item_id for due in dead}
+    # Over-fetched, since items whose refresh just failed are skipped for a while
+    expiring = [
+        due for due in await _expiring(2 * settings.URL_REFRESH_BATCH)
+        if due.item_id not in dead_ids and _failed.get(due.item_id) is None
+    ]
+    batch = [(due, True) for due in dead] + [(due, False) for due in expiring]
+    batch = batch[:settings.URL_REFRESH_BATCH]
+    # Extractions share the bounded yt-dlp pool, so a batch can't crowd out searches
+    await asyncio.gather(*(_refresh(due, is_dead) for due, is_dead in batch))
+
+
+async def run_refresher():
+    """Background task: refreshes stream URLs every URL_REFRESH_INTERVAL seconds."""
+    while True:
+        await asyncio.sleep(settings.URL_REFRESH_INTERVAL)
+        try:
+            await refresh_due()
+        except Exception:
+            logger.exception("Error refreshing playback URLs")
+
+
+async def ensure_playable(item: QueueItem) -> QueueItem:
+    """
+    Last check before a popped YouTube track goes to the host: a URL that
+    would lapse before the track ends is resolved again on the spot.
+    """
+    track = item.track
+    if track.source_type != SourceType.YOUTUBE or not track.canonical_id:
+        return item
+    expires_at = yt_service.playback_url_expiry(track.playback_url)
+    # Tracks prefetched to local disk have no expiry and pass through here
+    needed = track.duration + settings.URL_REFRESH_POP_MARGIN
+    if expires_at is None or expires_at - time.time() >= needed:
+        return item
+
+    track_info = await yt_service.get_youtube_track_info(
+        f"https://www.youtube.com/watch?v={track.canonical_id}", min_ttl=needed
+    )
+    if track_info is None:
+        return item
+    _stats["refreshed_at_pop"] += 1
+    return item.model_copy(update={
+        "track": track.model_copy(update={"playback_url": str(track_info.playback_url)})
+    })
+
+
+def refresh_stats() -> dict:
+    return {
+        **_stats,
+        "enabled": settings.URL_REFRESH_ENABLED,
+        "margin_seconds": settings.URL_REFRESH_MARGIN,
+        "batch": settings.URL_REFRESH_BATCH,
+    }
@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import uuid
+from sqlalchemy import select, delete, update, tuple_, values, column, Integer
+from sqlalchemy.dialects.postgresql import insert, UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+from core.config import settings
+from core.database import AsyncSessionLocal
+from models.session import Session as SessionModel
+from models.queue import Queue as QueueModel
+from models.vote import Vote as VoteModel
+from schemas.queue import QueueItem
+from services.queue_delta import broadcast_queue_delta
+
+logger = logging.getLogger(__name__)
+
+VoteKey = tuple[uuid.UUID, uuid.UUID]  # (user_id, queue_item_id)
+
+
+class _SessionVotes:
+    __slots__ = ("items", "votes", "user_votes", "pending", "deltas", "lock")
+
+    def __init__(self):
+        self.items: dict[uuid.UUID, QueueItem] = {}  # response templates
+        self.votes: dict[uuid.UUID, int] = {}  # best known vote count per item
+        self.user_votes: dict[VoteKey, int] = {}  # current vote, 0 for none
+        self.pending: dict[VoteKey, int] = {}  # vote rows to write, 0 to delete
+        self.deltas: dict[uuid.UUID, int] = {}  # vote count changes not yet written
+        # Held for a whole flush, so a flush started while another is writing
+        # returns only once both have committed
+        self.lock = asyncio.Lock()
+
+
+_sessions: dict[uuid.UUID, _SessionVotes] = {}
+
+
+async def vote(session_id: uuid.UUID, queue_item_id: uuid.UUID, vote: int, user_id: uuid.UUID, db: AsyncSession) -> QueueItem | None:
+    """
+    Applies a vote in memory and returns the item as the voter now sees it.
+    The database is only read the first time a user votes on an item.
+    """
+    state = _sessions.setdefault(session_id, _SessionVotes())
+    key = (user_id, queue_item_id)
+
+    if queue_item_id not in state.items or key not in state.user_votes:
+        # First touch of this item or this user's vote on it: load both once
+        query = (
+            select(QueueModel, VoteModel.vote_value)
+            .outerjoin(VoteModel, (VoteModel.queue_item_id == QueueModel.id) & (VoteModel.user_id == user_id))
+            .where(
+                QueueModel.session_id == session_id,
+                QueueModel.id == queue_item_id
+            )
+            .options(joinedload(QueueModel.track))
+        )
+        result = await db.execute(query)
+        row = result.first()
+        if not row:
+            return None
+        queue_item, vote_value = row
+
+        # Another vote may have loaded the same rows while we awaited
+        if queue_item_id not in state.items:
+            state.items[queue_item_id] = QueueItem.model_validate(queue_item)
+            state.votes[queue_item_id] = queue_item.votes + state.deltas.get(queue_item_id, 0)
+        state.user_votes.setdefault(key, vote_value or 0)
+
+    previous = state.user_votes[key]
+    # Same vote -> Toggle off, otherwise set or change it
+    current = 0 if previous == vote else vote
+    net_change = current - previous
+
+    state.user_votes[key] = current
+    state.pending[key] = current
+    state.deltas[queue_item_id] = state.deltas.get(queue_item_id, 0) + net_change
+    state.votes[queue_item_id] += net_change
+
+    return state.items[queue_item_id].model_copy(
+        update={"votes": state.votes[queue_item_id], "user_vote": current or None}
+    )
+
+
+def pending_user_votes(session_id: uuid.UUID, user_id: uuid.UUID) -> dict[uuid.UUID, int | None]:
+    """The user's votes that may not have reached the database yet."""
+    state = _sessions.get(session_id)
+    if not state:
+        return {}
+    return {
+        item_id: value or None
+        for (voter, item_id), value in state.pending.items()
+        if voter == user_id
+    }
+
+
+def discard_item(session_id: uuid.UUID, queue_item_id: uuid.UUID):
+    """Forgets an item that left the queue."""
+    state = _sessions.get(session_id)
+    if not state:
+        return
+    state.items.pop(queue_item_id, None)
+    state.votes.pop(queue_item_id, None)
+    state.deltas.pop(queue_item_id, None)
+    for key in [key for key in state.user_votes if key[1] == queue_item_id]:
+        state.user_votes.pop(key, None)
+        state.pending.pop(key, None)
+
+
+def discard_session(session_id: uuid.UUID):
+    _sessions.pop(session_id, None)
+
+
+async def flush_session(session_id: uuid.UUID):
+    """
+    Writes a session's pending votes and vote counts in one transaction. Returns
+    once every vote cast so far has committed, including any a flush already
+    under way was writing.
+    """
+    state = _sessions.get(session_id)
+    if not state:
+        return
+
+    async with state.lock:
+        if not state.pending:
+            return
+
+        # Votes arriving during the flush accumulate in fresh dicts
+        pending, state.pending = state.pending, {}
+        deltas, state.deltas = state.deltas, {}
+
+        try:
+            async with AsyncSessionLocal() as db:
+                changed = await _write_votes(session_id, pending, deltas, db)
+        except Exception:
+            logger.exception("Error flushing votes for session %s", session_id)
+            # Put the work back; votes made since take precedence
+            for key, value in pending.items():
+                state.pending.setdefault(key, value)
+            for item_id, delta in deltas.items():
+                state.deltas[item_id] = state.deltas.get(item_id, 0) + delta
+            return
+
+        if changed is None:
+            return
+        version, new_votes = changed
+        first_version = version - len(new_votes) + 1
+        for offset, (item_id, votes) in enumerate(new_votes):
+            if item_id in state.votes:
+                # The database count may include other workers' votes
+                state.votes[item_id] = votes + state.deltas.get(item_id, 0)
+            await broadcast_queue_delta(session_id, first_version + offset, "votes", id=str(item_id), votes=votes)
+
+
+async def _write_votes(
+    session_id: uuid.UUID,
+    pending: dict[VoteKey, int],
+    deltas: dict[uuid.UUID, int],
+    db: AsyncSession
+) -> tuple[int, list[tuple[uuid.UUID, int]]] | None:
+    # Lock the session first, like every other queue mutation, so pops can't interleave
+    version_result = await db.execute(
+        select(SessionModel.queue_version).where(SessionModel.id == session_id).with_for_update()
+    )
+    version = version_result.scalar_one_or_none()
+    if version is None:
+        return None
+
+    # Drop votes for items that were popped in the meantime
+    item_ids = {item_id for _, item_id in pending}
+    existing_result = await db.execute(
+        select(QueueModel.id).where(QueueModel.session_id == session_id, QueueModel.id.in_(item_ids))
+    )
+    existing = set(existing_result.scalars().all())
+    pending = {key: value for key, value in pending.items() if key[1] in existing}
+
+    removed = [key for key, value in pending.items() if value == 0]
+    if removed:
+        await db.execute(
+            delete(VoteModel).where(tuple_(VoteModel.user_id, VoteModel.queue_item_id).in_(removed))
+        )
+
+    upserts = [
+        {"id": uuid.uuid4(), "user_id": user_id, "queue_item_id": item_id, "vote_value": value}
+        for (user_id, item_id), value in pending.items() if value != 0
+    ]
+    if upserts:
+        stmt = insert(VoteModel).values(upserts)
+        await db.execute(
+            stmt.on_conflict_do_update(
+                constraint="uq_user_queue_vote",
+                set_={"vote_value": stmt.excluded.vote_value}
+            )
+        )
+
+    changes = [(item_id, delta) for item_id, delta in deltas.items() if delta and item_id in existing]
+    new_votes: list[tuple[uuid.UUID, int]] = []
+    if changes:
+        # All vote counts in one UPDATE ... FROM (VALUES ...)
+        changes_table = values(
+            column("id", UUID(as_uuid=True)), column("delta", Integer), name="changes"
+        ).data(changes)
+        result = await db.execute(
+            update(QueueModel)
+            .where(QueueModel.id == changes_table.c.id)
+            .values(votes=QueueModel.votes + changes_table.c.delta)
+            .returning(QueueModel.id, QueueModel.votes)
+            .execution_options(synchronize_session=False)
+        )
+        new_votes = [(row.id, row.votes) for row in result]
+
+        await db.execute(
+            update(SessionModel)
+            .where(SessionModel.id == session_id)
+            .values(queue_version=SessionModel.queue_version + len(new_votes))
+        )
+        version += len(new_votes)
+
+    await db.commit()
+    return version, new_votes
+
+
+async def flush_all():
+    for session_id in list(_sessions):
+        await flush_session(session_id)
+
+
+async def run_flusher():
+    """Background task: flushes pending votes every VOTE_FLUSH_INTERVAL seconds."""
+    while True:
+        await asyncio.sleep(settings.VOTE_FLUSH_INTERVAL)
+        await flush_all()
@@ -1,7 +1,22 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 import yt_dlp
 from pydantic import BaseModel, HttpUrl
 import re
 
+from core import metrics
+from core.cache import TTLCache
+from core.config import settings
+from core.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
 
 class YouTubeTrackInfo(BaseModel):
     title: str
@@ -9,8 +24,165 @@ class YouTubeTrackInfo(BaseModel):
     playback_url: HttpUrl
 
 
-# Simple in-memory cache
-_cache: dict[str, YouTubeTrackInfo] = {}
+# video_id -> YouTubeTrackInfo, or None for videos yt-dlp says can't be played
+_cache = TTLCache(max_size=settings.YT_CACHE_MAX_ENTRIES, default_ttl=settings.YT_CACHE_DEFAULT_TTL)
+_cache_dirty = False
+_MISSING = object()
+
+# (normalized query, max_results) -> search results
+_search_cache = TTLCache(max_size=settings.SEARCH_CACHE_MAX_ENTRIES, default_ttl=settings.SEARCH_CACHE_TTL)
+_search_refinement_hits = 0
+
+_TRACK_OPTS = {
+    "format": "bestaudio/best",
+    "quiet": True,
+    "no_warnings": True,
+    "extract_flat": True,
+}
+
+_SEARCH_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': True,  # Don't download, just get metadata
+}
+
+# Lists just the entries, without extracting each video
+_PLAYLIST_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': 'in_playlist',
+    'playlistend': settings.PLAYLIST_MAX_TRACKS,
+}
+
+# yt-dlp is blocking, so every extraction runs on this bounded pool
+_executor = ThreadPoolExecutor(max_workers=settings.YTDLP_WORKERS, thread_name_prefix="yt-dlp")
+
+# YoutubeDL isn't thread-safe, so each pool thread keeps its own warm instances
+_local = threading.local()
+
+# Concurrent requests for the same video/query share one extraction
+_track_flight = SingleFlight()
+_search_flight = SingleFlight()
+_playlist_flight = SingleFlight()
+
+
+def _get_ydl(opts: dict) -> yt_dlp.YoutubeDL:
+    """Returns the calling thread's reusable YoutubeDL for an option set."""
+    instances = getattr(_local, "instances", None)
+    if instances is None:
+        instances = _local.instances = {}
+    ydl = instances.get(id(opts))
+    if ydl is None:
+        ydl = instances[id(opts)] = yt_dlp.YoutubeDL(dict(opts))
+    return ydl
+
+
+_YTDLP_SECONDS = metrics.Histogram(
+    "ksunira_ytdlp_duration_seconds", "Time yt-dlp spends on a call, by operation", ("op",), metrics.SLOW_BUCKETS
+)
+_YTDLP_FAILURES = metrics.Counter(
+    "ksunira_ytdlp_failures_total", "yt-dlp calls that failed or timed out", ("op", "reason")
+)
+
+
+def _timed(op: str, func, *args):
+    with _YTDLP_SECONDS.time(op=op):
+        return func(*args)
+
+
+async def _run_in_pool(op: str, func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _timed, op, func, *args)
+
+
+def shutdown():
+    """Stops the extraction pool, dropping work that hasn't started yet."""
+    _executor.shutdown(wait=False, cancel_futures=True)
+
+
+def playback_url_expiry(playback_url: str) -> float | None:
+    """Returns the unix time a signed googlevideo URL stops working, if it says."""
+    match = re.search(r'[?&/]expire[=/](\d+)', playback_url)
+    return float(match.group(1)) if match else None
+
+
+def playback_url_expires_at(playback_url: str) -> datetime | None:
+    """playback_url_expiry() as a timestamp column value."""
+    expires_at = playback_url_expiry(playback_url)
+    return datetime.fromtimestamp(expires_at, timezone.utc) if expires_at is not None else None
+
+
+def _cache_track_info(video_id: str, track_info: YouTubeTrackInfo | None):
+    global _cache_dirty
+    if track_info is None:
+        ttl = settings.YT_NEGATIVE_TTL
+    else:
+        # Never serve a signed stream URL past its expire= timestamp
+        expires_at = playback_url_expiry(str(track_info.playback_url))
+        ttl = None
+        if expires_at is not None:
+            ttl = expires_at - settings.YT_CACHE_EXPIRY_MARGIN - time.time()
+    _cache.set(video_id, track_info, ttl)
+    _cache_dirty = True
+
+
+def cache_stats() -> dict:
+    return _cache.stats()
+
+
+def load_cache(path: str = settings.YT_CACHE_PATH):
+    """Restores the track info cache written by save_cache(), skipping expired entries."""
+    try:
+        with open(path) as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        logger.warning("Could not load YouTube cache from %s: %s", path, e)
+        return
+
+    now = time.time()
+    for entry in entries:
+        value = entry["value"]
+        track_info = YouTubeTrackInfo.model_validate(value) if value is not None else None
+        _cache.set(entry["key"], track_info, entry["expires_at"] - now)
+    logger.info("Loaded %d cached YouTube tracks", len(_cache))
+
+
+def _write_cache_file(path: str, entries: list[dict]):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(entries, f)
+    os.replace(tmp_path, path)
+
+
+async def save_cache(path: str = settings.YT_CACHE_PATH):
+    """Writes live cache entries to disk so a restart doesn't start cold."""
+    global _cache_dirty
+    entries = [
+        {
+            "key": key,
+            "expires_at": expires_at,
+            "value": value.model_dump(mode="json") if value is not None else None,
+        }
+        for key, expires_at, value in _cache.entries()
+    ]
+    # Cleared before the write so changes made while it runs mark it dirty again
+    _cache_dirty = False
+    try:
+        await asyncio.to_thread(_write_cache_file, path, entries)
+    except OSError as e:
+        _cache_dirty = True  # retried on the next save
+        logger.warning("Could not save YouTube cache to %s: %s", path, e)
+
+
+async def persist_cache_periodically():
+    """Background task: flushes the cache to disk whenever it has changed."""
+    while True:
+        await asyncio.sleep(settings.YT_CACHE_SAVE_INTERVAL)
+        if _cache_dirty:
+            await save_cache()
 
 
 def clean_youtube_url(url: str) -> str:
@@ -52,106 +224,266 @@ def extract_video_id(url: str) -> str | None:
         return match.group(1)
     return None
 
-def get_youtube_track_info(url: str) -> YouTubeTrackInfo | None:
-    """Uses yt-dlp to extract metadata and direct audio URL from a Youtube video."""
+def extract_playlist_id(url: str) -> str | None:
+    """Returns the list= ID of a playlist URL (clean_youtube_url strips it)."""
+    match = re.search(r'[?&]list=([0-9A-Za-z_-]+)', url)
+    return match.group(1) if match else None
+
+
+def _expand_playlist(playlist_id: str) -> list[str]:
+    """Blocking flat extraction of a playlist's video URLs. Runs on the pool."""
+    try:
+        info = _get_ydl(_PLAYLIST_OPTS).extract_info(
+            f"https://www.youtube.com/playlist?list={playlist_id}", download=False
+        )
+    except Exception as e:
+        logger.warning("Error expanding YouTube playlist %s: %s", playlist_id, e)
+        _YTDLP_FAILURES.inc(op="playlist", reason="error")
+        return []
+    return [
+        f"https://www.youtube.com/watch?v={entry['id']}"
+        for entry in info.get('entries') or []
+        if entry and entry.get('id')
+    ]
+
+
+async def expand_playlist(url: str) -> list[str]:
+    """Lists the video URLs of a playlist, up to PLAYLIST_MAX_TRACKS, without extracting them."""
+    playlist_id = extract_playlist_id(url)
+    if not playlist_id:
+        return []
+    try:
+        return await _playlist_flight.run(
+            playlist_id,
+            lambda: _run_in_pool("playlist", _expand_playlist, playlist_id),
+            timeout=settings.YTDLP_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        logger.warning("Timed out expanding YouTube playlist %s", playlist_id)
+        _YTDLP_FAILURES.inc(op="playlist", reason="timeout")
+        return []
+
+
+class _TransientError(Exception):
+    """An extraction that failed for reasons that may pass, e.g. a network error."""
+
+
+def _is_definitive(error: Exception) -> bool:
+    """Whether yt-dlp says the video itself can't be played: unavailable, private, blocked."""
+    if isinstance(error, yt_dlp.utils.DownloadError) and error.exc_info:
+        error = error.exc_info[1]
+    return isinstance(error, yt_dlp.utils.ExtractorError) and error.expected
+
+
+def _extract_track_info(url: str) -> YouTubeTrackInfo | None:
+    """
+    Blocking yt-dlp extraction of metadata and direct audio URL. Runs on the pool.
+    Returns None for videos that can't be played, and raises _TransientError for
+    failures worth retrying.
+    """
+    try:
+        info = _get_ydl(_TRACK_OPTS).extract_info(url, download=False)
+
+        # For DASH formats, the URL is in 'url', for others it's often in 'url' at the top level
+        playback_url = info.get("url")
+
+        if not playback_url:
+            # If the first pass didn't get the URL, try a more direct approach
+            formats = info.get("formats", [info])
+            best_audio = next((f for f in formats if f.get(
+                "acodec") != "none" and f.get("vcodec") == "none"), None)
+            if best_audio:
+                playback_url = best_audio.get("url")
+            else:
+                # Fallback for non-DASH streams or if best audio isn't obvious
+                playback_url = formats[0].get("url")
+
+        if not playback_url:
+            _YTDLP_FAILURES.inc(op="extract", reason="no_stream")
+            return None
+
+        return YouTubeTrackInfo(
+            title=info.get("title", "Unknown Title"),
+            duration=int(info.get("duration", 0)),
+            playback_url=str(playback_url) # Convert playback_url to string
+        )
+
+    except Exception as e:
+        logger.warning("Error fetching YouTube info for %s: %s", url, e)
+        if _is_definitive(e):
+            _YTDLP_FAILURES.inc(op="extract", reason="unavailable")
+            return None
+        _YTDLP_FAILURES.inc(op="extract", reason="error")
+        raise _TransientError(str(e)) from e
+
+
+def _lasts(track_info: YouTubeTrackInfo, min_ttl: float) -> bool:
+    """Whether a cached stream URL stays valid for min_ttl more seconds; unsigned ones don't say."""
+    expires_at = playback_url_expiry(str(track_info.playback_url))
+    return expires_at is not None and expires_at - time.time() >= min_ttl
+
+
+async def get_youtube_track_info(url: str, min_ttl: float = 0.0) -> YouTubeTrackInfo | None:
+    """
+    Extracts metadata and direct audio URL from a Youtube video without blocking the loop.
+    With min_ttl, a cached stream URL is only reused if it's good for that many more seconds.
+    """
     # Clean the URL first
     try:
         url = clean_youtube_url(url)
     except ValueError as e:
-        print(f"Invalid URL: {e}")
+        logger.warning("Invalid URL: %s", e)
         return None
     
     # Try to extract ID for cache lookup
     video_id = extract_video_id(url)
-    if video_id and video_id in _cache:
-        print(f"Cache hit for {video_id}")
-        return _cache[video_id]
-
-    ydl_opts = {
-        "format": "bestaudio/best",
-        "quiet": True,
-        "no_warnings": True,
-        "extract_flat": True,
-    }
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-
-            # For DASH formats, the URL is in 'url', for others it's often in 'url' at the top level
-            playback_url = info.get("url")
-
-            if not playback_url:
-                # If the first pass didn't get the URL, try a more direct approach
-                formats = info.get("formats", [info])
-                best_audio = next((f for f in formats if f.get(
-                    "acodec") != "none" and f.get("vcodec") == "none"), None)
-                if best_audio:
-                    playback_url = best_audio.get("url")
-                else:
-                    # Fallback for non-DASH streams or if best audio isn't obvious
-                    playback_url = formats[0].get("url")
-
-            if not playback_url:
-                return None
-            
-            # Use the ID from info if we couldn't extract it from URL (unlikely for valid URLs)
-            extracted_id = info.get("id") or video_id
-
-            track_info = YouTubeTrackInfo(
-                title=info.get("title", "Unknown Title"),
-                duration=int(info.get("duration", 0)),
-                playback_url=str(playback_url) # Convert playback_url to string
-            )
-            
-            # Cache the result using the ID
-            if extracted_id:
-                _cache[extracted_id] = track_info
-                
-            return track_info
+    if video_id:
+        cached = _cache.get(video_id, _MISSING)
+        if cached is not _MISSING and (cached is None or min_ttl <= 0 or _lasts(cached, min_ttl)):
+            logger.debug("Cache hit for %s", video_id)
+            return cached
 
-    except Exception as e:
-        print(f"Error fetching YouTube info: {e}")
+    async def fetch():
+        try:
+            track_info = await _run_in_pool("extract", _extract_track_info, url)
+        except _TransientError:
+            return None  # not cached, so the next request tries again
+        # Cache the result (or the video being unavailable) using the ID
+        if video_id:
+            _cache_track_info(video_id, track_info)
+        return track_info
+
+    try:
+        return await _track_flight.run(video_id or url, fetch, timeout=settings.YTDLP_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("Timed out fetching YouTube info for %s", url)
+        _YTDLP_FAILURES.inc(op="extract", reason="timeout")
         return None
 
 
-def search_youtube(query: str, max_results: int = 10) -> list[dict]:
-    """
-    Search YouTube for videos matching the query.
-    Returns a list of search results with metadata.
-    """
+def _search(query: str, max_results: int) -> list[dict]:
+    """Blocking ytsearch lookup. Runs on the pool."""
     try:
         # Use ytsearch prefix to search YouTube
         search_query = f"ytsearch{max_results}:{query}"
         
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': True,  # Don't download, just get metadata
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            result = ydl.extract_info(search_query, download=False)
-            
-            if not result or 'entries' not in result:
-                return []
+        result = _get_ydl(_SEARCH_OPTS).extract_info(search_query, download=False)
             
-            search_results = []
-            for entry in result['entries']:
-                if not entry:
-                    continue
-                    
-                search_results.append({
-                    'video_id': entry.get('id', ''),
-                    'title': entry.get('title', 'Unknown Title'),
-                    'duration': entry.get('duration', 0),
-                    'thumbnail_url': entry.get('thumbnail', ''),
-                    'channel': entry.get('channel', entry.get('uploader', 'Unknown')),
-                    'url': entry.get('url', f"https://youtube.com/watch?v={entry.get('id', '')}")
-                })
-            
-            return search_results
+        if not result or 'entries' not in result:
+            return []
+        
+        search_results = []
+        for entry in result['entries']:
+            if not entry:
+                continue
+                
+            search_results.append({
+                'video_id': entry.get('id', ''),
+                'title': entry.get('title', 'Unknown Title'),
+                'duration': entry.get('duration', 0),
+                'thumbnail_url': entry.get('thumbnail', ''),
+                'channel': entry.get('channel', entry.get('uploader', 'Unknown')),
+                'url': entry.get('url', f"https://youtube.com/watch?v={entry.get('id', '')}")
+            })
+        
+        return search_results
             
     except Exception as e:
-        print(f"Error searching YouTube: {e}")
+        logger.warning("Error searching YouTube for %r: %s", query, e)
+        _YTDLP_FAILURES.inc(op="search", reason="error")
         return []
 
+
+def normalize_query(query: str) -> str:
+    """Folds case, punctuation and whitespace so equivalent queries share a cache entry."""
+    query = re.sub(r'[^\w\s]|_', ' ', query.casefold())
+    return ' '.join(query.split())
+
+
+def _refine_cached_search(normalized: str, max_results: int) -> list[dict] | None:
+    """
+    Answers a query from the cached results of a shorter query it extends,
+    e.g. "daft punk aro" from "daft punk". Every word must appear in the result's
+    title or channel; the last word only as a prefix, since the user may still be typing.
+    """
+    words = normalized.split()
+    for end in range(len(normalized) - 1, 0, -1):
+        cached = _search_cache.peek((normalized[:end], max_results))
+        if cached is None:
+            continue
+
+        matches = []
+        for result in cached:
+            text_words = normalize_query(f"{result['title']} {result['channel']}").split()
+            if all(word in text_words for word in words[:-1]) and any(
+                    text_word.startswith(words[-1]) for text_word in text_words):
+                matches.append(result)
+
+        if len(matches) >= min(settings.SEARCH_REFINE_MIN_RESULTS, max_results):
+            return matches
+        # The longest cached prefix is the most specific; shorter ones won't match better
+        return None
+    return None
+
+
+def search_cache_stats() -> dict:
+    stats = _search_cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    stats["refinement_hits"] = _search_refinement_hits
+    stats["misses"] -= _search_refinement_hits
+    stats["hit_ratio"] = (stats["hits"] + _search_refinement_hits) / lookups if lookups else 0.0
+    return stats
+
+
+metrics.Gauge(
+    "ksunira_cache_hit_ratio", "Share of lookups answered from cache", ("cache",),
+    collect=lambda: [(("track_info",), cache_stats()["hit_ratio"]), (("search",), search_cache_stats()["hit_ratio"])],
+)
+
+
+def _cache_lookups() -> list[tuple[tuple[str, str], int]]:
+    track, search = cache_stats(), search_cache_stats()
+    return [
+        (("track_info", "hit"), track["hits"]),
+        (("track_info", "miss"), track["misses"]),
+        (("search", "hit"), search["hits"] + search["refinement_hits"]),
+        (("search", "miss"), search["misses"]),
+    ]
+
+
+metrics.Counter("ksunira_cache_lookups_total", "Cache lookups by outcome", ("cache", "result"), collect=_cache_lookups)
+
+
+async def search_youtube(query: str, max_results: int = 10) -> list[dict]:
+    """
+    Search YouTube for videos matching the query.
+    Returns a list of search results with metadata.
+    """
+    global _search_refinement_hits
+    normalized = normalize_query(query)
+    if not normalized:
+        return []
+
+    key = (normalized, max_results)
+    cached = _search_cache.get(key)
+    if cached is not None:
+        return cached
+
+    refined = _refine_cached_search(normalized, max_results)
+    if refined is not None:
+        _search_refinement_hits += 1
+        return refined
+
+    async def fetch():
+        results = await _run_in_pool("search", _search, query.strip(), max_results)
+        # Empty results usually mean the search failed; don't pin that in the cache
+        if results:
+            _search_cache.set(key, results)
+        return results
+
+    try:
+        return await _search_flight.run(key, fetch, timeout=settings.YTDLP_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("Timed out searching YouTube for %r", query)
+        _YTDLP_FAILURES.inc(op="search", reason="timeout")
+        return []
@@ -0,0 +1,77 @@
+"""
+The ksunira.msgpack encoding against the reference msgpack decoder, and the
+server's KEYS table against the client's copy in frontend/lib/wire.ts.
+"""
+import json
+import re
+import uuid
+from pathlib import Path
+
+import msgpack
+import pytest
+
+from core import wire
+from scripts.bench_ws_encoding import _traffic
+
+CLIENT_WIRE = Path(__file__).resolve().parents[2] / "frontend" / "lib" / "wire.ts"
+
+MESSAGES = _traffic()
+
+
+def _without_urls(obj):
+    """The message as encode() sends it: stream URLs blanked."""
+    if isinstance(obj, dict):
+        return {key: "" if key == "playback_url" else _without_urls(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_without_urls(value) for value in obj]
+    return obj
+
+
+def _reference_decode(obj, key=None):
+    """Undoes interning on a frame decoded by the msgpack package alone."""
+    if isinstance(obj, dict):
+        decoded = {}
+        for code, value in obj.items():
+            name = wire.KEYS[code] if isinstance(code, int) else code
+            decoded[name] = _reference_decode(value, name)
+        return decoded
+    if isinstance(obj, list):
+        return [_reference_decode(value, key) for value in obj]
+    if isinstance(obj, bytes):
+        assert key in wire.UUID_KEYS
+        return str(uuid.UUID(bytes=obj))
+    return obj
+
+
+def test_client_keys_match_server():
+    source = CLIENT_WIRE.read_text()
+    table = re.search(r"const KEYS = \[(.*?)\];", source, re.S).group(1)
+    assert tuple(re.findall(r"'([^']*)'", table)) == wire.KEYS
+
+
+@pytest.mark.parametrize("message", [message for _, message in MESSAGES], ids=[label for label, _ in MESSAGES])
+def test_round_trip(message):
+    frame = wire.encode(wire.PROTOCOL_MSGPACK, json.dumps(message))
+    expected = _without_urls(message)
+    assert wire.unpack(frame) == expected
+    assert _reference_decode(msgpack.unpackb(frame, strict_map_key=False)) == expected
+
+
+def test_keys_and_uuids_are_interned():
+    _, message = next((label, message) for label, message in MESSAGES if label == "queue_delta removed")
+    raw = msgpack.unpackb(wire.encode(wire.PROTOCOL_MSGPACK, json.dumps(message)), strict_map_key=False)
+    payload = raw[wire.KEYS.index("payload")]
+    assert raw[wire.KEYS.index("type")] == "queue_delta"
+    assert payload[wire.KEYS.index("id")] == uuid.UUID(message["payload"]["id"]).bytes
+
+
+def test_json_frames_pass_through():
+    frame = json.dumps(MESSAGES[0][1])
+    assert wire.encode(wire.PROTOCOL_JSON, frame) == frame
+    assert wire.encode(None, frame) == frame
+
+
+def test_negotiate():
+    assert wire.negotiate(["other", wire.PROTOCOL_MSGPACK]) == wire.PROTOCOL_MSGPACK
+    assert wire.negotiate([wire.PROTOCOL_MSGPACK], allow_msgpack=False) is None
+    assert wire.negotiate([]) is None
@@ -2,7 +2,7 @@
 
 import { useEffect, useState, useCallback, useRef } from 'react';
 import { useParams } from 'next/navigation';
-import { addTrackToQueue, getQueue, popQueue, uploadTrack, searchYouTube, YouTubeSearchResult, joinSession, type QueueItem, API_BASE_URL } from '@/lib/api';
+import { addTrackToQueue, getQueue, popQueue, uploadTrack, searchYouTube, YouTubeSearchResult, joinSession, applyQueueDelta, deltaBaseVersion, type QueueItem, type QueueDelta, API_BASE_URL } from '@/lib/api';
 import toast from 'react-hot-toast';
 import Queue from '@/components/Queue';
 import Player from '@/components/Player';
@@ -255,6 +255,8 @@ export default function HostPage() {
   const sessionId = params?.sessionId as string;
 
   const [queue, setQueue] = useState<QueueItem[]>([]);
+  // Version of the queue we hold; deltas must follow it without gaps
+  const queueVersionRef = useRef(0);
   
   // User state
   const [userId, setUserId] = useState<string | null>(null);
@@ -276,7 +278,9 @@ export default function HostPage() {
   // Fetch initial queue
   useEffect(() => {
     getQueue(sessionId, userId)
-      .then(data => {
+      .then(snapshot => {
+        const data = snapshot.items;
+        queueVersionRef.current = snapshot.version;
         setQueue(data);
         // If queue has items and nothing is playing, start the first one
         if (data.length > 0 && !currentTrack) {
@@ -309,12 +313,20 @@ export default function HostPage() {
   // Handle WS messages
   useEffect(() => {
     const handleMessage = (message: any) => {
-      if (message.type === 'queue_update') {
-        getQueue(sessionId, userId).then(data => {
-          setQueue(data);
-          // We no longer auto-set currentTrack from queue update
-          // because handleNextTrack sets it explicitly from the pop response.
-        });
+      if (message.type === 'queue_delta') {
+        const delta: QueueDelta = message.payload;
+        // We no longer auto-set currentTrack from queue update
+        // because handleNextTrack sets it explicitly from the pop response.
+        if (deltaBaseVersion(delta) === queueVersionRef.current) {
+          queueVersionRef.current = delta.version;
+          setQueue(prev => applyQueueDelta(prev, delta));
+        } else if (delta.version > queueVersionRef.current) {
+          // We missed a delta; resync from a snapshot
+          getQueue(sessionId, userId).then(snapshot => {
+            queueVersionRef.current = snapshot.version;
+            setQueue(snapshot.items);
+          });
+        }
       } else if (message.type === 'skip') {
         console.log("Received skip message");
         handleNextTrack();
@@ -362,6 +374,11 @@ export default function HostPage() {
     }
   }, [currentTrack, sendMessage]);
 
+  // Deltas only carry shared vote counts, so our own vote comes from the vote response
+  const updateUserVote = (voted: QueueItem) => {
+    setQueue(prev => prev.map(item => item.id === voted.id ? { ...item, user_vote: voted.user_vote } : item));
+  };
+
   const isPoppingRef = useRef(false);
 
   const handleNextTrack = useCallback(async () => {
@@ -567,7 +584,7 @@ export default function HostPage() {
       <AddTrackForm sessionId={sessionId} userId={userId} theme="purple" />
 
       <h2 className="text-2xl font-semibold mb-4 border-b border-gray-700 pb-2">Up Next</h2>
-      <Queue items={queue} sessionId={sessionId} userId={userId} theme="purple" />
+      <Queue items={queue} sessionId={sessionId} userId={userId} onVote={updateUserVote} theme="purple" />
       </div>
     </main>
   );
@@ -2,7 +2,7 @@
 
 import { useEffect, useState, useCallback, useRef } from 'react';
 import { useParams } from 'next/navigation';
-import { addTrackToQueue, getQueue, uploadTrack, searchYouTube, YouTubeSearchResult, joinSession, type QueueItem, API_BASE_URL } from '@/lib/api';
+import { addTrackToQueue, getQueue, uploadTrack, searchYouTube, YouTubeSearchResult, joinSession, applyQueueDelta, deltaBaseVersion, type QueueItem, type QueueDelta, API_BASE_URL } from '@/lib/api';
 import toast from 'react-hot-toast';
 import Queue from '@/components/Queue';
 
@@ -253,6 +253,8 @@ export default function GuestPage() {
   const sessionId = params?.sessionId as string;
 
   const [queue, setQueue] = useState<QueueItem[]>([]);
+  // Version of the queue we hold; deltas must follow it without gaps
+  const queueVersionRef = useRef(0);
   
   // User state
   const [userId, setUserId] = useState<string | null>(null);
@@ -325,7 +327,9 @@ export default function GuestPage() {
   useEffect(() => {
     if (!sessionId) return;
     getQueue(sessionId, userId)
-      .then(data => {
+      .then(snapshot => {
+        const data = snapshot.items;
+        queueVersionRef.current = snapshot.version;
         setQueue(data);
         if (data.length > 0 && !currentTrack) {
            // We don't auto-play on guest, just show info
@@ -338,14 +342,18 @@ export default function GuestPage() {
   useEffect(() => {
     const handleMessage = (message: any) => {
       
-      if (message.type === 'queue_update') {
-        getQueue(sessionId, userId).then(data => {
-          setQueue(data);
-          // If queue is empty and we are not playing, clear the player
-          if (data.length === 0 && !isPlaying) {
-             setCurrentTrack(null);
-          }
-        });
+      if (message.type === 'queue_delta') {
+        const delta: QueueDelta = message.payload;
+        if (deltaBaseVersion(delta) === queueVersionRef.current) {
+          queueVersionRef.current = delta.version;
+          setQueue(prev => applyQueueDelta(prev, delta));
+        } else if (delta.version > queueVersionRef.current) {
+          // We missed a delta; resync from a snapshot
+          getQueue(sessionId, userId).then(snapshot => {
+            queueVersionRef.current = snapshot.version;
+            setQueue(snapshot.items);
+          });
+        }
       } else if (message.type === 'track_started') {
         // Host started a new track
         const { track_id, title, duration: trackDuration } = message.payload;
@@ -443,6 +451,18 @@ export default function GuestPage() {
     return addMessageHandler(handleMessage);
   }, [sessionId, addMessageHandler, currentTrack, duration, userId, isPlaying]); // Added isPlaying to dependencies
 
+  // If queue is empty and we are not playing, clear the player
+  useEffect(() => {
+    if (queue.length === 0 && !isPlaying) {
+      setCurrentTrack(null);
+    }
+  }, [queue]);
+
+  // Deltas only carry shared vote counts, so our own vote comes from the vote response
+  const updateUserVote = (voted: QueueItem) => {
+    setQueue(prev => prev.map(item => item.id === voted.id ? { ...item, user_vote: voted.user_vote } : item));
+  };
+
   // Request initial state from host when connected
   useEffect(() => {
     if (isConnected) {
@@ -560,7 +580,7 @@ export default function GuestPage() {
       <AddTrackForm sessionId={sessionId} userId={userId} theme="blue" />
 
       <h2 className="text-2xl font-semibold mb-4 border-b border-gray-700 pb-2">Up Next</h2>
-      <Queue items={queue} sessionId={sessionId} userId={userId} theme="blue" />
+      <Queue items={queue} sessionId={sessionId} userId={userId} onVote={updateUserVote} theme="blue" />
       </div>
     </main>
   );
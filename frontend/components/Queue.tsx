@@ -7,7 +7,7 @@ interface QueueProps {
   items: QueueItem[];
   sessionId: string;
   userId: string | null;
-  onVote?: () => void;
+  onVote?: (item: QueueItem) => void;
   theme?: 'purple' | 'blue';
 }
 
@@ -21,8 +21,8 @@ export default function Queue({ items, sessionId, userId, onVote, theme = 'purpl
     }
     setVotingTrack(trackId);
     try {
-      await voteTrack(sessionId, trackId, vote, userId);
-      if (onVote) onVote();
+      const updated = await voteTrack(sessionId, trackId, vote, userId);
+      if (onVote) onVote(updated);
     } catch (error) {
       console.error('Failed to vote:', error);
     } finally {
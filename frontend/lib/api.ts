@@ -125,14 +125,60 @@ export interface Track {
 
 export interface QueueItem {
   id: string;
-  position: number;
+  position: number; // insertion order; play order is votes desc, then position
   votes: number;
   user_vote?: number | null; // 1, -1, or null
   track: Track;
 }
 
+// A full copy of the queue as of a given queue version
+export interface QueueSnapshot {
+  items: QueueItem[];
+  version: number;
+}
+
+// Incremental queue changes broadcast as `queue_delta` messages.
+// Each delta bumps the queue version by exactly one, except `added_many`,
+// which takes it from `since` to `version` in one go.
+export type QueueDelta =
+  | { version: number; op: 'added'; item: QueueItem }
+  | { version: number; since: number; op: 'added_many'; items: QueueItem[] }
+  | { version: number; op: 'votes'; id: string; votes: number }
+  | { version: number; op: 'removed'; id: string }
+  | { version: number; op: 'updated'; id: string; track: Track };
+
+// The queue version a delta applies on top of
+export function deltaBaseVersion(delta: QueueDelta): number {
+  return delta.op === 'added_many' ? delta.since : delta.version - 1;
+}
+
+// Same order the server plays in: most votes first, then oldest first
+function sortQueue(items: QueueItem[]): QueueItem[] {
+  return [...items].sort((a, b) => b.votes - a.votes || a.position - b.position);
+}
+
+// Applies a delta to a queue. Deltas are idempotent, so re-applying one
+// that a snapshot already reflects is harmless.
+export function applyQueueDelta(items: QueueItem[], delta: QueueDelta): QueueItem[] {
+  switch (delta.op) {
+    case 'added':
+      if (items.some(item => item.id === delta.item.id)) return items;
+      return sortQueue([...items, delta.item]);
+    case 'added_many': {
+      const known = new Set(items.map(item => item.id));
+      return sortQueue([...items, ...delta.items.filter(item => !known.has(item.id))]);
+    }
+    case 'votes':
+      return sortQueue(items.map(item => item.id === delta.id ? { ...item, votes: delta.votes } : item));
+    case 'removed':
+      return items.filter(item => item.id !== delta.id);
+    case 'updated':
+      return items.map(item => item.id === delta.id ? { ...item, track: delta.track } : item);
+  }
+}
+
 // Function to fetch the current queue
-export async function getQueue(sessionId: string, userId?: string | null): Promise<QueueItem[]> {
+export async function getQueue(sessionId: string, userId?: string | null): Promise<QueueSnapshot> {
   const url = new URL(`${API_BASE_URL}/api/sessions/${sessionId}/queue`);
   if (userId) {
     url.searchParams.append('user_id', userId);
@@ -141,8 +187,7 @@ export async function getQueue(sessionId: string, userId?: string | null): Promi
   if (!response.ok) {
     throw new Error('Failed to fetch queue');
   }
-  const data = await response.json();
-  return data.items;
+  return response.json();
 }
 
 // Function to add a new track
@@ -1,4 +1,5 @@
 import { useEffect, useRef, useState, useCallback } from 'react';
+import { PROTOCOL_JSON, PROTOCOL_MSGPACK, unpack } from './wire';
 
 type MessageHandler = (message: any) => void;
 
@@ -10,7 +11,9 @@ export function useWebSocket(url: string | null) {
   useEffect(() => {
     if (!url) return;
 
-    const ws = new WebSocket(url);
+    // The server picks the first it speaks; we always send JSON text either way
+    const ws = new WebSocket(url, [PROTOCOL_MSGPACK, PROTOCOL_JSON]);
+    ws.binaryType = 'arraybuffer';
     wsRef.current = ws;
 
     ws.onopen = () => {
@@ -20,7 +23,7 @@ export function useWebSocket(url: string | null) {
 
     ws.onmessage = (event) => {
       try {
-        const message = JSON.parse(event.data);
+        const message = typeof event.data === 'string' ? JSON.parse(event.data) : unpack(event.data);
         handlersRef.current.forEach(handler => handler(message));
       } catch (e) {
         console.error("Failed to parse WS message", e);
@@ -0,0 +1,91 @@
+// Decoder for the ksunira.msgpack WebSocket subprotocol (see backend/core/wire.py).
+// Map keys may be indexes into KEYS, and 16-byte bin values are UUIDs.
+
+export const PROTOCOL_MSGPACK = 'ksunira.msgpack';
+export const PROTOCOL_JSON = 'ksunira.json';
+
+// Must match KEYS on the server, in the same order; backend/tests/test_wire.py checks it
+const KEYS = [
+  'type', 'payload', 'version', 'op', 'id', 'item', 'items', 'since', 'votes',
+  'user_vote', 'track', 'title', 'duration', 'source_type', 'playback_url', 'added_by',
+  'canonical_id', 'position', 'session_id', 'created_at', 'track_id', 'currentTrack',
+  'currentTime', 'isPlaying', 'volume', 'time',
+];
+
+const textDecoder = new TextDecoder();
+
+function formatUuid(bytes: Uint8Array): string {
+  const hex = Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+  return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`;
+}
+
+export function unpack(buffer: ArrayBuffer): any {
+  const view = new DataView(buffer);
+  const bytes = new Uint8Array(buffer);
+  let offset = 0;
+
+  const str = (size: number) => {
+    const value = textDecoder.decode(bytes.subarray(offset, offset + size));
+    offset += size;
+    return value;
+  };
+  const bin = (size: number) => {
+    const value = bytes.subarray(offset, offset + size);
+    offset += size;
+    return size === 16 ? formatUuid(value) : value;
+  };
+  const array = (size: number) => {
+    const values = [];
+    for (let i = 0; i < size; i++) values.push(read());
+    return values;
+  };
+  const map = (size: number) => {
+    const result: Record<string, any> = {};
+    for (let i = 0; i < size; i++) {
+      const key = read();
+      result[typeof key === 'number' ? KEYS[key] : key] = read();
+    }
+    return result;
+  };
+  const fixed = (size: number, value: number | bigint) => {
+    offset += size;
+    return Number(value);
+  };
+
+  function read(): any {
+    const byte = bytes[offset++];
+    if (byte < 0x80) return byte;
+    if (byte >= 0xe0) return byte - 0x100;
+    if (byte < 0x90) return map(byte & 0x0f);
+    if (byte < 0xa0) return array(byte & 0x0f);
+    if (byte < 0xc0) return str(byte & 0x1f);
+    switch (byte) {
+      case 0xc0: return null;
+      case 0xc2: return false;
+      case 0xc3: return true;
+      case 0xc4: return bin(bytes[offset++]);
+      case 0xc5: return bin(fixed(2, view.getUint16(offset)));
+      case 0xc6: return bin(fixed(4, view.getUint32(offset)));
+      case 0xca: return fixed(4, view.getFloat32(offset));
+      case 0xcb: return fixed(8, view.getFloat64(offset));
+      case 0xcc: return fixed(1, view.getUint8(offset));
+      case 0xcd: return fixed(2, view.getUint16(offset));
+      case 0xce: return fixed(4, view.getUint32(offset));
+      case 0xcf: return fixed(8, view.getBigUint64(offset));
+      case 0xd0: return fixed(1, view.getInt8(offset));
+      case 0xd1: return fixed(2, view.getInt16(offset));
+      case 0xd2: return fixed(4, view.getInt32(offset));
+      case 0xd3: return fixed(8, view.getBigInt64(offset));
+      case 0xd9: return str(bytes[offset++]);
+      case 0xda: return str(fixed(2, view.getUint16(offset)));
+      case 0xdb: return str(fixed(4, view.getUint32(offset)));
+      case 0xdc: return array(fixed(2, view.getUint16(offset)));
+      case 0xdd: return array(fixed(4, view.getUint32(offset)));
+      case 0xde: return map(fixed(2, view.getUint16(offset)));
+      case 0xdf: return map(fixed(4, view.getUint32(offset)));
+    }
+    throw new Error(`Unsupported MessagePack type 0x${byte.toString(16)}`);
+  }
+
+  return read();
+}